@@ -0,0 +1,321 @@
+import os
+
+import numpy as np
+import pandas as pd
+from chat_history import count_tokens
+from intraday import INTRADAY_ANOMALY_GUIDANCE
+from langchain_core.documents import Document
+from store import DEFAULT_METER
+from utils import ANOMALY_GUIDANCE, PROLONGED_ANOMALY_GUIDANCE, weather_window_stats
+
+# groupings of the anomalies outside the top k, from finest to coarsest
+GROUP_FREQUENCIES = {"M": "month", "Q": "quarter", "Y": "year"}
+
+
+def anomaly_table(profile, anomalies, prolonged_anomalies, intraday_outliers=None, half_life_days=90):
+    """
+    Severity, recency and weather of every daily, prolonged and intraday anomaly.
+
+    The severity of a daily or prolonged anomaly is the sum of the daily usage z-scores over its days, so
+    longer and larger anomalies are more severe. The severity of an intraday outlier is the largest robust
+    z-score of its slots against their baseline, (usage - baseline) / (1.4826 * MAD), as it barely moves
+    the daily total. Anomalies are ranked by their severity weighted by recency, which halves every
+    half_life_days before the last day of the data. The sums are taken from prefix sums over the anomaly
+    bounds, as in weather_window_stats, so the cost does not grow with a loop over the anomalies.
+
+    Parameters:
+    profile (DailyProfile): Daily usage and weather of the customer.
+    anomalies (list): List of dates with energy usage anomalies.
+    prolonged_anomalies (list): List of tuples with start and end dates of prolonged anomalies.
+    intraday_outliers (pd.DataFrame): The intraday.intraday_outliers, or None.
+    half_life_days (float): Age in days at which the rank of an anomaly is halved.
+
+    Returns:
+    pd.DataFrame: One row per anomaly, highest ranked first, with the columns kind ("daily", "prolonged"
+        or "intraday"), start, end, days, usage, mean_zscore (the robust z-score for intraday outliers),
+        severity, mean_temperature (NaN without weather) and rank_score. Intraday outliers keep the times
+        of their first and last slots, and days counts the days they touch.
+    """
+    anomalies = [] if anomalies is None else list(anomalies)
+    prolonged_anomalies = [] if prolonged_anomalies is None else list(prolonged_anomalies)
+    if intraday_outliers is None:
+        intraday_outliers = pd.DataFrame(columns=["start", "end", "usage", "max_zscore"])
+    intraday_starts = pd.DatetimeIndex(intraday_outliers["start"])
+    intraday_ends = pd.DatetimeIndex(intraday_outliers["end"])
+    starts = pd.DatetimeIndex(anomalies + [start for start, _ in prolonged_anomalies])
+    ends = pd.DatetimeIndex(anomalies + [end for _, end in prolonged_anomalies])
+    n_windows = len(starts)
+
+    # intraday outliers are placed on the days they touch, the end of their last slot is exclusive
+    first_days = starts.append(intraday_starts.floor("D"))
+    last_days = ends.append((intraday_ends - pd.Timedelta(1, unit="ns")).floor("D"))
+    days = profile.usage.index
+    first = days.searchsorted(first_days, side="left")
+    last = np.maximum(days.searchsorted(last_days, side="right"), first)
+
+    def window_sums(values):
+        prefix = np.concatenate(([0.0], np.cumsum(np.nan_to_num(values))))
+        return (prefix[last] - prefix[first])[:n_windows]
+
+    n_days = last - first
+    zscore_sums = window_sums(profile.usage["zscore"].to_numpy(dtype=float))
+    intraday_zscores = intraday_outliers["max_zscore"].to_numpy(dtype=float)
+    severity = np.concatenate((zscore_sums, intraday_zscores))
+    if profile.weather is not None:
+        temperature = weather_window_stats(profile, first_days, last_days)["mean_temperature"].to_numpy()
+    else:
+        temperature = np.full(len(first_days), np.nan)
+    age_days = (days[-1] - last_days).days.to_numpy() if len(days) else np.zeros(len(first_days))
+
+    table = pd.DataFrame(
+        {
+            "kind": ["daily"] * len(anomalies)
+            + ["prolonged"] * len(prolonged_anomalies)
+            + ["intraday"] * len(intraday_outliers),
+            "start": starts.append(intraday_starts),
+            "end": ends.append(intraday_ends),
+            "days": n_days,
+            "usage": np.concatenate(
+                (
+                    window_sums(profile.usage["usage"].to_numpy(dtype=float)),
+                    intraday_outliers["usage"].to_numpy(dtype=float),
+                )
+            ),
+            "mean_zscore": np.concatenate(
+                (zscore_sums / np.maximum(n_days[:n_windows], 1), intraday_zscores)
+            ),
+            "severity": severity,
+            "mean_temperature": temperature,
+            "rank_score": severity * 0.5 ** (np.maximum(age_days, 0) / half_life_days),
+        }
+    )
+    return table.sort_values("rank_score", ascending=False, kind="stable").reset_index(drop=True)
+
+
+def describe_anomalies(table):
+    """One line description of each anomaly of an anomaly_table, in the order of the table."""
+    descriptions = []
+    for kind, start, end, days, usage, zscore, temperature in zip(
+        table["kind"],
+        table["start"],
+        table["end"],
+        table["days"],
+        table["usage"],
+        table["mean_zscore"],
+        table["mean_temperature"],
+        strict=True,
+    ):
+        if kind == "daily":
+            text = f"[{start:%Y-%m-%d}: z-score {zscore:.2f}, usage {usage:.1f}"
+        elif kind == "intraday":
+            text = (
+                f"[{start:%Y-%m-%d %H:%M} - {end:%H:%M} (intraday): "
+                f"robust z-score {zscore:.2f}, usage {usage:.1f}"
+            )
+        else:
+            text = (
+                f"[{start:%Y-%m-%d} - {end:%Y-%m-%d} (prolonged, {days} days): "
+                f"mean z-score {zscore:.2f}, usage {usage:.1f}"
+            )
+        if not np.isnan(temperature):
+            text += f", {temperature:.2f} °C"
+        descriptions.append(text + "]")
+    return descriptions
+
+
+def _group_summaries(table, freq, max_groups=None):
+    """
+    Counts, largest z-score and mean temperature of the anomalies in each period, with all but the latest
+    max_groups - 1 periods summarized together. The robust z-scores of intraday outliers are on another
+    scale, so they are only counted.
+    """
+    table = table.sort_values("start", kind="stable")
+    daily = (table["kind"] == "daily").to_numpy()
+    prolonged = (table["kind"] == "prolonged").to_numpy()
+    intraday = (table["kind"] == "intraday").to_numpy()
+    periods = table["start"].dt.to_period(freq)
+    temperature = table["mean_temperature"].to_numpy()
+
+    # consecutive anomaly days in the same period are counted as one run
+    starts = table["start"].to_numpy()[daily]
+    new_run = np.ones(len(starts), dtype=bool)
+    new_run[1:] = (np.diff(starts) != np.timedelta64(1, "D")) | (
+        periods.to_numpy()[daily][1:] != periods.to_numpy()[daily][:-1]
+    )
+    runs = np.zeros(len(table), dtype=int)
+    runs[daily] = new_run
+
+    groups = (
+        pd.DataFrame(
+            {
+                "period": periods.astype(str).to_numpy(),
+                "daily": daily.astype(int),
+                "runs": runs,
+                "prolonged": prolonged.astype(int),
+                "prolonged_days": np.where(prolonged, table["days"], 0),
+                "intraday": intraday.astype(int),
+                "max_zscore": np.where(intraday, np.nan, table["mean_zscore"].to_numpy(dtype=float)),
+                "temperature_sum": np.nan_to_num(temperature),
+                "temperature_count": np.isfinite(temperature).astype(int),
+            }
+        )
+        .groupby("period", sort=True)
+        .agg(
+            {
+                "daily": "sum",
+                "runs": "sum",
+                "prolonged": "sum",
+                "prolonged_days": "sum",
+                "intraday": "sum",
+                "max_zscore": "max",
+                "temperature_sum": "sum",
+                "temperature_count": "sum",
+            }
+        )
+    )
+    if max_groups is not None and len(groups) > max_groups:
+        older = groups.iloc[: len(groups) - max_groups + 1]
+        merged = older.agg({column: "max" if column == "max_zscore" else "sum" for column in groups})
+        merged.name = f"{older.index[0]} to {older.index[-1]}"
+        groups = pd.concat([merged.to_frame().T, groups.iloc[len(older) :]])
+
+    summaries = []
+    for period, group in zip(groups.index, groups.itertuples(index=False), strict=True):
+        parts = []
+        if group.daily:
+            runs = f" in {group.runs:.0f} runs of days" if group.runs < group.daily else ""
+            parts.append(f"{group.daily:.0f} daily{runs}")
+        if group.prolonged:
+            parts.append(f"{group.prolonged:.0f} prolonged over {group.prolonged_days:.0f} days")
+        if group.intraday:
+            parts.append(f"{group.intraday:.0f} intraday")
+        summary = f"[{period}: {' and '.join(parts)}"
+        if not np.isnan(group.max_zscore):
+            summary += f", max z-score {group.max_zscore:.2f}"
+        if group.temperature_count:
+            summary += f", mean temperature {group.temperature_sum / group.temperature_count:.2f} °C"
+        summaries.append(summary + "]")
+    return summaries
+
+
+def _recurrence(table, min_anomalies=5):
+    """The most common weekday and month of the daily anomalies, if there are enough to tell."""
+    daily = table.loc[table["kind"] == "daily", "start"]
+    if len(daily) < min_anomalies:
+        return ""
+    weekdays = daily.dt.day_name().value_counts(normalize=True)
+    months = daily.dt.month_name().value_counts(normalize=True)
+    return (
+        f"The daily anomalies are most common on {weekdays.index[0]}s ({weekdays.iloc[0]:.0%}) "
+        f"and in {months.index[0]} ({months.iloc[0]:.0%}). "
+    )
+
+
+def _compact_text(table, top_k, freq, max_groups, average_temperature_str):
+    top, rest = table.iloc[:top_k], table.iloc[top_k:]
+    kinds = table["kind"].value_counts()
+    intraday = f" and {kinds['intraday']} intraday anomalies" if kinds.get("intraday", 0) else ""
+    text = (
+        f"Anomalies have been detected in the customer's energy usage: {kinds.get('daily', 0)} daily "
+        f"anomalies, {kinds.get('prolonged', 0)} prolonged anomalies{intraday} between "
+        f"{table['start'].min():%Y-%m-%d} and {table['end'].max():%Y-%m-%d}. "
+    )
+    if len(top):
+        text += (
+            f"The {len(top)} most severe and recent anomalies, with their z-score, usage and temperature, "
+            f"are: {', '.join(describe_anomalies(top))}. "
+        )
+    if len(rest):
+        summaries = _group_summaries(rest, freq, max_groups)
+        text += f"The other anomalies by {GROUP_FREQUENCIES[freq]}: {', '.join(summaries)}. "
+    text += _recurrence(table)
+    if kinds.get("prolonged", 0):
+        text += f"Prolonged anomalies are marked as prolonged. {PROLONGED_ANOMALY_GUIDANCE} "
+    if kinds.get("intraday", 0):
+        text += f"Intraday anomalies are marked as intraday. {INTRADAY_ANOMALY_GUIDANCE} "
+    text += (
+        "The full table of anomalies is provided in the retrieved context when the user asks about "
+        f"specific dates. {ANOMALY_GUIDANCE} {average_temperature_str}."
+    )
+    return text
+
+
+def compact_anomaly_text(anomaly_text, table, average_temperature_str, max_tokens=None, top_k=10):
+    """
+    The anomaly description for the system prompt, within a token budget.
+
+    The full description from generate_anomaly_text is kept when it fits. Otherwise only the top_k highest
+    ranked anomalies of the table are described in full, and the others are counted by month, or by
+    quarter or year if that does not fit either, with the most common weekday and month of the daily
+    anomalies. If the years do not fit, the older years are counted together, and finally top_k is halved
+    until the description fits. The prompt is resent on every call, so this keeps the size and latency of
+    each call flat however long the customer's history is.
+
+    Parameters:
+    anomaly_text (str): Full description of the anomalies, from generate_anomaly_text.
+    table (pd.DataFrame): The anomaly_table.
+    average_temperature_str (str): Description of the average temperature, from analyse_weather_data.
+    max_tokens (int): Token budget, defaults to the ANOMALY_CONTEXT_MAX_TOKENS environment variable or
+        600.
+    top_k (int): Number of anomalies described in full.
+
+    Returns:
+    str: The description of the anomalies.
+    """
+    max_tokens = max_tokens or int(os.getenv("ANOMALY_CONTEXT_MAX_TOKENS", "600"))
+    if count_tokens(anomaly_text) <= max_tokens or table.empty:
+        return anomaly_text
+
+    # coarser groups first, then fewer groups, then fewer anomalies in full
+    levels = [(top_k, freq, None) for freq in GROUP_FREQUENCIES]
+    levels += [(top_k, "Y", max_groups) for max_groups in (16, 8, 4, 2, 1)]
+    while top_k > 0:
+        top_k //= 2
+        levels.append((top_k, "Y", 1))
+    for k, freq, max_groups in levels:
+        text = _compact_text(table, k, freq, max_groups, average_temperature_str)
+        if count_tokens(text) <= max_tokens:
+            break
+    return text
+
+
+def anomaly_documents(table, customer_id=DEFAULT_METER, rows_per_document=10):
+    """
+    The anomaly table as documents for the retriever, so the details of any anomaly can be retrieved.
+
+    The anomalies of each month are described in date order, split into documents of at most
+    rows_per_document anomalies, with the same metadata as load_customer_documents.
+
+    Parameters:
+    table (pd.DataFrame): The anomaly_table.
+    customer_id (str): Customer of the anomalies, or None to leave the documents without a customer_id.
+    rows_per_document (int): Maximum number of anomalies per document.
+
+    Returns:
+    list: Documents with the metadata section ("anomaly_table"), record (month and part), datetime (first
+        day of the month) and customer_id (if given).
+    """
+    table = table.sort_values("start", kind="stable")
+    descriptions = describe_anomalies(table)
+    periods = table["start"].dt.to_period("M").to_numpy()
+    docs = []
+    # the table is sorted, so each month is a contiguous block of rows
+    bounds = np.flatnonzero(np.concatenate(([True], periods[1:] != periods[:-1], [True])))
+    for first, last in zip(bounds[:-1], bounds[1:], strict=True):
+        period = periods[first]
+        for part, offset in enumerate(range(first, last, rows_per_document)):
+            metadata = {
+                "section": "anomaly_table",
+                "record": f"{period}/{part}",
+                "datetime": period.start_time.isoformat(),
+            }
+            if customer_id is not None:
+                metadata["customer_id"] = str(customer_id)
+            docs.append(
+                Document(
+                    f"Energy usage anomalies detected in {period}: "
+                    + ", ".join(descriptions[offset : min(offset + rows_per_document, last)]),
+                    metadata=metadata,
+                )
+            )
+    return docs
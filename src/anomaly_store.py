@@ -0,0 +1,382 @@
+import os
+import sqlite3
+from contextlib import closing, contextmanager
+
+import numpy as np
+import pandas as pd
+from metrics import metrics
+from store import STORE_DIR
+from utils import prolonged_anomaly_windows
+
+ANOMALY_STORE_PATH = os.path.join(STORE_DIR, "anomalies.sqlite")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meters (
+    meter_id TEXT PRIMARY KEY,
+    parameters TEXT NOT NULL,
+    watermark TEXT NOT NULL,
+    n_days INTEGER NOT NULL,
+    usage_sum REAL NOT NULL,
+    usage_sum_squares REAL NOT NULL,
+    mean REAL NOT NULL,
+    std REAL NOT NULL,
+    prefix_end REAL,
+    running_min_end REAL
+);
+CREATE TABLE IF NOT EXISTS daily (
+    meter_id TEXT NOT NULL,
+    day TEXT NOT NULL,
+    usage REAL NOT NULL,
+    zscore REAL,
+    prefix REAL,
+    running_min REAL,
+    PRIMARY KEY (meter_id, day)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS daily_running_min ON daily (meter_id, running_min DESC, day);
+CREATE TABLE IF NOT EXISTS windows (
+    meter_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    start_day TEXT NOT NULL,
+    end_day TEXT NOT NULL,
+    is_open INTEGER NOT NULL,
+    PRIMARY KEY (meter_id, kind, start_day)
+) WITHOUT ROWID;
+"""
+
+DAY = pd.Timedelta(days=1)
+
+
+def last_complete_day(index):
+    """
+    The last day of a sorted datetime index whose readings are complete, or None.
+
+    The last day is complete when its last reading is the last one of the day at the usual interval
+    between readings, e.g. 23:45 for 15 minute readings, otherwise the day before it is.
+    """
+    if len(index) == 0:
+        return None
+    last = index[-1]
+    if len(index) > 1:
+        interval = index[-1000:].to_series().diff().median()
+    else:
+        interval = DAY
+    day = last.floor("D")
+    return day if last + interval >= day + DAY else day - DAY
+
+
+class AnomalyStore:
+    """
+    SQLite store of the daily usage, z-score statistics and detected anomalies of each meter.
+
+    The results are kept up to a watermark, the last complete day of readings, so a session reads them
+    instead of running the detectors. When readings are appended, only the days after the watermark are
+    aggregated and detected: their daily anomalies are added, and a prolonged anomaly window is found for
+    each new day from the stored prefix sums and their running minimum, with one indexed lookup for its
+    earliest start. The new windows are merged into the stored ones, extending a window that was still
+    open at the end of the data, or closing it.
+
+    The z-scores use the mean and standard deviation of the last full detection, so the stored days never
+    need to be rescored. Running sums track the current statistics, and once they have drifted by more
+    than zscore_tolerance at the detection thresholds, every day is detected again from the stored daily
+    usage, without reading the raw readings again. Right after a full detection the results are those of
+    detect_daily_anomalies and detect_prolonged_anomalies over the complete days.
+
+    Between full detections the stored anomalies can differ from those of the detectors over the same
+    days: days near a threshold may be in one and not the other, as their z-scores are off by up to the
+    tolerance. With zscore_tolerance=0 every append runs a full detection, from the stored daily usage,
+    and the results always match the detectors. The tolerance is part of the stored parameters, so
+    changing it detects every day again.
+
+    Parameters:
+    path (str): SQLite database file.
+    daily_zscore_threshold (float): Z-score threshold for daily anomalies.
+    min_consecutive_days (int): Minimum number of consecutive days to consider as a prolonged anomaly.
+    zscore_threshold (float): Z-score threshold for prolonged anomalies.
+    zscore_tolerance (float): Largest change of the z-scores at the thresholds before a full detection.
+    """
+
+    def __init__(
+        self,
+        path=ANOMALY_STORE_PATH,
+        daily_zscore_threshold=2,
+        min_consecutive_days=3,
+        zscore_threshold=1.5,
+        zscore_tolerance=0.05,
+    ):
+        self.path = path
+        self.daily_zscore_threshold = daily_zscore_threshold
+        self.min_consecutive_days = min_consecutive_days
+        self.zscore_threshold = zscore_threshold
+        self.zscore_tolerance = zscore_tolerance
+        self.parameters = (
+            f"{daily_zscore_threshold}/{min_consecutive_days}/{zscore_threshold}/{zscore_tolerance}"
+        )
+
+    @contextmanager
+    def _transaction(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with closing(sqlite3.connect(self.path, timeout=30, isolation_level=None)) as conn:
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+            # concurrent sessions updating the same meter are serialized by the write lock
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    @metrics.timed("stored_anomalies")
+    def anomalies(self, meter_id, df=None):
+        """
+        The anomalies of a meter, brought up to date with its readings first if they are given.
+
+        Parameters:
+        meter_id (str): Meter of the readings.
+        df (pd.DataFrame): Readings of the meter with a datetime index and a "usage" column, e.g. from
+            load_smart_meter_data.
+
+        Returns:
+        tuple: The dates of the daily anomalies (or None) and the list of (start, end) dates of the
+            prolonged anomalies (or None), as returned by the detectors.
+        """
+        meter_id = str(meter_id)
+        with self._transaction() as conn:
+            if df is not None:
+                self._update(conn, meter_id, df)
+            rows = conn.execute(
+                "SELECT kind, start_day, end_day FROM windows WHERE meter_id = ? ORDER BY kind, start_day",
+                (meter_id,),
+            ).fetchall()
+        daily = [pd.Timestamp(row["start_day"]) for row in rows if row["kind"] == "daily"]
+        prolonged = [
+            (pd.Timestamp(row["start_day"]), pd.Timestamp(row["end_day"]))
+            for row in rows
+            if row["kind"] == "prolonged"
+        ]
+        return (pd.DatetimeIndex(daily) if daily else None), (prolonged or None)
+
+    def watermark(self, meter_id):
+        """The last day of a meter included in the stored results, or None."""
+        with self._transaction() as conn:
+            row = conn.execute("SELECT watermark FROM meters WHERE meter_id = ?", (str(meter_id),)).fetchone()
+        return None if row is None else pd.Timestamp(row["watermark"])
+
+    def _update(self, conn, meter_id, df):
+        """Adds the complete days after the watermark, returning the number of days added."""
+        usage = df["usage"]
+        last_day = last_complete_day(usage.index)
+        if last_day is None:
+            return 0
+        state = conn.execute("SELECT * FROM meters WHERE meter_id = ?", (meter_id,)).fetchone()
+        if state is not None and state["parameters"] != self.parameters:
+            state = None
+
+        first_day = usage.index[0].floor("D") if state is None else pd.Timestamp(state["watermark"]) + DAY
+        if last_day < first_day:
+            return 0
+        # only the readings after the watermark are aggregated, gaps count as zero usage like resample
+        tail = usage.iloc[usage.index.searchsorted(first_day) : usage.index.searchsorted(last_day + DAY)]
+        days = pd.date_range(first_day, last_day, freq="D")
+        values = tail.astype(float).resample("D").sum().reindex(days, fill_value=0.0).to_numpy()
+
+        if state is None or self._drifted(state, values):
+            if state is not None:
+                stored = conn.execute(
+                    "SELECT usage FROM daily WHERE meter_id = ? ORDER BY day", (meter_id,)
+                ).fetchall()
+                days = pd.date_range(end=last_day, periods=len(stored) + len(values), freq="D")
+                values = np.concatenate(([row["usage"] for row in stored], values))
+            self._detect_all(conn, meter_id, days, values)
+        else:
+            self._append(conn, meter_id, state, days, values)
+        return len(days)
+
+    def _drifted(self, state, values):
+        """Whether the z-scores at the thresholds move by more than the tolerance with the new days."""
+        mean, std = _statistics(
+            state["n_days"] + len(values),
+            state["usage_sum"] + values.sum(),
+            state["usage_sum_squares"] + (values**2).sum(),
+        )
+        if not state["std"] > 0 or not std > 0:
+            return True
+        thresholds = np.array([self.daily_zscore_threshold, self.zscore_threshold])
+        moved = (state["mean"] + thresholds * state["std"] - mean) / std - thresholds
+        return np.abs(moved).max() > self.zscore_tolerance
+
+    def _detect_all(self, conn, meter_id, days, values):
+        """Scores and detects every day, replacing the stored days and anomalies of the meter."""
+        mean, std = values.mean(), values.std()
+        with np.errstate(invalid="ignore", divide="ignore"):
+            zscores = (values - mean) / std
+        prefix = np.concatenate(([0.0], np.cumsum(zscores - self.zscore_threshold)))
+        running_min = np.minimum.accumulate(prefix)
+
+        conn.execute("DELETE FROM daily WHERE meter_id = ?", (meter_id,))
+        conn.execute("DELETE FROM windows WHERE meter_id = ?", (meter_id,))
+        self._insert_days(conn, meter_id, days, values, zscores, prefix[:-1], running_min[:-1])
+        self._insert_daily_anomalies(conn, meter_id, days, zscores)
+        starts, ends = prolonged_anomaly_windows(zscores, self.min_consecutive_days, self.zscore_threshold)
+        self._insert_windows(conn, meter_id, days[starts], days[ends], days[-1])
+        conn.execute(
+            "INSERT OR REPLACE INTO meters VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                meter_id,
+                self.parameters,
+                days[-1].isoformat(),
+                len(values),
+                values.sum(),
+                (values**2).sum(),
+                mean,
+                std,
+                prefix[-1],
+                running_min[-1],
+            ),
+        )
+
+    def _append(self, conn, meter_id, state, days, values):
+        """Scores and detects the new days with the stored statistics, and merges the new windows."""
+        n_days, length = state["n_days"], self.min_consecutive_days
+        first_day = pd.Timestamp(state["watermark"]) - (n_days - 1) * DAY
+        zscores = (values - state["mean"]) / state["std"]
+
+        # prefix sums of the excess z-scores, and their running minimum, from position n_days on
+        excess = np.cumsum(zscores - self.zscore_threshold)
+        prefix = np.concatenate(([state["prefix_end"]], state["prefix_end"] + excess))
+        running_min = np.minimum.accumulate(np.concatenate(([state["running_min_end"]], prefix[1:])))
+        stored_min = conn.execute(
+            "SELECT running_min FROM daily WHERE meter_id = ? AND day = ?",
+            (meter_id, (first_day + (n_days - 1) * DAY).isoformat()),
+        ).fetchone()
+
+        def running_min_at(position):
+            if position >= n_days:
+                return running_min[position - n_days]
+            row = conn.execute(
+                "SELECT running_min FROM daily WHERE meter_id = ? AND day = ?",
+                (meter_id, (first_day + position * DAY).isoformat()),
+            ).fetchone()
+            return row["running_min"]
+
+        # the longest window ending on each new day starts at the earliest position with a running minimum
+        # below the prefix sum after that day, and the running minimum is non-increasing
+        intervals = []
+        for i, target in enumerate(prefix[1:]):
+            end = n_days + i
+            latest_start = end + 1 - length
+            if latest_start < 0 or not running_min_at(latest_start) < target:
+                continue
+            if stored_min is not None and stored_min["running_min"] < target:
+                row = conn.execute(
+                    "SELECT day FROM daily WHERE meter_id = ? AND running_min < ? "
+                    "ORDER BY running_min DESC, day LIMIT 1",
+                    (meter_id, target),
+                ).fetchone()
+                start = (pd.Timestamp(row["day"]) - first_day).days
+            else:
+                start = n_days + int(np.argmax(running_min < target))
+            intervals.append((start, end))
+
+        last_day = days[-1]
+        self._insert_days(conn, meter_id, days, values, zscores, prefix[:-1], running_min[:-1])
+        self._insert_daily_anomalies(conn, meter_id, days, zscores)
+        conn.execute(
+            "UPDATE windows SET is_open = 0 WHERE meter_id = ? AND is_open = 1 AND end_day < ?",
+            (meter_id, last_day.isoformat()),
+        )
+        if intervals:
+            # stored windows that overlap or touch the new ones are merged with them
+            low = min(start for start, _ in intervals)
+            touching = conn.execute(
+                "SELECT start_day, end_day FROM windows WHERE meter_id = ? AND kind = 'prolonged' "
+                "AND end_day >= ?",
+                (meter_id, (first_day + (low - 1) * DAY).isoformat()),
+            ).fetchall()
+            for row in touching:
+                start = (pd.Timestamp(row["start_day"]) - first_day).days
+                intervals.append((start, (pd.Timestamp(row["end_day"]) - first_day).days))
+            conn.execute(
+                "DELETE FROM windows WHERE meter_id = ? AND kind = 'prolonged' AND end_day >= ?",
+                (meter_id, (first_day + (low - 1) * DAY).isoformat()),
+            )
+            low = min(start for start, _ in intervals)
+            coverage = np.zeros(n_days + len(days) - low + 1, dtype=np.intp)
+            for start, end in intervals:
+                coverage[start - low] += 1
+                coverage[end - low + 1] -= 1
+            covered = np.cumsum(coverage[:-1]) > 0
+            edges = np.diff(np.concatenate(([0], covered.astype(np.int8), [0])))
+            starts = first_day + pd.to_timedelta(low + np.flatnonzero(edges == 1), unit="D")
+            ends = first_day + pd.to_timedelta(low + np.flatnonzero(edges == -1) - 1, unit="D")
+            self._insert_windows(conn, meter_id, starts, ends, last_day)
+
+        values_sum = state["usage_sum"] + values.sum()
+        squares_sum = state["usage_sum_squares"] + (values**2).sum()
+        conn.execute(
+            "UPDATE meters SET watermark = ?, n_days = ?, usage_sum = ?, usage_sum_squares = ?, "
+            "prefix_end = ?, running_min_end = ? WHERE meter_id = ?",
+            (
+                last_day.isoformat(),
+                n_days + len(days),
+                values_sum,
+                squares_sum,
+                prefix[-1],
+                running_min[-1],
+                meter_id,
+            ),
+        )
+
+    @staticmethod
+    def _insert_days(conn, meter_id, days, values, zscores, prefix, running_min):
+        conn.executemany(
+            "INSERT OR REPLACE INTO daily VALUES (?, ?, ?, ?, ?, ?)",
+            zip(
+                [meter_id] * len(days),
+                [day.isoformat() for day in days],
+                values.tolist(),
+                _nullable(zscores),
+                _nullable(prefix),
+                _nullable(running_min),
+                strict=True,
+            ),
+        )
+
+    def _insert_daily_anomalies(self, conn, meter_id, days, zscores):
+        with np.errstate(invalid="ignore"):
+            anomalies = days[zscores > self.daily_zscore_threshold]
+        conn.executemany(
+            "INSERT OR REPLACE INTO windows VALUES (?, 'daily', ?, ?, 0)",
+            [(meter_id, day.isoformat(), day.isoformat()) for day in anomalies],
+        )
+
+    @staticmethod
+    def _insert_windows(conn, meter_id, starts, ends, last_day):
+        conn.executemany(
+            "INSERT OR REPLACE INTO windows VALUES (?, 'prolonged', ?, ?, ?)",
+            [
+                (meter_id, start.isoformat(), end.isoformat(), int(end == last_day))
+                for start, end in zip(starts, ends, strict=True)
+            ],
+        )
+
+
+def anomaly_store_tolerance():
+    """
+    zscore_tolerance of the anomaly store in the chatbot, from the ANOMALY_STORE_ZSCORE_TOLERANCE
+    environment variable, 0.05 by default. 0 keeps the stored anomalies identical to those of the detectors.
+    """
+    return float(os.getenv("ANOMALY_STORE_ZSCORE_TOLERANCE") or 0.05)
+
+
+def _statistics(n, total, squares):
+    """Mean and standard deviation from running sums."""
+    mean = total / n
+    return mean, np.sqrt(max(squares / n - mean**2, 0.0))
+
+
+def _nullable(values):
+    """Floats for SQLite, with NaN stored as NULL."""
+    return [None if np.isnan(value) else value for value in values.tolist()]
@@ -1,9 +1,9 @@
 import streamlit as st
-from chatbot_rag_anomaly_detection import ChatbotRAG as Chatbot
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# from auth import check_password
 # if not check_password():
 #     st.stop()  # Do not continue if check_password is not True.
 
@@ -25,12 +25,15 @@ if "messages" not in st.session_state:
 
 for message in st.session_state.messages:
     with st.chat_message(message["role"]):
-        if isinstance(message["content"], str):
-            st.markdown(message["content"])
+        if "figure" in message:
+            st.session_state.chatbot.show_figure(message["figure"])
         else:
-            st.plotly_chart(message["content"])
+            st.markdown(message["content"])
 
 if "chatbot" not in st.session_state:
+    # imported here so that the page renders before langchain, plotly and scipy are loaded
+    from chatbot_rag_anomaly_detection import ChatbotRAG as Chatbot
+
     st.session_state.chatbot = Chatbot()
 
 if prompt := st.chat_input("Please describe your energy usage anomaly."):
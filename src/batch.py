@@ -0,0 +1,187 @@
+"""
+Scans a directory or glob of per-customer smart meter files for anomalies, using all cores, and writes a
+single consolidated anomaly report.
+
+Each meter file has the format of src/smart_meter_data.csv. Weather is either one file shared by all
+customers, or a directory with a weather file of the same name as each meter file. Run from the
+repository root:
+
+    python src/batch.py "data/meters/*.csv" --weather data/weather --output report.parquet
+"""
+
+import argparse
+import glob
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from functools import partial
+
+import pandas as pd
+from store import aggregate_daily
+from utils import DailyProfile, anomaly_weather_table, detect_daily_anomalies, detect_prolonged_anomalies
+
+REPORT_COLUMNS = ["customer", "kind", "start", "end", "mean_temperature", "error"]
+REPORT_FORMATS = [".csv", ".parquet", ".jsonl"]
+
+
+def find_jobs(meters, weather=None):
+    """
+    Pairs each meter file with its weather file.
+
+    Parameters:
+    meters (str): Directory of meter CSV files, or a glob pattern.
+    weather (str): Weather CSV file shared by all customers, directory of weather files named like the
+        meter files, or None.
+
+    Returns:
+    list: Tuples of the meter file and weather file (or None) of each customer.
+    """
+    paths = sorted(glob.glob(os.path.join(meters, "*.csv")) if os.path.isdir(meters) else glob.glob(meters))
+    if weather is not None and os.path.isdir(weather):
+        return [(path, os.path.join(weather, os.path.basename(path))) for path in paths]
+    return [(path, weather) for path in paths]
+
+
+def analyse_customer(meter_path, weather_path=None, chunksize=None):
+    """
+    Detects the anomalies of one customer, with the mean temperature during each, as report rows.
+
+    With a chunksize, the files are aggregated to days a chunk of rows at a time instead of being loaded
+    whole, for files larger than memory.
+    """
+    customer = os.path.splitext(os.path.basename(meter_path))[0]
+    if chunksize is not None:
+        weather = None if weather_path is None else aggregate_daily(weather_path, "mean", chunksize)
+        profile = DailyProfile.from_daily(aggregate_daily(meter_path, "sum", chunksize), weather)
+    else:
+        df = pd.read_csv(meter_path, index_col=0, parse_dates=True)
+        weather_df = (
+            None if weather_path is None else pd.read_csv(weather_path, index_col=0, parse_dates=True)
+        )
+        profile = DailyProfile(df, weather_df)
+
+    anomalies = detect_daily_anomalies(profile)
+    prolonged_anomalies = detect_prolonged_anomalies(profile)
+    if profile.weather is None:
+        windows = [] if anomalies is None else [("daily", day, day, None) for day in anomalies]
+        if prolonged_anomalies is not None:
+            windows += [("prolonged", start, end, None) for start, end in prolonged_anomalies]
+    else:
+        table = anomaly_weather_table(profile, anomalies, prolonged_anomalies)
+        windows = zip(table["kind"], table["start"], table["end"], table["mean_temperature"], strict=True)
+    return [(customer, kind, start, end, temperature, None) for kind, start, end, temperature in windows]
+
+
+def analyse_chunk(jobs, chunksize=None):
+    """Analyses a chunk of customers in a worker process, reporting failures as error rows."""
+    rows = []
+    for meter_path, weather_path in jobs:
+        try:
+            rows += analyse_customer(meter_path, weather_path, chunksize)
+        except Exception as error:
+            customer = os.path.splitext(os.path.basename(meter_path))[0]
+            rows.append((customer, "error", None, None, None, f"{type(error).__name__}: {error}"))
+    return len(jobs), rows
+
+
+def run_batch(jobs, workers=None, chunk_size=16, max_pending=None, chunksize=None):
+    """
+    Analyses customers on a process pool, yielding the report rows of each chunk as it completes.
+
+    Parameters:
+    jobs (list): Tuples of meter file and weather file, from find_jobs.
+    workers (int): Number of worker processes, defaults to the number of cores.
+    chunk_size (int): Customers sent to a worker at a time, amortising the inter-process overhead.
+    max_pending (int): Chunks submitted but not yet collected, defaults to twice the workers, so results
+        are consumed as fast as they are produced and never pile up in memory.
+    chunksize (int): Rows read at a time from each file, or None to load the files whole.
+
+    Yields:
+    tuple: Number of customers in the chunk and its report rows.
+    """
+    workers = workers or os.cpu_count()
+    max_pending = max_pending or 2 * workers
+    chunks = (jobs[i : i + chunk_size] for i in range(0, len(jobs), chunk_size))
+    pending = set()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for chunk in chunks:
+            if len(pending) >= max_pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+            pending.add(executor.submit(partial(analyse_chunk, chunksize=chunksize), chunk))
+        for future in wait(pending).done:
+            yield future.result()
+
+
+def build_report(rows):
+    """
+    The report of the rows of all chunks, ordered by customer, so it does not depend on the order in which
+    the chunks completed.
+    """
+    report = pd.DataFrame(rows, columns=REPORT_COLUMNS)
+    return report.sort_values("customer", kind="stable", ignore_index=True)
+
+
+def write_report(report, output):
+    """Writes the report as CSV, Parquet or JSON lines, chosen by the file extension."""
+    extension = os.path.splitext(output)[1].lower()
+    if extension == ".csv":
+        report.to_csv(output, index=False)
+    elif extension == ".parquet":
+        report.to_parquet(output, index=False)
+    elif extension == ".jsonl":
+        report.to_json(output, orient="records", lines=True, date_format="iso")
+    else:
+        raise ValueError(f"Unknown report format {extension}, use one of {', '.join(REPORT_FORMATS)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("meters", help="directory of meter CSV files, or a glob pattern")
+    parser.add_argument(
+        "--weather", help="shared weather CSV file, or directory of per-customer weather files"
+    )
+    parser.add_argument("--output", default="anomaly_report.csv", help=".csv, .parquet or .jsonl report file")
+    parser.add_argument("--workers", type=int, help="worker processes, defaults to the number of cores")
+    parser.add_argument("--chunk-size", type=int, default=16, help="customers per task sent to a worker")
+    parser.add_argument(
+        "--read-chunksize", type=int, help="read files this many rows at a time, for files larger than memory"
+    )
+    args = parser.parse_args()
+
+    if os.path.splitext(args.output)[1].lower() not in REPORT_FORMATS:
+        parser.error(f"--output must end in one of {', '.join(REPORT_FORMATS)}")
+    jobs = find_jobs(args.meters, args.weather)
+    if not jobs:
+        sys.exit(f"No meter files found for {args.meters}")
+
+    start = time.perf_counter()
+    rows = []
+    completed = 0
+    for n_customers, chunk_rows in run_batch(
+        jobs, args.workers, args.chunk_size, chunksize=args.read_chunksize
+    ):
+        rows += chunk_rows
+        completed += n_customers
+        elapsed = time.perf_counter() - start
+        print(
+            f"\r{completed}/{len(jobs)} meters, {completed / elapsed:.1f} meters/s", end="", file=sys.stderr
+        )
+    print(file=sys.stderr)
+
+    report = build_report(rows)
+    write_report(report, args.output)
+    elapsed = time.perf_counter() - start
+    errors = (report["kind"] == "error").sum()
+    print(
+        f"{len(jobs)} meters in {elapsed:.2f}s ({len(jobs) / elapsed:.1f} meters/s), "
+        f"{len(report) - errors} anomalies, {errors} errors, report written to {args.output}"
+    )
+
+
+if __name__ == "__main__":
+    main()
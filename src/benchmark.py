@@ -0,0 +1,193 @@
+"""
+Benchmarks the anomaly detection pipeline in utils on synthetic data of increasing size.
+
+Records the wall time, peak memory and output of each function for each size, and fails if any of them
+regressed against a stored baseline, or if there is no baseline unless --allow-missing-baseline is given.
+The baseline holds timings of one machine, so create it on the machine that runs the checks. Run from the
+repository root:
+
+    python src/benchmark.py --days 1 31 365 3650 --update-baseline
+    python src/benchmark.py --days 1 31 365 3650
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import pandas as pd
+from fleet import detect_fleet_anomalies
+from store import build_store, open_store
+from synthetic_data import generate_smart_meter_data
+from utils import (
+    PLOT_MAX_POINTS,
+    DailyProfile,
+    analyse_weather_data,
+    detect_daily_anomalies,
+    detect_prolonged_anomalies,
+    plot_anomalies,
+    plot_weather,
+)
+
+BASELINE_PATH = "src/benchmark_baseline.json"
+
+# the injected anomalies that each detector is expected to find
+RECALL_KINDS = {"detect_daily_anomalies": "daily", "detect_prolonged_anomalies": "prolonged"}
+
+
+def measure(function, repeat):
+    """Best wall time over repeat runs, and the peak memory and result of an extra traced run."""
+    seconds = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        seconds = min(seconds, time.perf_counter() - start)
+    tracemalloc.start()
+    result = function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seconds, peak, result
+
+
+def digest(result):
+    """Short fingerprint of a function output, to detect changes in the results."""
+    if isinstance(result, pd.DataFrame | pd.Series):
+        result = result.to_json(date_format="iso")
+    elif hasattr(result, "to_json"):
+        result = result.to_json()
+    elif result is not None and not isinstance(result, str | tuple):
+        result = list(result)
+    return hashlib.sha256(repr(result).encode()).hexdigest()[:16]
+
+
+def recall(truth, kind, detected):
+    """Fraction of the injected anomalies of a kind that overlap a detected anomaly."""
+    injected = truth[truth["kind"] == kind]
+    if len(injected) == 0:
+        return None
+    if detected is None:
+        return 0.0
+    windows = [(day, day) for day in detected] if kind == "daily" else detected
+    found = sum(
+        any(start <= end_detected and start_detected <= end for start_detected, end_detected in windows)
+        for start, end in zip(injected["start"], injected["end"], strict=True)
+    )
+    return found / len(injected)
+
+
+def run_size(days, n_meters, repeat):
+    """Benchmarks every pipeline step for one data size, returning a result per step."""
+    df, weather_df, truth = generate_smart_meter_data(days=days, n_meters=n_meters)
+    meter_df = df.iloc[:, :1].set_axis(["usage"], axis=1)
+    truth = truth[truth["meter_id"] == df.columns[0]]
+
+    with tempfile.TemporaryDirectory() as directory:
+        csv_path = os.path.join(directory, "smart_meter_data.csv")
+        store_dir = os.path.join(directory, "store")
+        meter_df.to_csv(csv_path)
+
+        anomalies = detect_daily_anomalies(meter_df)
+        prolonged_anomalies = detect_prolonged_anomalies(meter_df)
+        steps = {
+            "build_store": lambda: build_store(csv_path, store_dir).meters,
+            "load_smart_meter_data": lambda: open_store(csv_path, store_dir).to_frame(),
+            "daily_profile": lambda: DailyProfile(meter_df, weather_df).usage,
+            "detect_daily_anomalies": lambda: detect_daily_anomalies(meter_df),
+            "detect_prolonged_anomalies": lambda: detect_prolonged_anomalies(meter_df),
+            "analyse_weather_data": lambda: analyse_weather_data(weather_df, anomalies, prolonged_anomalies),
+            "plot_anomalies": lambda: plot_anomalies(
+                meter_df, anomalies, prolonged_anomalies, max_points=PLOT_MAX_POINTS
+            ),
+            "plot_weather": lambda: plot_weather(weather_df, max_points=PLOT_MAX_POINTS),
+        }
+        if n_meters > 1:
+            steps["detect_fleet_anomalies"] = lambda: detect_fleet_anomalies(df)
+
+        results = {}
+        for name, function in steps.items():
+            seconds, peak, output = measure(function, repeat)
+            key = f"{name}/{days}d/{n_meters}m"
+            results[key] = {
+                "seconds": seconds,
+                "peak_mb": peak / 2**20,
+                "digest": digest(output),
+                "recall": recall(truth, RECALL_KINDS[name], output) if name in RECALL_KINDS else None,
+            }
+            line = f"{key:<45} {seconds * 1000:10.2f}ms {peak / 2**20:10.2f}MB"
+            if results[key]["recall"] is not None:
+                line += f"  recall {results[key]['recall']:.2f}"
+            print(line)
+    return results
+
+
+def regressions(results, baseline, time_tolerance, memory_tolerance):
+    """Descriptions of the results that are slower, use more memory or differ from the baseline."""
+    found = []
+    for key, result in results.items():
+        if key not in baseline:
+            continue
+        base = baseline[key]
+        # small absolute margins stop timer and allocator noise on tiny inputs counting as regressions
+        if result["seconds"] > base["seconds"] * time_tolerance + 0.005:
+            found.append(f"{key}: {result['seconds'] * 1000:.2f}ms, baseline {base['seconds'] * 1000:.2f}ms")
+        if result["peak_mb"] > base["peak_mb"] * memory_tolerance + 1:
+            found.append(f"{key}: peak {result['peak_mb']:.2f}MB, baseline {base['peak_mb']:.2f}MB")
+        if result["digest"] != base["digest"]:
+            found.append(f"{key}: output changed from the baseline")
+        if result["recall"] is not None and base["recall"] is not None and result["recall"] < base["recall"]:
+            found.append(f"{key}: recall {result['recall']:.2f}, baseline {base['recall']:.2f}")
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--days", type=int, nargs="+", default=[1, 31, 365, 3650], help="history lengths")
+    parser.add_argument("--meters", type=int, nargs="+", default=[1], help="meter counts")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per function, the best is kept")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="baseline results file")
+    parser.add_argument("--update-baseline", action="store_true", help="store these results as the baseline")
+    parser.add_argument(
+        "--allow-missing-baseline", action="store_true", help="succeed when there is no baseline to check"
+    )
+    parser.add_argument("--time-tolerance", type=float, default=1.5, help="allowed slowdown factor")
+    parser.add_argument("--memory-tolerance", type=float, default=1.5, help="allowed peak memory factor")
+    args = parser.parse_args()
+
+    results = {}
+    for n_meters in args.meters:
+        for days in args.days:
+            results.update(run_size(days, n_meters, args.repeat))
+
+    if args.update_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        with open(args.baseline, "w") as f:
+            json.dump({**baseline, **results}, f, indent=2)
+        print(f"baseline written to {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f"no baseline at {args.baseline}, run with --update-baseline to create one")
+        if not args.allow_missing_baseline:
+            sys.exit(1)
+        return
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    found = regressions(results, baseline, args.time_tolerance, args.memory_tolerance)
+    for regression in found:
+        print(f"REGRESSION {regression}")
+    if found:
+        sys.exit(1)
+    print("no regressions against the baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Benchmarks the cold start of the app: the import time of each module in a fresh interpreter, and the time
+until the page header has been rendered, before the chatbot is imported.
+
+Run from the repository root:
+
+    python src/benchmark_startup.py --repeat 5
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+MODULES = [
+    "streamlit",
+    "dotenv",
+    "auth",
+    "tracing",
+    "utils",
+    "langchain_openai",
+    "chatbot_rag_anomaly_detection",
+]
+
+# everything app.py runs before the chatbot is imported
+FIRST_RENDER = """
+import streamlit as st
+from dotenv import load_dotenv
+
+load_dotenv()
+st.title("Energy Usage Anomaly Detection Assistant")
+st.logo(image="src/logo.png", size="large")
+"""
+
+TIMED = """
+import time
+start = time.perf_counter()
+{code}
+print(time.perf_counter() - start)
+"""
+
+
+def time_in_fresh_interpreter(code):
+    """Seconds taken to run code in a new Python process, or the error if it fails."""
+    src_dir = os.path.dirname(os.path.abspath(__file__))
+    env = {**os.environ, "PYTHONPATH": src_dir, "STREAMLIT_LOG_LEVEL": "error"}
+    result = subprocess.run(
+        [sys.executable, "-c", TIMED.format(code=code)], capture_output=True, text=True, env=env
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def benchmark(name, code, repeat):
+    try:
+        times = [time_in_fresh_interpreter(code) for _ in range(repeat)]
+    except RuntimeError as error:
+        print(f"{name:<40} failed: {error}")
+        return
+    print(f"{name:<40} {statistics.median(times) * 1000:8.1f}ms (min {min(times) * 1000:.1f}ms)")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--repeat", type=int, default=5, help="number of fresh interpreters per measurement")
+    args = parser.parse_args()
+
+    print(f"median of {args.repeat} runs, each in a fresh interpreter")
+    for module in MODULES:
+        benchmark(f"import {module}", f"import {module}", args.repeat)
+    benchmark("first render (page header)", FIRST_RENDER, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
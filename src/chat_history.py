@@ -0,0 +1,156 @@
+import os
+import re
+
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import HumanMessage, SystemMessage, get_buffer_string
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.runnables import RunnableBranch, RunnableLambda
+
+SUMMARY_PROMPT = """Progressively summarize the conversation between a user and an energy usage anomaly \
+detection assistant, adding onto the previous summary and returning a new summary. Keep the dates, \
+anomalies, appliances, suggested causes and fixes, and any questions that are not yet resolved. \
+Use at most {max_words} words.
+
+Previous summary:
+{summary}
+
+New lines of conversation:
+{lines}
+
+New summary:"""
+
+# words and phrases that refer back to earlier turns, so the question needs the history to be understood
+REFERENCE_PATTERN = re.compile(
+    r"^\s*(and|but|so)\b|\b(it|its|it's|that|this|these|those|they|them|their|he|she|above|earlier|previous|"
+    r"previously|before|again|same|else|other|another|former|latter|also|(which|first|second|last) one|"
+    r"what about|how about|you said|you mentioned|as well)\b",
+    re.IGNORECASE,
+)
+
+
+def count_tokens(text):
+    """Approximate number of tokens in a text, at about 4 characters per token for English."""
+    return len(text) // 4 + 1
+
+
+def references_history(question):
+    """Whether a question may refer to earlier turns of the conversation, e.g. "why did it happen?"."""
+    return len(question.split()) <= 3 or REFERENCE_PATTERN.search(question) is not None
+
+
+class BudgetedChatHistory(BaseChatMessageHistory):
+    """
+    Chat history that keeps its size within a token budget.
+
+    Once the history exceeds max_tokens, all exchanges but the last keep_turns are folded into a running
+    summary by the llm, which is passed to the chains as a system message before the recent messages.
+    Folding everything but the recent exchanges at once means a summary call is only needed every few
+    turns, rather than on every turn. If the recent exchanges are over the budget on their own, the oldest
+    of them are folded too, until the history fits. A ValueError is raised if the summary alone is over
+    the budget.
+
+    Parameters:
+    llm (BaseChatModel): Model used to update the summary, or None to drop older exchanges instead.
+    max_tokens (int): Token budget of the history, defaults to the CHAT_HISTORY_MAX_TOKENS environment
+        variable or 2000.
+    keep_turns (int): Number of recent exchanges kept verbatim, defaults to the CHAT_HISTORY_KEEP_TURNS
+        environment variable or 4.
+    summary_words (int): Maximum length of the summary in words.
+    token_counter (callable): Number of tokens in a text, defaults to count_tokens.
+    """
+
+    def __init__(self, llm=None, max_tokens=None, keep_turns=None, summary_words=200, token_counter=None):
+        if max_tokens is None:
+            max_tokens = int(os.getenv("CHAT_HISTORY_MAX_TOKENS", "2000"))
+        if keep_turns is None:
+            keep_turns = int(os.getenv("CHAT_HISTORY_KEEP_TURNS", "4"))
+        self.max_tokens = max_tokens
+        self.keep_turns = keep_turns
+        self.summary_words = summary_words
+        self.token_counter = token_counter or count_tokens
+        self.summary = ""
+        self.recent = []
+        self._summarize = None
+        if llm is not None:
+            self._summarize = (
+                RunnableLambda(lambda inputs: [HumanMessage(SUMMARY_PROMPT.format(**inputs))])
+                | llm
+                | StrOutputParser()
+            )
+
+    @property
+    def messages(self):
+        if not self.summary:
+            return list(self.recent)
+        return [SystemMessage(f"Summary of the earlier conversation: {self.summary}")] + self.recent
+
+    def add_messages(self, messages):
+        self.recent.extend(messages)
+        if self.token_count() > self.max_tokens:
+            self._fold()
+
+    def token_count(self):
+        """Approximate number of tokens the history adds to each prompt."""
+        return self._tokens(self.messages)
+
+    def _tokens(self, messages):
+        return sum(self.token_counter(str(message.content)) for message in messages)
+
+    def _cut(self):
+        """
+        Position of the first message kept verbatim: the start of the keep_turns-th last exchange, or of a
+        later one while the messages from there on do not fit in the budget with the current summary.
+        """
+        # an exchange starts at each user message
+        starts = [i for i, message in enumerate(self.recent) if message.type == "human"]
+        if self.keep_turns == 0:
+            first = len(self.recent)
+        else:
+            first = starts[-self.keep_turns] if len(starts) >= self.keep_turns else 0
+        summary = self.messages[: len(self.messages) - len(self.recent)]
+        for cut in [first] + [start for start in starts if start > first]:
+            if self._tokens(summary + self.recent[cut:]) <= self.max_tokens:
+                return cut
+        return len(self.recent)
+
+    def _fold(self):
+        # one summary call is enough unless the new summary is larger than the one the cut was chosen with
+        cut = self._cut()
+        while cut > 0:
+            older, self.recent = self.recent[:cut], self.recent[cut:]
+            if self._summarize is not None:
+                self.summary = self._summarize.invoke(
+                    {
+                        "max_words": self.summary_words,
+                        "summary": self.summary or "(none)",
+                        "lines": get_buffer_string(older),
+                    }
+                )
+            cut = self._cut()
+        if self.token_count() > self.max_tokens:
+            raise ValueError(
+                f"The summary of the chat history alone is over the budget of {self.max_tokens} tokens, "
+                "increase max_tokens or decrease summary_words"
+            )
+
+    def clear(self):
+        self.summary = ""
+        self.recent = []
+
+
+def create_selective_history_aware_retriever(llm, retriever, prompt):
+    """
+    Like langchain's create_history_aware_retriever, but only rewrites the question with the llm when it
+    may refer to earlier turns.
+
+    Questions on an empty history, or that stand on their own, go straight to the retriever, saving an llm
+    round-trip before the answer starts streaming.
+    """
+
+    def needs_history(inputs):
+        return bool(inputs.get("chat_history")) and references_history(inputs["input"])
+
+    return RunnableBranch(
+        (needs_history, prompt | llm | StrOutputParser() | retriever),
+        (lambda inputs: inputs["input"]) | retriever,
+    ).with_config(run_name="chat_retriever_chain")
@@ -0,0 +1,111 @@
+import asyncio
+import os
+import re
+import time
+import zlib
+
+import numpy as np
+from chat_history import count_tokens
+from http_clients import get_async_http_client, get_http_client
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, get_buffer_string
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_openai import ChatOpenAI
+
+
+class LocalChatModel(BaseChatModel):
+    """
+    Deterministic local chat model, for running and load testing without the OpenAI API.
+
+    The response is a fixed number of words drawn from the prompt, seeded by a hash of the prompt, so the
+    same prompt always gets the same response. Streaming waits first_token_latency before the first token
+    and token_latency before each later one, like a remote model generating at a fixed rate, and the last
+    chunk carries the usage metadata as ChatOpenAI does with stream_usage.
+
+    Parameters:
+    model_name (str): Name reported for the model, e.g. as part of the response cache keys.
+    token_latency (float): Seconds taken to generate each token after the first.
+    first_token_latency (float): Seconds taken before the first token, e.g. reading the prompt.
+    response_tokens (int): Number of tokens in each response.
+    """
+
+    model_name: str = "local"
+    token_latency: float = 0.02
+    first_token_latency: float = 0.3
+    response_tokens: int = 100
+
+    @property
+    def _llm_type(self):
+        return "local"
+
+    @property
+    def _identifying_params(self):
+        return {"model_name": self.model_name, "response_tokens": self.response_tokens}
+
+    def _respond(self, messages):
+        prompt = get_buffer_string(messages)
+        words = re.findall(r"\w+", prompt.lower()) or ["ok"]
+        rng = np.random.default_rng(zlib.crc32(prompt.encode()))
+        tokens = [f" {words[i]}" for i in rng.integers(len(words), size=self.response_tokens)]
+        tokens[0] = tokens[0].lstrip().capitalize()
+        usage = {
+            "input_tokens": count_tokens(prompt),
+            "output_tokens": len(tokens),
+            "total_tokens": count_tokens(prompt) + len(tokens),
+        }
+        return tokens, usage
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        tokens, usage = self._respond(messages)
+        time.sleep(self.first_token_latency + self.token_latency * (len(tokens) - 1))
+        message = AIMessage("".join(tokens), usage_metadata=usage)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        tokens, usage = self._respond(messages)
+        for i, token in enumerate(tokens):
+            time.sleep(self.first_token_latency if i == 0 else self.token_latency)
+            yield ChatGenerationChunk(message=AIMessageChunk(token))
+        yield ChatGenerationChunk(message=AIMessageChunk("", usage_metadata=usage))
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        tokens, usage = self._respond(messages)
+        await asyncio.sleep(self.first_token_latency + self.token_latency * (len(tokens) - 1))
+        message = AIMessage("".join(tokens), usage_metadata=usage)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        # waits on the event loop, so one thread can stream many responses at once
+        tokens, usage = self._respond(messages)
+        for i, token in enumerate(tokens):
+            await asyncio.sleep(self.first_token_latency if i == 0 else self.token_latency)
+            yield ChatGenerationChunk(message=AIMessageChunk(token))
+        yield ChatGenerationChunk(message=AIMessageChunk("", usage_metadata=usage))
+
+
+def get_chat_model(model, **kwargs):
+    """
+    Chat model used by the chatbots.
+
+    The LLM_PROVIDER environment variable selects "openai" (the default) or "local" models. The OpenAI
+    models share the pooled HTTP clients of the process, and the local model is configured with the
+    LOCAL_LLM_TOKEN_LATENCY, LOCAL_LLM_FIRST_TOKEN_LATENCY (seconds) and LOCAL_LLM_RESPONSE_TOKENS
+    environment variables.
+
+    Parameters:
+    model (str): Name of the OpenAI model.
+    kwargs: Arguments of ChatOpenAI, e.g. temperature, ignored by the local model.
+    """
+    provider = os.getenv("LLM_PROVIDER", "openai")
+    if provider == "openai":
+        return ChatOpenAI(
+            model=model, http_client=get_http_client(), http_async_client=get_async_http_client(), **kwargs
+        )
+    if provider == "local":
+        return LocalChatModel(
+            model_name=f"local-{model}",
+            token_latency=float(os.getenv("LOCAL_LLM_TOKEN_LATENCY", "0.02")),
+            first_token_latency=float(os.getenv("LOCAL_LLM_FIRST_TOKEN_LATENCY", "0.3")),
+            response_tokens=int(os.getenv("LOCAL_LLM_RESPONSE_TOKENS", "100")),
+        )
+    raise ValueError(f"Unknown LLM provider: {provider}")
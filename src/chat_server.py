@@ -0,0 +1,144 @@
+"""
+Serves the chatbot over HTTP from one asyncio event loop, so one worker process can stream many chats.
+
+Sessions are created with POST /sessions and their answers are streamed from POST
+/sessions/<session_id>/messages as server-sent events, one JSON string per chunk and an "end" event. Without
+an input the answer is the summary of the anomalies that the app starts with. GET /metrics serves the
+metrics in the Prometheus text format.
+
+The answers are generated with ChatbotRAG.aanswer. The next chunk is only taken from the chain once the
+previous one has been written to the client, so a slow client slows down its own answer instead of
+buffering it, and a client that disconnects stops its answer. At most --max-answers answers are generated
+at once and later ones wait in line. The OpenAI requests of every session share the pooled HTTP clients,
+with at most OPENAI_MAX_CONNECTIONS connections. Run from the repository root:
+
+    python src/chat_server.py --port 8080 --max-answers 100
+
+    curl -X POST localhost:8080/sessions
+    curl -N localhost:8080/sessions/<session_id>/messages -d '{"input": "Why was my usage high?"}'
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import time
+from dataclasses import dataclass, field
+
+from aiohttp import web
+from chatbot_rag_anomaly_detection import INITIAL_PROMPT, ChatbotRAG, SharedResources
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Session:
+    """A chat session of the server."""
+
+    chatbot: ChatbotRAG
+    # one answer at a time per session keeps its chat history in order
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    last_used: float = field(default_factory=time.monotonic)
+
+
+class ChatServer:
+    """
+    The sessions of the chat server and its request handlers.
+
+    Parameters:
+    shared (SharedResources): Shared resources of the chatbot.
+    max_answers (int): Maximum number of answers generated at once.
+    session_ttl (float): Seconds after which an idle session is dropped.
+    """
+
+    def __init__(self, shared, max_answers=100, session_ttl=3600):
+        self.shared = shared
+        self.answer_slots = asyncio.Semaphore(max_answers)
+        self.session_ttl = session_ttl
+        self.sessions = {}
+
+    def app(self):
+        """The aiohttp application serving the chat."""
+        app = web.Application()
+        app.add_routes(
+            [
+                web.post("/sessions", self.create_session),
+                web.post("/sessions/{session_id}/messages", self.post_message),
+                web.delete("/sessions/{session_id}", self.delete_session),
+                web.get("/metrics", self.get_metrics),
+            ]
+        )
+        return app
+
+    def _expire(self):
+        now = time.monotonic()
+        for session_id, session in list(self.sessions.items()):
+            if now - session.last_used > self.session_ttl and not session.lock.locked():
+                del self.sessions[session_id]
+
+    async def create_session(self, request):
+        self._expire()
+        chatbot = ChatbotRAG(self.shared, initial_summary=False)
+        self.sessions[chatbot.session_id] = Session(chatbot)
+        metrics.increment("chat_sessions_total")
+        return web.json_response({"session_id": chatbot.session_id}, status=201)
+
+    async def delete_session(self, request):
+        if self.sessions.pop(request.match_info["session_id"], None) is None:
+            raise web.HTTPNotFound(text="Unknown session")
+        return web.Response(status=204)
+
+    async def post_message(self, request):
+        session = self.sessions.get(request.match_info["session_id"])
+        if session is None:
+            raise web.HTTPNotFound(text="Unknown session")
+        try:
+            body = await request.json() if request.can_read_body else {}
+        except json.JSONDecodeError as error:
+            raise web.HTTPBadRequest(text="The body is not valid JSON") from error
+        input = body.get("input") or INITIAL_PROMPT
+
+        response = web.StreamResponse(
+            headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"}
+        )
+        async with session.lock, self.answer_slots:
+            await response.prepare(request)
+            chunks = session.chatbot.aanswer(input)
+            try:
+                async for chunk in chunks:
+                    # waits for the client to take the data once the send buffer is full
+                    await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            except ConnectionResetError:
+                metrics.increment("chat_disconnects_total")
+                logger.info("Client disconnected from session %s", session.chatbot.session_id)
+                return response
+            finally:
+                await chunks.aclose()
+                session.last_used = time.monotonic()
+            await response.write(b"event: end\ndata: {}\n\n")
+        await response.write_eof()
+        return response
+
+    async def get_metrics(self, request):
+        return web.Response(text=metrics.to_prometheus(), content_type="text/plain")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--host", default="0.0.0.0", help="address to listen on")
+    parser.add_argument("--port", type=int, default=8080, help="port to listen on")
+    parser.add_argument("--max-answers", type=int, default=100, help="answers generated at once")
+    parser.add_argument("--session-ttl", type=float, default=3600, help="seconds before idle sessions expire")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    shared = SharedResources()
+    server = ChatServer(shared, args.max_answers, args.session_ttl)
+    web.run_app(server.app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,20 @@
 import streamlit as st
+from chat_models import get_chat_model
 from dotenv import load_dotenv
-from langchain.globals import set_debug
 from langchain_community.chat_message_histories import ChatMessageHistory
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_core.runnables.history import RunnableWithMessageHistory
-from langchain_openai import ChatOpenAI
-
-set_debug(True)
+from tracing import configure_tracing, get_callbacks
 
 load_dotenv()
 
+configure_tracing()
+
 
 class ChatbotBasic:
 
     def __init__(self):
-        model = ChatOpenAI(model="gpt-4o-mini")
+        model = get_chat_model("gpt-4o-mini")
 
         chat_history = ChatMessageHistory()
 
@@ -44,6 +44,8 @@ class ChatbotBasic:
         )
 
     def stream(self, input):
-        stream = self.chain.stream({"input": input}, {"configurable": {"session_id": "unused"}})
+        stream = self.chain.stream(
+            {"input": input}, {"configurable": {"session_id": "unused"}, "callbacks": get_callbacks()}
+        )
         response = st.write_stream(stream)
         return response
@@ -1,36 +1,28 @@
-import json
-
 import streamlit as st
+from chat_history import BudgetedChatHistory, create_selective_history_aware_retriever
+from chat_models import get_chat_model
 from dotenv import load_dotenv
-from langchain.chains import create_history_aware_retriever, create_retrieval_chain
+from embedding_cache import get_embeddings
+from langchain.chains import create_retrieval_chain
 from langchain.chains.combine_documents import create_stuff_documents_chain
-from langchain.globals import set_debug
-from langchain_community.chat_message_histories import ChatMessageHistory
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_core.runnables.history import RunnableWithMessageHistory
-from langchain_core.vectorstores import InMemoryVectorStore
-from langchain_openai import ChatOpenAI, OpenAIEmbeddings
-from langchain_text_splitters import RecursiveJsonSplitter
-
-set_debug(True)
+from metrics import measure_stream
+from retriever import build_customer_retriever
+from tracing import configure_tracing, get_callbacks
 
 load_dotenv()
 
+configure_tracing()
+
 
 class ChatbotRAG:
 
     def __init__(self):
-        llm = ChatOpenAI(model="gpt-4o-mini", temperature=0)
+        llm = get_chat_model("gpt-4o-mini", temperature=0, stream_usage=True)
 
         ### Construct retriever ###
-        with open("src/example_customer_documents.json") as f:
-            json_data = json.load(f)
-
-        splitter = RecursiveJsonSplitter(max_chunk_size=300)
-        docs = splitter.create_documents(texts=[json_data])
-
-        vectorstore = InMemoryVectorStore.from_documents(documents=docs, embedding=OpenAIEmbeddings())
-        retriever = vectorstore.as_retriever()
+        retriever = build_customer_retriever(get_embeddings())
 
         ### Contextualize question ###
         contextualize_q_system_prompt = """Given a chat history and the latest user question \
@@ -45,7 +37,10 @@ class ChatbotRAG:
                 ("human", "{input}"),
             ]
         )
-        history_aware_retriever = create_history_aware_retriever(llm, retriever, contextualize_q_prompt)
+        # the question is only rewritten when it refers to earlier turns
+        history_aware_retriever = create_selective_history_aware_retriever(
+            llm, retriever, contextualize_q_prompt
+        )
 
         ### Answer question ###
         qa_system_prompt = """You are an an energy usage anomaly detection assistant. \
@@ -71,7 +66,8 @@ class ChatbotRAG:
         rag_chain = create_retrieval_chain(history_aware_retriever, question_answer_chain)
 
         ### Statefully manage chat history ###
-        chat_history = ChatMessageHistory()
+        # older turns are summarized to keep the history within a token budget
+        chat_history = BudgetedChatHistory(llm)
 
         self.chain = RunnableWithMessageHistory(
             rag_chain,
@@ -82,7 +78,9 @@ class ChatbotRAG:
         )
 
     def stream(self, input):
-        stream = self.chain.stream({"input": input}, {"configurable": {"session_id": "unused"}})
+        stream = self.chain.stream(
+            {"input": input}, {"configurable": {"session_id": "unused"}, "callbacks": get_callbacks()}
+        )
 
         def stream_func():
             for chunk in stream:
@@ -90,7 +88,7 @@ class ChatbotRAG:
                     if key == "answer":
                         yield chunk[key]
                     
-        response = st.write_stream(stream_func)
+        response = st.write_stream(measure_stream(stream_func()))
 
         return response
 
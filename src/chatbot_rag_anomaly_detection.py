@@ -1,17 +1,30 @@
-import json
+import logging
+import sqlite3
+import uuid
+import weakref
 
 import streamlit as st
+from anomaly_context import anomaly_documents, anomaly_table, compact_anomaly_text
+from anomaly_store import AnomalyStore, anomaly_store_tolerance
+from chat_history import BudgetedChatHistory, create_selective_history_aware_retriever
+from chat_models import get_chat_model
 from dotenv import load_dotenv
-from langchain.chains import create_history_aware_retriever, create_retrieval_chain
+from embedding_cache import get_embeddings
+from figure_cache import FigureCache, data_fingerprint, render_figure
+from intraday import add_intraday_days, intraday_anomaly_text, intraday_outliers, intraday_threshold
+from langchain.chains import create_retrieval_chain
 from langchain.chains.combine_documents import create_stuff_documents_chain
-from langchain.globals import set_debug
-from langchain_community.chat_message_histories import ChatMessageHistory
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_core.runnables.history import RunnableWithMessageHistory
-from langchain_core.vectorstores import InMemoryVectorStore
-from langchain_openai import ChatOpenAI, OpenAIEmbeddings
-from langchain_text_splitters import RecursiveJsonSplitter
+from metrics import ameasure_stream, measure_stream, metrics, start_metrics_server
+from response_cache import ResponseCache
+from retriever import build_customer_retriever
+from store import DEFAULT_METER
+from task_graph import format_timings, run_task_graph
+from tracing import configure_tracing, get_callbacks, span
 from utils import (
+    PLOT_MAX_POINTS,
+    DailyProfile,
     analyse_weather_data,
     detect_daily_anomalies,
     detect_prolonged_anomalies,
@@ -22,59 +35,164 @@ from utils import (
     plot_weather,
 )
 
-set_debug(True)
-
 load_dotenv()
 
+configure_tracing()
 
-class ChatbotRAG:
+logger = logging.getLogger(__name__)
 
-    def __init__(self):
 
-        ### Load smart meter data and detect anomalies ###
-        df = load_smart_meter_data()
-        weather_df = load_weather_data()
-        anomalies = detect_daily_anomalies(df)
-        prolonged_anomalies = detect_prolonged_anomalies(df)
-        average_temperature_str, anomaly_temperatures_str, prolonged_anomaly_temperatures_str = (
-            analyse_weather_data(weather_df, anomalies, prolonged_anomalies)
-        )
-        fig = plot_anomalies(df, anomalies, prolonged_anomalies)
-        fig_weather = plot_weather(weather_df)
-        self.anomaly_text = generate_anomaly_text(
-            anomalies,
-            prolonged_anomalies,
-            average_temperature_str,
-            anomaly_temperatures_str,
-            prolonged_anomaly_temperatures_str,
-        )
+class SharedResources:
+    """
+    The read-only resources of the chatbot, built once per process and shared by every session.
 
-        ### initialize chain ###
-        self.initialize_chain()
+    Holds the smart meter and weather data, the detected anomalies, the figures, the retriever, the LLM
+    clients and the chain. The chain looks up the chat history of each session by its session id, so
+    sessions only need to hold their own history. The figures are held as cache keys and compressed specs
+    from the FigureCache, and are only rebuilt when the data or the anomalies drawn on them change. The
+    anomalies are read from the AnomalyStore, which only detects the days added since the last start-up,
+    with the z-score tolerance in the ANOMALY_STORE_ZSCORE_TOLERANCE environment variable.
+    With the INTRADAY_ANOMALY_THRESHOLD environment variable set, the days with intraday outliers are added
+    to the daily anomalies and the outliers are described in the prompt.
 
-        ### invoke chain for initial summary ###
-        initial_prompt = """provide a summary of the anomalies detected in the my energy usage \
-        from the smart meter data and any other relevant context."""
-        response = self.stream(initial_prompt)
-        st.plotly_chart(fig)
-        st.plotly_chart(fig_weather)
-        st.session_state.messages.append({"role": "assistant", "content": response})
-        st.session_state.messages.append({"role": "assistant", "content": fig})
-        st.session_state.messages.append({"role": "assistant", "content": fig_weather})
+    Parameters:
+    customer_id (str): Customer whose data is loaded, part of the figure cache keys.
+    figure_cache (FigureCache): Cache of the figure specs.
+    anomaly_store (AnomalyStore): Store of the detected anomalies.
+    """
+
+    def __init__(self, customer_id=DEFAULT_METER, figure_cache=None, anomaly_store=None):
+        start_metrics_server()
+        self.customer_id = customer_id
+        self.figure_cache = figure_cache or FigureCache()
+        self.anomaly_store = anomaly_store or AnomalyStore(zscore_tolerance=anomaly_store_tolerance())
+
+        # chat histories of the sessions by session id, and the model that summarizes their older turns to
+        # keep each history within a token budget
+        self._chat_histories = weakref.WeakValueDictionary()
+        self.summary_llm = get_chat_model("gpt-4o-mini", temperature=0, stream_usage=True)
+
+        ### Load smart meter data, detect anomalies and initialize chain ###
+        # the independent data steps run concurrently, the retriever (embeddings calls) is built once the
+        # anomaly table documents are ready, and the chain once the retriever and anomaly text are ready
+        tasks = {
+            "load_smart_meter_data": (load_smart_meter_data, []),
+            "load_weather_data": (load_weather_data, []),
+            "daily_profile": (DailyProfile, ["load_smart_meter_data", "load_weather_data"]),
+            "stored_anomalies": (self.stored_anomalies, ["load_smart_meter_data"]),
+            "intraday_outliers": (self.intraday_outliers, ["load_smart_meter_data"]),
+            "detect_daily_anomalies": (
+                lambda stored, outliers: add_intraday_days(stored[0], outliers),
+                ["stored_anomalies", "intraday_outliers"],
+            ),
+            "detect_prolonged_anomalies": (lambda stored: stored[1], ["stored_anomalies"]),
+            "analyse_weather_data": (
+                analyse_weather_data,
+                ["daily_profile", "detect_daily_anomalies", "detect_prolonged_anomalies"],
+            ),
+            "generate_anomaly_text": (
+                lambda anomalies, prolonged_anomalies, weather_strs, outliers: (
+                    generate_anomaly_text(anomalies, prolonged_anomalies, *weather_strs)
+                    + " "
+                    + intraday_anomaly_text(outliers)
+                ).rstrip(),
+                [
+                    "detect_daily_anomalies",
+                    "detect_prolonged_anomalies",
+                    "analyse_weather_data",
+                    "intraday_outliers",
+                ],
+            ),
+            # the anomaly description is kept within a token budget, with the full table retrievable; the
+            # intraday outliers are rows of their own rather than the days they fall on
+            "anomaly_table": (
+                lambda profile, stored, prolonged_anomalies, outliers: anomaly_table(
+                    profile, stored[0], prolonged_anomalies, outliers
+                ),
+                ["daily_profile", "stored_anomalies", "detect_prolonged_anomalies", "intraday_outliers"],
+            ),
+            "anomaly_context": (
+                lambda table, anomaly_text, weather_strs: compact_anomaly_text(
+                    anomaly_text, table, weather_strs[0]
+                ),
+                ["anomaly_table", "generate_anomaly_text", "analyse_weather_data"],
+            ),
+            "anomaly_documents": (
+                lambda table: anomaly_documents(table, self.customer_id),
+                ["anomaly_table"],
+            ),
+            # the figures are cached on everything they draw: the data, the anomalies and the plot options
+            "data_fingerprint": (
+                lambda profile: data_fingerprint(profile.df, profile.weather_df),
+                ["daily_profile"],
+            ),
+            "plot_anomalies": (
+                lambda fingerprint, profile, anomalies, prolonged_anomalies: self.cached_figure(
+                    "anomalies",
+                    data_fingerprint(fingerprint, anomalies, prolonged_anomalies, PLOT_MAX_POINTS),
+                    lambda: plot_anomalies(
+                        profile, anomalies, prolonged_anomalies, max_points=PLOT_MAX_POINTS
+                    ),
+                ),
+                ["data_fingerprint", "daily_profile", "detect_daily_anomalies", "detect_prolonged_anomalies"],
+            ),
+            "plot_weather": (
+                lambda fingerprint, profile: self.cached_figure(
+                    "weather",
+                    data_fingerprint(fingerprint, PLOT_MAX_POINTS),
+                    lambda: plot_weather(profile, max_points=PLOT_MAX_POINTS),
+                ),
+                ["data_fingerprint", "daily_profile"],
+            ),
+            "build_retriever": (self.build_retriever, ["anomaly_documents"]),
+            "initialize_chain": (self.initialize_chain, ["build_retriever", "anomaly_context"]),
+        }
+        with span("shared_startup"):
+            results, self.startup_timings = run_task_graph(tasks)
+        logger.info("Shared start-up timings:\n%s", format_timings(tasks, self.startup_timings))
+        self.profile = results["daily_profile"]
+        self.figures = {"anomalies": results["plot_anomalies"], "weather": results["plot_weather"]}
+
+    def cached_figure(self, name, fingerprint, build):
+        """The cache key and compressed spec of a figure, built only if it is not cached for this data."""
+        key = self.figure_cache.key(self.customer_id, fingerprint, name)
+        return key, self.figure_cache.get_or_build(key, build)
+
+    def stored_anomalies(self, df):
+        """
+        The daily and prolonged anomalies from the anomaly store, after adding any new readings.
+
+        Runs the detectors instead if the store can not be used, e.g. on a read-only file system.
+        """
+        try:
+            return self.anomaly_store.anomalies(self.customer_id, df)
+        except (sqlite3.Error, OSError):
+            logger.warning("Anomaly store unavailable, running the detectors", exc_info=True)
+            return detect_daily_anomalies(df), detect_prolonged_anomalies(df)
+
+    def intraday_outliers(self, df):
+        """The intraday outliers of the data, or None if the intraday detection is off."""
+        threshold = intraday_threshold()
+        return None if threshold is None else intraday_outliers(df, threshold=threshold)
+
+    def add_session(self, session_id, chat_history):
+        """
+        Makes the chat history of a session available to the chain.
 
-    def initialize_chain(self):
+        Only a weak reference is kept, so the history is released with its session.
+        """
+        self._chat_histories[session_id] = chat_history
 
-        llm = ChatOpenAI(model="gpt-4o", temperature=0)
+    def build_retriever(self, anomaly_documents):
 
         ### Construct retriever ###
-        with open("src/example_customer_documents.json") as f:
-            json_data = json.load(f)
+        return build_customer_retriever(get_embeddings(), anomaly_documents, customer_id=self.customer_id)
 
-        splitter = RecursiveJsonSplitter(max_chunk_size=300)
-        docs = splitter.create_documents(texts=[json_data])
+    def initialize_chain(self, retriever, anomaly_text):
 
-        vectorstore = InMemoryVectorStore.from_documents(documents=docs, embedding=OpenAIEmbeddings())
-        retriever = vectorstore.as_retriever()
+        self.anomaly_text = anomaly_text
+        llm = get_chat_model("gpt-4o", temperature=0, stream_usage=True)
+        self.model_name = llm.model_name
 
         ### Contextualize question ###
         contextualize_q_system_prompt = """Given a chat history and the latest user question \
@@ -89,7 +207,10 @@ class ChatbotRAG:
                 ("human", "{input}"),
             ]
         )
-        history_aware_retriever = create_history_aware_retriever(llm, retriever, contextualize_q_prompt)
+        # the question is only rewritten when it refers to earlier turns
+        history_aware_retriever = create_selective_history_aware_retriever(
+            llm, retriever, contextualize_q_prompt
+        )
 
         ### Answer question ###
         qa_system_prompt = (
@@ -125,25 +246,98 @@ class ChatbotRAG:
         rag_chain = create_retrieval_chain(history_aware_retriever, question_answer_chain)
 
         ### Statefully manage chat history ###
-        chat_history = ChatMessageHistory()
-
         self.chain = RunnableWithMessageHistory(
             rag_chain,
-            lambda session_id: chat_history,
+            lambda session_id: self._chat_histories[session_id],
             input_messages_key="input",
             history_messages_key="chat_history",
             output_messages_key="answer",
         )
 
-    def stream(self, input):
-        stream = self.chain.stream({"input": input}, {"configurable": {"session_id": "unused"}})
 
-        def stream_func():
-            for chunk in stream:
-                for key in chunk:
-                    if key == "answer":
-                        yield chunk[key]
+@st.cache_resource(show_spinner="Analysing your energy usage...")
+def get_shared_resources():
+    """The SharedResources of this process, built by the first session."""
+    return SharedResources()
+
+
+INITIAL_PROMPT = """provide a summary of the anomalies detected in the my energy usage \
+        from the smart meter data and any other relevant context."""
+
+
+class ChatbotRAG:
+    """
+    The chatbot of one session, holding only its chat history and using the shared resources for the rest.
+
+    Parameters:
+    shared (SharedResources): Shared resources, defaults to those of this process.
+    initial_summary (bool): Whether to stream the summary of the anomalies and show the figures.
+    """
+
+    def __init__(self, shared=None, initial_summary=True):
+        self.shared = shared or get_shared_resources()
+        self.session_id = uuid.uuid4().hex
+        self.chat_history = BudgetedChatHistory(self.shared.summary_llm)
+        self.shared.add_session(self.session_id, self.chat_history)
+        if not initial_summary:
+            return
+
+        ### invoke chain for initial summary ###
+        response = self.stream(INITIAL_PROMPT, cache=ResponseCache())
+        st.session_state.messages.append({"role": "assistant", "content": response})
+        # messages refer to the shared figures by name, instead of holding a copy per session
+        for name in ["anomalies", "weather"]:
+            self.show_figure(name)
+            st.session_state.messages.append({"role": "assistant", "figure": name})
+
+    def show_figure(self, name):
+        """Draws a shared figure, by the name stored in the session messages, from its cached spec."""
+        render_figure(*self.shared.figures[name])
+
+    def answer(self, input):
+        """
+        Generates the chunks of the answer to the input, adding the exchange to the chat history.
+
+        The time to the first chunk of the answer is recorded in the metrics, as the wait seen by the user.
+        """
+        stream = self.shared.chain.stream(
+            {"input": input},
+            {"configurable": {"session_id": self.session_id}, "callbacks": get_callbacks()},
+        )
+        return measure_stream(chunk["answer"] for chunk in stream if "answer" in chunk)
+
+    def aanswer(self, input):
+        """
+        Generates the chunks of the answer to the input on the event loop, like answer, for the chat server.
+
+        The chain is streamed with astream, so waiting on the LLM does not hold a thread and one process can
+        answer many sessions at once.
+        """
+        stream = self.shared.chain.astream(
+            {"input": input},
+            {"configurable": {"session_id": self.session_id}, "callbacks": get_callbacks()},
+        )
+        return ameasure_stream(chunk["answer"] async for chunk in stream if "answer" in chunk)
+
+    def stream(self, input, cache=None):
+        """
+        Streams the response to the input to the app.
+
+        If a ResponseCache is given, a response cached for the same model, anomalies and input is replayed
+        instead of invoking the chain, and new responses are added to the cache.
+        """
+        if cache is not None:
+            cache_key = cache.key(self.shared.model_name, self.shared.anomaly_text, input)
+            cached_response = cache.get(cache_key)
+            if cached_response is not None:
+                metrics.increment("cached_responses_total")
+                # keep the chat history as if the chain had answered
+                self.chat_history.add_user_message(input)
+                self.chat_history.add_ai_message(cached_response)
+                return st.write_stream(iter([cached_response]))
 
-        response = st.write_stream(stream_func)
+        response = st.write_stream(self.answer(input))
 
+        if cache is not None:
+            cache.put(cache_key, response)
         return response
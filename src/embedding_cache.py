@@ -0,0 +1,130 @@
+import fcntl
+import hashlib
+import os
+import re
+import zlib
+from contextlib import contextmanager
+
+import numpy as np
+from http_clients import get_async_http_client, get_http_client
+from langchain_core.embeddings import Embeddings
+from langchain_openai import OpenAIEmbeddings
+from store import STORE_DIR
+
+EMBEDDING_INDEX_PATH = os.path.join(STORE_DIR, "embeddings.npz")
+
+
+class HashingEmbeddings(Embeddings):
+    """
+    Local bag-of-words embeddings using the hashing trick, for running and testing without the OpenAI API.
+
+    Parameters:
+    dimensions (int): Length of the embedding vectors.
+    """
+
+    def __init__(self, dimensions=256):
+        self.dimensions = dimensions
+        self.model = f"local-hashing-{dimensions}"
+
+    def _embed(self, text):
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        for token in re.findall(r"\w+", text.lower()):
+            token_hash = zlib.crc32(token.encode())
+            vector[token_hash % self.dimensions] += 1.0 if token_hash & (1 << 31) else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts):
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+
+class PersistentEmbeddingCache(Embeddings):
+    """
+    Embeddings wrapper that stores document embeddings on disk, keyed by a hash of the model and text.
+
+    Only documents that are not in the index are passed to the wrapped embeddings, so unchanged chunks are
+    never embedded again across sessions. The index is a single .npz file that is replaced atomically. It
+    is shared by the processes of the app: new vectors are merged into the index on disk under a file lock,
+    so one process never drops the vectors that another has added since it read the index.
+
+    Parameters:
+    embeddings (Embeddings): Embeddings used for texts that are not in the index.
+    model_name (str): Name of the embedding model, part of the cache key.
+    path (str): Location of the index file.
+    """
+
+    def __init__(self, embeddings, model_name, path=EMBEDDING_INDEX_PATH):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.path = path
+        self._index = self._read()
+
+    def _read(self):
+        if not os.path.exists(self.path):
+            return {}
+        with np.load(self.path) as index:
+            return dict(zip(index["keys"].tolist(), index["vectors"], strict=True))
+
+    def _key(self, text):
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode()).hexdigest()
+
+    def embed_documents(self, texts):
+        keys = [self._key(text) for text in texts]
+        missing = {key: text for key, text in zip(keys, texts, strict=True) if key not in self._index}
+        if missing:
+            # other processes may have embedded them since the index was read
+            self._index = {**self._read(), **self._index}
+            missing = {key: text for key, text in missing.items() if key not in self._index}
+        if missing:
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            self._index.update(zip(missing, np.asarray(vectors, dtype=np.float32), strict=True))
+            self._save()
+        return [self._index[key].tolist() for key in keys]
+
+    def embed_query(self, text):
+        return self.embeddings.embed_query(text)
+
+    @contextmanager
+    def _locked(self):
+        """Holds the lock file of the index, so only one process at a time merges its vectors into it."""
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(f"{self.path}.lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _save(self):
+        with self._locked():
+            self._index = {**self._read(), **self._index}
+            temporary_path = f"{self.path}.{os.getpid()}.tmp.npz"
+            np.savez(
+                temporary_path,
+                keys=np.array(list(self._index)),
+                vectors=np.stack(list(self._index.values())),
+            )
+            os.replace(temporary_path, self.path)
+
+
+def get_embeddings():
+    """
+    Embeddings for the customer document retriever, backed by the persistent embedding cache.
+
+    The EMBEDDINGS_PROVIDER environment variable selects "openai" (the default) or "local" embeddings, and
+    EMBEDDINGS_DIMENSIONS sets the length of the local embedding vectors (256 by default). The OpenAI
+    embeddings share the pooled HTTP clients of the process.
+    """
+    provider = os.getenv("EMBEDDINGS_PROVIDER", "openai")
+    if provider == "openai":
+        embeddings = OpenAIEmbeddings(
+            http_client=get_http_client(), http_async_client=get_async_http_client()
+        )
+    elif provider == "local":
+        embeddings = HashingEmbeddings(int(os.getenv("EMBEDDINGS_DIMENSIONS", "256")))
+    else:
+        raise ValueError(f"Unknown embeddings provider: {provider}")
+    return PersistentEmbeddingCache(embeddings, embeddings.model)
@@ -0,0 +1,120 @@
+import hashlib
+import json
+import os
+import time
+import zlib
+
+import pandas as pd
+import streamlit as st
+from store import STORE_DIR
+
+FIGURE_CACHE_DIR = os.path.join(STORE_DIR, "figures")
+
+# part of every cache key, increase it when a change to the plotting code changes the figures
+FIGURE_CACHE_VERSION = 2
+
+
+def data_fingerprint(*objects):
+    """Hash of the contents of DataFrames, indexes and other objects that a figure is built from."""
+    digest = hashlib.sha256()
+    for obj in objects:
+        if isinstance(obj, pd.DataFrame | pd.Series | pd.Index):
+            digest.update(pd.util.hash_pandas_object(obj).to_numpy().tobytes())
+        else:
+            digest.update(repr(obj).encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class FigureCache:
+    """
+    Compressed JSON specs of figures on disk with TTL and LRU eviction, keyed on the customer, the
+    fingerprint of everything drawn on the figure and the figure.
+
+    A figure is only built and serialized once for the same inputs, and is kept in memory as its compressed
+    spec rather than as a Figure object. If the cache directory can not be written, e.g. on a read-only
+    file system, specs are still returned but not stored.
+
+    Parameters:
+    directory (str): Directory of the cached specs.
+    ttl (float): Seconds after which an unused spec expires.
+    max_entries (int): Maximum number of specs kept, the least recently used are evicted first.
+    """
+
+    def __init__(self, directory=FIGURE_CACHE_DIR, ttl=7 * 24 * 60 * 60, max_entries=200):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+    @staticmethod
+    def key(customer_id, fingerprint, name):
+        """Cache key of a figure of a customer's data, for the current version of the plotting code."""
+        return hashlib.sha256(
+            f"{FIGURE_CACHE_VERSION}\0{customer_id}\0{fingerprint}\0{name}".encode()
+        ).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json.z")
+
+    def get(self, key):
+        """The compressed spec of a figure, or None if it is not cached."""
+        try:
+            with open(self._path(key), "rb") as f:
+                spec = f.read()
+        except OSError:
+            return None
+        # the modification time records the last use, for the eviction
+        try:
+            os.utime(self._path(key))
+        except OSError:
+            pass
+        return spec
+
+    def put(self, key, figure):
+        """Serializes, compresses and stores a figure, returning its compressed spec."""
+        spec = zlib.compress(figure.to_json().encode())
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            temporary_path = f"{self._path(key)}.{os.getpid()}.tmp"
+            with open(temporary_path, "wb") as f:
+                f.write(spec)
+            os.replace(temporary_path, self._path(key))
+            self._evict()
+        except OSError:
+            pass
+        return spec
+
+    def _evict(self):
+        """Deletes the specs unused for longer than the TTL, then the least recently used over max_entries."""
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".json.z"):
+                try:
+                    entries.append((entry.stat().st_mtime, entry.path))
+                except OSError:
+                    pass
+        entries.sort(reverse=True)
+        expired = time.time() - self.ttl
+        for position, (last_used, path) in enumerate(entries):
+            if position >= self.max_entries or last_used <= expired:
+                try:
+                    os.remove(path)
+                except OSError:
+                    # another process may have evicted it already
+                    pass
+
+    def get_or_build(self, key, build):
+        """The compressed spec of a figure, calling build to create the figure if it is not cached."""
+        spec = self.get(key)
+        return spec if spec is not None else self.put(key, build())
+
+
+@st.cache_data(show_spinner=False, max_entries=100)
+def render_figure(key, _spec):
+    """
+    Draws a figure from its cache key and compressed spec.
+
+    Streamlit replays the chart drawn by a cached function, so a figure is only parsed and serialized the
+    first time its key is drawn, and reruns cost the same however many points the figure has.
+    """
+    st.plotly_chart(json.loads(zlib.decompress(_spec)))
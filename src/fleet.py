@@ -0,0 +1,172 @@
+import numpy as np
+import pandas as pd
+
+
+def daily_usage_matrix(data, readings_per_day=1):
+    """
+    Aggregates fleet smart meter data to a days x meters matrix of daily usage.
+
+    Parameters:
+    data (pd.DataFrame or np.ndarray): Wide DataFrame with a datetime index and one column per meter, or a
+        2-D array with one row per reading and one column per meter.
+    readings_per_day (int): Number of array rows per day, e.g. 96 for 15 minute readings. Ignored for
+        DataFrames, which are resampled by their index.
+
+    Returns:
+    tuple: The daily usage matrix, the day labels (dates, or day positions for arrays) and the meter ids.
+    """
+    if isinstance(data, pd.DataFrame):
+        df_daily = data.resample("D").sum()
+        return df_daily.to_numpy(dtype=float), df_daily.index, data.columns.to_numpy()
+
+    usage = np.asarray(data, dtype=float)
+    if usage.ndim != 2:
+        raise ValueError(f"Expected a 2-D days x meters array, got {usage.ndim} dimensions")
+    n_days, remainder = divmod(usage.shape[0], readings_per_day)
+    if remainder:
+        raise ValueError(
+            f"{usage.shape[0]} rows is not a whole number of days of {readings_per_day} readings"
+        )
+    # missing readings count as zero usage, matching resample("D").sum()
+    daily = np.nansum(usage.reshape(n_days, readings_per_day, usage.shape[1]), axis=1)
+    return daily, np.arange(n_days), np.arange(usage.shape[1])
+
+
+def daily_zscores(daily):
+    """Per meter z-scores of a days x meters matrix, NaN for meters with constant usage."""
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return (daily - daily.mean(axis=0)) / daily.std(axis=0)
+
+
+def prolonged_anomaly_coverage(zscores, min_consecutive_days=3, zscore_threshold=1.5):
+    """
+    Marks the days of each meter that fall in a prolonged anomaly.
+
+    The column-wise equivalent of utils.prolonged_anomaly_windows, where the binary search over the running
+    minimum of the prefix sums is done for every day and meter at once.
+
+    Parameters:
+    zscores (np.ndarray): Days x meters matrix of daily z-scores.
+    min_consecutive_days (int): Minimum number of consecutive days to consider as a prolonged anomaly.
+    zscore_threshold (float): Z-score threshold for detecting anomalies.
+
+    Returns:
+    np.ndarray: Boolean days x meters matrix, True on days inside a prolonged anomaly window.
+    """
+    n_days, n_meters = zscores.shape
+    if n_days < min_consecutive_days:
+        return np.zeros(zscores.shape, dtype=bool)
+
+    # work on meters x days so that every scan runs along contiguous memory, and treat meters with NaN
+    # z-scores (constant usage) as never exceeding the threshold
+    excess = np.nan_to_num(np.ascontiguousarray(zscores.T) - zscore_threshold, nan=-1.0)
+    prefix = np.zeros((n_meters, n_days + 1))
+    np.cumsum(excess, axis=1, out=prefix[:, 1:])
+    running_min = np.minimum.accumulate(prefix, axis=1)
+    return prefix_coverage(prefix, running_min, min_consecutive_days).T
+
+
+def prefix_coverage(prefix, running_min, min_consecutive_days, suffix_max=None):
+    """
+    Marks the days in a prolonged anomaly window, from the prefix sums of the excess z-scores.
+
+    A day is covered by a window of at least min_consecutive_days days in one of two ways. Either the
+    window ends min_consecutive_days - 1 or more days after it, and then any start up to the day will do,
+    so it is covered when the lowest prefix sum up to the day is below the highest from that end on. Or
+    the window ends within min_consecutive_days - 1 days after it, and then it is the longest window
+    ending on that day that must be long enough. Both are array comparisons, with no search per day.
+
+    Split out of prolonged_anomaly_coverage so that the prefix sums, their running minimum and suffix
+    maximum can be shared by several minimum window lengths, e.g. in a parameter sweep.
+
+    Parameters:
+    prefix (np.ndarray): Rows x (days + 1) matrix of the prefix sums of the daily z-scores minus the
+        threshold, starting from 0.
+    running_min (np.ndarray): Running minimum of prefix along the days.
+    min_consecutive_days (int): Minimum number of consecutive days to consider as a prolonged anomaly.
+    suffix_max (np.ndarray): Maximum of prefix from each day on, computed if not given.
+
+    Returns:
+    np.ndarray: Boolean rows x days matrix, True on days inside a prolonged anomaly window.
+    """
+    n_rows, n_days = prefix.shape[0], prefix.shape[1] - 1
+    length = min_consecutive_days
+    covered = np.zeros((n_rows, n_days), dtype=bool)
+    if n_days < length:
+        return covered
+    if suffix_max is None:
+        suffix_max = np.maximum.accumulate(prefix[:, ::-1], axis=1)[:, ::-1]
+
+    # windows ending length - 1 or more days after the day
+    covered[:, : n_days - length + 1] = running_min[:, : n_days - length + 1] < suffix_max[:, length:]
+
+    # windows of at least length days ending on each of the next length - 1 days
+    long_enough = np.zeros((n_rows, n_days), dtype=bool)
+    long_enough[:, length - 1 :] = running_min[:, : n_days - length + 1] < prefix[:, length:]
+    for shift in range(length - 1):
+        covered[:, : n_days - shift] |= long_enough[:, shift:]
+    return covered
+
+
+def detect_fleet_anomalies(
+    data,
+    readings_per_day=1,
+    daily_zscore_threshold=2,
+    min_consecutive_days=3,
+    zscore_threshold=1.5,
+    meter_chunk_size=4096,
+):
+    """
+    Detects daily and prolonged anomalies for many smart meters at once.
+
+    Applies the same rules as utils.detect_daily_anomalies and utils.detect_prolonged_anomalies to every
+    meter, using array operations across all meters instead of a Python loop over customers.
+
+    Parameters:
+    data (pd.DataFrame or np.ndarray): Wide DataFrame with a datetime index and one column per meter, or a
+        2-D array with one row per reading and one column per meter.
+    readings_per_day (int): Number of array rows per day. Ignored for DataFrames.
+    daily_zscore_threshold (float): Z-score threshold for daily anomalies.
+    min_consecutive_days (int): Minimum number of consecutive days to consider as a prolonged anomaly.
+    zscore_threshold (float): Z-score threshold for prolonged anomalies.
+    meter_chunk_size (int): Number of meters processed together, bounding the working memory.
+
+    Returns:
+    pd.DataFrame: One row per anomaly with the columns meter_id, kind ("daily" or "prolonged"), start and
+        end (inclusive), sorted by meter.
+    """
+    daily, days, meter_ids = daily_usage_matrix(data, readings_per_day)
+
+    meters, kinds, starts, ends = [], [], [], []
+    for first in range(0, daily.shape[1], meter_chunk_size):
+        zscores = daily_zscores(daily[:, first : first + meter_chunk_size])
+
+        # daily anomalies start and end on the same day
+        meter, day = np.nonzero((zscores > daily_zscore_threshold).T)
+        meters.append(meter + first)
+        kinds.append(np.zeros(len(meter), dtype=np.int8))
+        starts.append(day)
+        ends.append(day)
+
+        # transpose so the window edges come out ordered by meter, then day
+        coverage = prolonged_anomaly_coverage(zscores, min_consecutive_days, zscore_threshold).T
+        edges = np.diff(coverage.astype(np.int8), axis=1, prepend=0, append=0)
+        meter, start = np.nonzero(edges == 1)
+        _, end = np.nonzero(edges == -1)
+        meters.append(meter + first)
+        kinds.append(np.ones(len(meter), dtype=np.int8))
+        starts.append(start)
+        ends.append(end - 1)
+
+    meters = np.concatenate(meters)
+    order = np.argsort(meters, kind="stable")
+    return pd.DataFrame(
+        {
+            "meter_id": meter_ids[meters[order]],
+            "kind": pd.Categorical.from_codes(
+                np.concatenate(kinds)[order], categories=["daily", "prolonged"]
+            ),
+            "start": days[np.concatenate(starts)[order]],
+            "end": days[np.concatenate(ends)[order]],
+        }
+    )
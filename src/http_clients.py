@@ -0,0 +1,44 @@
+import os
+import threading
+
+import httpx
+import openai
+
+_lock = threading.Lock()
+_clients = {}
+
+
+def http_limits():
+    """
+    Connection limits of the pooled clients.
+
+    OPENAI_MAX_CONNECTIONS (20 by default) caps the concurrent requests of each client, and further
+    requests wait in the pool's queue for a free connection, so a burst of sessions can not open more
+    connections to the API than this. The other settings are those of the OpenAI SDK's own clients.
+    """
+    max_connections = int(os.getenv("OPENAI_MAX_CONNECTIONS", "20"))
+    return httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+
+
+def _pooled(name, factory):
+    # the SDK's client classes keep its timeout and redirect settings, which a plain httpx client would
+    # replace with the much shorter httpx defaults
+    with _lock:
+        if name not in _clients:
+            _clients[name] = factory(limits=http_limits())
+        return _clients[name]
+
+
+def get_http_client():
+    """The process-wide HTTP client of the OpenAI chat models and embeddings, reusing its connections."""
+    return _pooled("sync", openai.DefaultHttpxClient)
+
+
+def get_async_http_client():
+    """
+    The process-wide asyncio HTTP client of the OpenAI chat models and embeddings.
+
+    Its connections belong to the event loop that first uses them, so the async methods of the models
+    should only be called from one event loop, e.g. that of the chat server.
+    """
+    return _pooled("async", openai.DefaultAsyncHttpxClient)
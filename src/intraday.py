@@ -0,0 +1,252 @@
+import os
+
+import numpy as np
+import pandas as pd
+from metrics import metrics
+
+# 15 minute readings
+SLOTS_PER_DAY = 96
+
+# scale of the median absolute deviation that matches the standard deviation of normal data
+MAD_SCALE = 1.4826
+
+
+def slot_matrix(df, slots_per_day=SLOTS_PER_DAY):
+    """
+    Reshapes the smart meter readings into a days x slots matrix, by the time of day of each reading.
+
+    Every day from the first to the last reading gets a row, slots without a reading are NaN and readings
+    falling in the same slot are summed.
+
+    Parameters:
+    df (pd.DataFrame): DataFrame containing the energy usage data with a datetime index.
+    slots_per_day (int): Number of slots per day, e.g. 96 for 15 minute readings.
+
+    Returns:
+    tuple: The days (DatetimeIndex) and the days x slots_per_day usage matrix.
+    """
+    usage = df["usage"]
+    if usage.empty:
+        return pd.DatetimeIndex([]), np.empty((0, slots_per_day))
+    first_day = usage.index.min().floor("D")
+    positions = ((usage.index - first_day) // (pd.Timedelta(days=1) / slots_per_day)).to_numpy()
+    values = usage.to_numpy(dtype=float)
+    valid = np.isfinite(values)
+
+    n_days = positions.max() // slots_per_day + 1
+    size = n_days * slots_per_day
+    sums = np.bincount(positions[valid], weights=values[valid], minlength=size)
+    counts = np.bincount(positions[valid], minlength=size)
+    matrix = np.where(counts > 0, sums, np.nan).reshape(n_days, slots_per_day)
+    return pd.date_range(first_day, periods=n_days, freq="D"), matrix
+
+
+def _nanmedian(values, count):
+    """Median of each row of a 2-D array with count finite values, ignoring NaN, from one sort of the rows."""
+    # NaN sorts last, so the finite values of each row come first
+    ordered = np.sort(values, axis=1)
+    lower = np.take_along_axis(ordered, np.maximum((count - 1) // 2, 0)[:, None], axis=1)[:, 0]
+    upper = np.take_along_axis(ordered, (count // 2).clip(max=values.shape[1] - 1)[:, None], axis=1)[:, 0]
+    return (lower + upper) / 2
+
+
+def slot_baseline(matrix, weeks=4, slot_window=2, min_history=10, chunk_days=366):
+    """
+    Rolling day-of-week baseline of every slot of a days x slots matrix.
+
+    The history of a slot is the same slot and the slot_window slots either side of it, on the same weekday
+    of each of the previous weeks. The baseline is the median of the history and the spread is its median
+    absolute deviation, so earlier anomalies do not inflate them. The history of every slot is sliced at
+    once from a sliding window view of the flattened matrix, so neighbouring slots run over midnight, and
+    the days are processed in chunks of chunk_days to bound the memory.
+
+    Parameters:
+    matrix (np.ndarray): Days x slots usage matrix from slot_matrix, with consecutive days as rows.
+    weeks (int): Number of previous weeks in the history.
+    slot_window (int): Number of neighbouring slots either side in the history.
+    min_history (int): Minimum number of readings in the history, slots with fewer get a NaN baseline.
+    chunk_days (int): Number of days processed at a time.
+
+    Returns:
+    tuple: The days x slots baseline and median absolute deviation matrices.
+    """
+    n_days, slots_per_day = matrix.shape
+    flat = matrix.ravel()
+    width = 2 * slot_window + 1
+    # slots before the first day are NaN padding, and windows[i] holds the width slots from padded[i]
+    pad = 7 * slots_per_day * weeks + slot_window
+    padded = np.concatenate((np.full(pad, np.nan), flat, np.full(slot_window, np.nan))).astype(np.float32)
+    windows = np.lib.stride_tricks.sliding_window_view(padded, width)
+    baseline = np.full(flat.size, np.nan)
+    deviation = np.full(flat.size, np.nan)
+    # the windows centred on the same slot of each previous week
+    shifts = [pad - 7 * slots_per_day * week - slot_window for week in range(1, weeks + 1)]
+    chunk = chunk_days * slots_per_day
+    for first in range(0, flat.size, chunk):
+        last = min(first + chunk, flat.size)
+        history = np.concatenate([windows[first + shift : last + shift] for shift in shifts], axis=1)
+        count = np.isfinite(history).sum(axis=1)
+        median = _nanmedian(history, count)
+        mad = _nanmedian(np.abs(history - median[:, None]), count)
+        enough = count >= min_history
+        baseline[first : first + chunk] = np.where(enough, median, np.nan)
+        deviation[first : first + chunk] = np.where(enough, mad, np.nan)
+    return baseline.reshape(n_days, slots_per_day), deviation.reshape(n_days, slots_per_day)
+
+
+@metrics.timed("intraday_outliers")
+def intraday_outliers(
+    df,
+    threshold=3.5,
+    weeks=4,
+    slot_window=2,
+    min_history=10,
+    min_slots=2,
+    min_scale=0.05,
+    slots_per_day=SLOTS_PER_DAY,
+):
+    """
+    Finds short periods of unusually high usage within days, e.g. an appliance left on overnight.
+
+    The readings are reshaped with slot_matrix and every slot is scored against its slot_baseline with the
+    robust z-score (usage - baseline) / (1.4826 * MAD), in one pass over the matrix. The spread is at least
+    min_scale times the mean reading, so slots that barely vary (e.g. zero usage at night) do not flag
+    every small change. Consecutive slots above the threshold, over midnight too, form one outlier, and
+    outliers shorter than min_slots slots are dropped.
+
+    Parameters:
+    df (pd.DataFrame): DataFrame containing the energy usage data with a datetime index.
+    threshold (float): Robust z-score threshold for a slot.
+    weeks (int): Number of previous weeks in the baseline of each slot.
+    slot_window (int): Number of neighbouring slots either side in the baseline.
+    min_history (int): Minimum number of readings in the baseline of a slot for it to be scored.
+    min_slots (int): Minimum number of consecutive slots in an outlier.
+    min_scale (float): Smallest spread as a fraction of the mean reading.
+    slots_per_day (int): Number of slots per day, e.g. 96 for 15 minute readings.
+
+    Returns:
+    pd.DataFrame: One row per outlier in date order, with the columns start and end (the start of the first
+        slot and the end of the last), slots, usage, baseline (the summed baselines of the slots) and max_zscore.
+    """
+    days, matrix = slot_matrix(df, slots_per_day)
+    columns = ["start", "end", "slots", "usage", "baseline", "max_zscore"]
+    if len(days) == 0:
+        return pd.DataFrame(columns=columns)
+    baseline, deviation = slot_baseline(matrix, weeks, slot_window, min_history)
+
+    usage = matrix.ravel()
+    baseline = baseline.ravel()
+    scale = np.maximum(MAD_SCALE * deviation.ravel(), min_scale * np.nanmean(usage))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        scores = (usage - baseline) / scale
+    flagged = scores > threshold
+
+    # runs of consecutive flagged slots, with their sums and maximums from one reduction over the run bounds
+    edges = np.diff(np.concatenate(([0], flagged.astype(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    long_enough = ends - starts >= min_slots
+    starts, ends = starts[long_enough], ends[long_enough]
+    bounds = np.stack([starts, ends], axis=1).ravel()
+
+    def run_reduce(reduce, values):
+        # the reductions between one run's end and the next run's start are discarded, a pad keeps the
+        # bounds in range
+        if len(bounds) == 0:
+            return np.empty(0)
+        return reduce.reduceat(np.append(values, np.nan), bounds)[::2]
+
+    slot = pd.Timedelta(days=1) / slots_per_day
+    return pd.DataFrame(
+        {
+            "start": days[0] + starts * slot,
+            "end": days[0] + ends * slot,
+            "slots": ends - starts,
+            "usage": run_reduce(np.add, usage),
+            "baseline": run_reduce(np.add, baseline),
+            "max_zscore": run_reduce(np.maximum, scores),
+        },
+        columns=columns,
+    )
+
+
+@metrics.timed("detect_intraday_anomalies")
+def detect_intraday_anomalies(df, **kwargs):
+    """
+    Detects the days with intraday outliers in energy usage from smart meter data.
+
+    Returns the dates like detect_daily_anomalies, so the days can be plotted and described in the same
+    way. The keyword arguments are those of intraday_outliers.
+    """
+    outliers = intraday_outliers(df, **kwargs)
+    if outliers.empty:
+        return None
+    return _outlier_days(outliers)
+
+
+def _outlier_days(outliers):
+    """The days touched by each outlier, including both days of one that runs over midnight."""
+    last = outliers["end"] - pd.Timedelta(1, unit="ns")
+    days = np.concatenate([outliers["start"].dt.floor("D"), last.dt.floor("D")])
+    return pd.DatetimeIndex(np.unique(days))
+
+
+def add_intraday_days(anomalies, outliers):
+    """
+    The daily anomaly dates together with the days of the intraday outliers, or None if there are none.
+
+    Parameters:
+    anomalies (pd.DatetimeIndex): Dates of the daily anomalies, or None.
+    outliers (pd.DataFrame): The intraday_outliers, or None.
+    """
+    if outliers is None or outliers.empty:
+        return anomalies
+    days = _outlier_days(outliers)
+    return days if anomalies is None else pd.DatetimeIndex(anomalies).union(days)
+
+
+# what the intraday outliers are, for the system prompt
+INTRADAY_ANOMALY_GUIDANCE = (
+    "These are short periods of unusually high usage within a day, compared with the same time of day on the "
+    "same weekday of the previous weeks. They can be caused by a device being left on, e.g. overnight."
+)
+
+
+def intraday_anomaly_text(outliers, max_outliers=10):
+    """
+    Description of the intraday outliers for the system prompt, the largest excess usage first.
+
+    Parameters:
+    outliers (pd.DataFrame): The intraday_outliers.
+    max_outliers (int): Number of outliers described, the others are only counted.
+
+    Returns:
+    str: The description, empty if there are no outliers.
+    """
+    if outliers is None or outliers.empty:
+        return ""
+    excess = outliers["usage"] - outliers["baseline"]
+    largest = outliers.loc[excess.sort_values(ascending=False, kind="stable").index[:max_outliers]]
+    descriptions = [
+        f"[{start:%Y-%m-%d %H:%M} - {end:%H:%M}: usage {usage:.1f} against {baseline:.1f} usually]"
+        for start, end, usage, baseline in zip(
+            largest["start"],
+            largest["end"],
+            largest["usage"],
+            largest["baseline"],
+            strict=True,
+        )
+    ]
+    text = f"{INTRADAY_ANOMALY_GUIDANCE} Intraday anomalies have been detected: {', '.join(descriptions)}"
+    if len(outliers) > len(largest):
+        text += f" and {len(outliers) - len(largest)} more"
+    return text + "."
+
+
+def intraday_threshold():
+    """
+    Robust z-score threshold of the intraday detection in the chatbot, from the INTRADAY_ANOMALY_THRESHOLD
+    environment variable, or None when it is not set and the intraday detection is off.
+    """
+    threshold = os.getenv("INTRADAY_ANOMALY_THRESHOLD")
+    return float(threshold) if threshold else None
@@ -0,0 +1,134 @@
+"""
+Load tests the chatbot with concurrent sessions, using the local chat model and embeddings.
+
+The shared resources are built once, then each session starts a ChatbotRAG, streams the initial summary of
+the anomalies and asks follow-up questions, as a user of the app would. Sessions run on threads, up to
+--concurrency at a time, like the script threads of concurrent Streamlit users, or with --async as tasks on
+one event loop, like the sessions of the chat server. Reports the sessions per second, the time to the
+first token of the answers, the latency of each stage and the memory. No OpenAI requests are made. Run
+from the repository root:
+
+    python src/load_test.py --sessions 100 --concurrency 10 20 50 --token-latency 0.02
+    python src/load_test.py --sessions 500 --concurrency 100 500 --async
+"""
+
+import argparse
+import asyncio
+import os
+import resource
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# the local models stand in for the OpenAI API, so no key is needed and no requests are made
+os.environ["LLM_PROVIDER"] = "local"
+os.environ["EMBEDDINGS_PROVIDER"] = "local"
+os.environ.setdefault("OPENAI_API_KEY", "unused")
+
+from chatbot_rag_anomaly_detection import INITIAL_PROMPT, ChatbotRAG, SharedResources  # noqa: E402
+from metrics import metrics  # noqa: E402
+
+# follow-up questions, the second and third refer to earlier turns so they are rewritten before retrieval
+QUESTIONS = [
+    "Why was my usage so high in the middle of August?",
+    "Could that be the air conditioner?",
+    "What else could it be?",
+]
+
+
+def peak_memory():
+    """Peak resident memory of this process in MB."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10
+
+
+def run_session(shared, turns):
+    """Runs one session, returning the time to first token and the total time of each of its answers."""
+    session = ChatbotRAG(shared, initial_summary=False)
+    timings = []
+    for question in [INITIAL_PROMPT] + [QUESTIONS[i % len(QUESTIONS)] for i in range(turns)]:
+        start = time.perf_counter()
+        first_token = None
+        for _ in session.answer(question):
+            if first_token is None:
+                first_token = time.perf_counter() - start
+        timings.append((first_token, time.perf_counter() - start))
+    return timings
+
+
+async def arun_session(shared, turns, slots):
+    """Runs one session on the event loop, once one of the concurrency slots is free, like run_session."""
+    async with slots:
+        session = ChatbotRAG(shared, initial_summary=False)
+        timings = []
+        for question in [INITIAL_PROMPT] + [QUESTIONS[i % len(QUESTIONS)] for i in range(turns)]:
+            start = time.perf_counter()
+            first_token = None
+            async for _ in session.aanswer(question):
+                if first_token is None:
+                    first_token = time.perf_counter() - start
+            timings.append((first_token, time.perf_counter() - start))
+        return timings
+
+
+async def aload_test(shared, sessions, concurrency, turns):
+    """Runs the sessions as tasks on one event loop, up to concurrency at a time."""
+    slots = asyncio.Semaphore(concurrency)
+    return await asyncio.gather(*[arun_session(shared, turns, slots) for _ in range(sessions)])
+
+
+def load_test(shared, sessions, concurrency, turns, use_async=False):
+    """Runs the sessions, returning the wall time and the timings of every answer."""
+    start = time.perf_counter()
+    if use_async:
+        results = asyncio.run(aload_test(shared, sessions, concurrency, turns))
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(lambda _: run_session(shared, turns), range(sessions)))
+    return time.perf_counter() - start, np.array([timing for result in results for timing in result])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--sessions", type=int, default=100, help="number of sessions per run")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 50], help="concurrent sessions")
+    parser.add_argument("--turns", type=int, default=2, help="follow-up questions per session")
+    parser.add_argument("--token-latency", type=float, default=0.02, help="seconds per generated token")
+    parser.add_argument("--first-token-latency", type=float, default=0.3, help="seconds to the first token")
+    parser.add_argument("--response-tokens", type=int, default=100, help="tokens per response")
+    parser.add_argument("--dimensions", type=int, default=256, help="length of the embedding vectors")
+    parser.add_argument(
+        "--async", dest="use_async", action="store_true", help="run sessions on an event loop"
+    )
+    args = parser.parse_args()
+
+    os.environ["LOCAL_LLM_TOKEN_LATENCY"] = str(args.token_latency)
+    os.environ["LOCAL_LLM_FIRST_TOKEN_LATENCY"] = str(args.first_token_latency)
+    os.environ["LOCAL_LLM_RESPONSE_TOKENS"] = str(args.response_tokens)
+    os.environ["EMBEDDINGS_DIMENSIONS"] = str(args.dimensions)
+
+    start = time.perf_counter()
+    shared = SharedResources()
+    print(f"shared start-up: {time.perf_counter() - start:.2f}s, peak memory {peak_memory():.0f}MB")
+    print(
+        f"{'concurrency':>11} {'sessions/s':>10} {'ttft p50':>9} {'ttft p99':>9} {'answer p50':>10} "
+        f"{'answer p99':>10} {'peak memory':>11}"
+    )
+    for concurrency in args.concurrency:
+        seconds, timings = load_test(shared, args.sessions, concurrency, args.turns, args.use_async)
+        ttft = np.percentile(timings[:, 0], [50, 99])
+        total = np.percentile(timings[:, 1], [50, 99])
+        print(
+            f"{concurrency:>11} {args.sessions / seconds:>10.2f} {ttft[0]:>8.3f}s {ttft[1]:>8.3f}s "
+            f"{total[0]:>9.3f}s {total[1]:>9.3f}s {peak_memory():>9.0f}MB"
+        )
+
+    print("\nstage latencies over all runs")
+    for stage, stats in metrics.summary()["stages"].items():
+        print(f"{stage:<30} {stats['count']:>7} {stats['p50']:>8.3f}s {stats['p99']:>8.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""
+Reports the memory used by the chatbot as the number of concurrent sessions grows.
+
+The shared resources (data, anomalies, figures, retriever, LLM clients and chain) are built once, then
+sessions with a few turns of chat history are added, and the traced memory is reported per session. The
+memory of one set of shared resources is what every session used before they were shared. No LLM requests
+are made, and the documents are embedded locally. Run from the repository root:
+
+    python src/memory_report.py --sessions 1 10 100 1000
+"""
+
+import argparse
+import os
+import tracemalloc
+
+# the clients are created but never called, so no key is needed
+os.environ.setdefault("OPENAI_API_KEY", "unused")
+os.environ.setdefault("EMBEDDINGS_PROVIDER", "local")
+
+from chatbot_rag_anomaly_detection import ChatbotRAG, SharedResources  # noqa: E402
+
+QUESTION = "Why was my usage so high on the 15th, could it be the air conditioner? " * 2
+ANSWER = "The anomaly on the 15th coincides with the hottest day of the month. " * 10
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 10, 100, 1000], help="session counts")
+    parser.add_argument("--turns", type=int, default=3, help="exchanges in each session's chat history")
+    args = parser.parse_args()
+
+    tracemalloc.start()
+    shared = SharedResources()
+    shared_bytes = tracemalloc.get_traced_memory()[0]
+
+    print(f"shared resources: {shared_bytes / 2**20:.2f}MB, paid once per process instead of per session")
+    print(f"{'sessions':>10} {'per session':>14} {'total':>10} {'unshared':>10}")
+    sessions = []
+    for n_sessions in sorted(args.sessions):
+        while len(sessions) < n_sessions:
+            session = ChatbotRAG(shared, initial_summary=False)
+            for _ in range(args.turns):
+                session.chat_history.add_user_message(QUESTION)
+                session.chat_history.add_ai_message(ANSWER)
+            sessions.append(session)
+        total = tracemalloc.get_traced_memory()[0]
+        per_session = (total - shared_bytes) / n_sessions
+        print(
+            f"{n_sessions:>10} {per_session / 2**10:>12.1f}KB {total / 2**20:>8.2f}MB "
+            f"{(shared_bytes + per_session) * n_sessions / 2**20:>8.2f}MB"
+        )
+    tracemalloc.stop()
+
+
+if __name__ == "__main__":
+    main()
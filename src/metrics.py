@@ -0,0 +1,235 @@
+import functools
+import json
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+class Metrics:
+    """
+    Process-wide stage latencies and counters.
+
+    The most recent durations of each stage are kept for percentiles, so memory stays bounded however long
+    the process runs, and every observation can also be appended to a JSON lines file for later analysis.
+    Safe to use from several threads, e.g. concurrent sessions and the start-up task graph.
+
+    Parameters:
+    max_samples (int): Number of recent durations kept per stage.
+    jsonl_path (str): File that every observation is appended to, or None.
+    """
+
+    def __init__(self, max_samples=10000, jsonl_path=None):
+        self.max_samples = max_samples
+        self.jsonl_path = jsonl_path
+        self._lock = threading.Lock()
+        self._samples = defaultdict(lambda: deque(maxlen=self.max_samples))
+        self._totals = defaultdict(lambda: [0, 0.0])
+        # counter values by name and label set, so each combination of labels is a series of its own
+        self._counters = defaultdict(float)
+
+    def observe(self, stage, seconds, **labels):
+        """Records the duration of a stage."""
+        with self._lock:
+            self._samples[stage].append(seconds)
+            total = self._totals[stage]
+            total[0] += 1
+            total[1] += seconds
+        self._log({"type": "stage", "stage": stage, "seconds": seconds, **labels})
+
+    def increment(self, counter, value=1, **labels):
+        """Adds to a counter, e.g. of tokens or retrieved chunks, in the series of its labels."""
+        key = (counter, frozenset((name, str(label)) for name, label in labels.items()))
+        with self._lock:
+            self._counters[key] += value
+        self._log({"type": "counter", "counter": counter, "value": value, **labels})
+
+    def _log(self, record):
+        if self.jsonl_path is None:
+            return
+        record["time"] = time.time()
+        with self._lock, open(self.jsonl_path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+
+    @contextmanager
+    def timer(self, stage, **labels):
+        """Records the duration of the enclosed block as a stage, also when it raises."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start, **labels)
+
+    def timed(self, stage):
+        """Decorator recording the duration of each call of a function as a stage."""
+
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.timer(stage):
+                    return function(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def summary(self):
+        """
+        Count, total, mean, maximum and percentiles of the recent durations of each stage, and the counters.
+
+        Returns:
+        dict: "stages" maps each stage to its statistics in seconds, "counters" maps each counter to its
+            series, a list with the labels and value of each combination of labels it was incremented with.
+        """
+        with self._lock:
+            samples = {stage: np.array(values) for stage, values in self._samples.items()}
+            totals = {stage: tuple(total) for stage, total in self._totals.items()}
+            series = [(name, sorted(labels), value) for (name, labels), value in self._counters.items()]
+        counters = defaultdict(list)
+        for name, labels, value in sorted(series, key=lambda item: item[:2]):
+            counters[name].append({"labels": dict(labels), "value": value})
+        stages = {}
+        for stage, values in sorted(samples.items()):
+            count, total = totals[stage]
+            stages[stage] = {
+                "count": count,
+                "sum": total,
+                "mean": total / count,
+                "max": float(values.max()),
+                **{f"p{round(q * 100)}": float(np.quantile(values, q)) for q in QUANTILES},
+            }
+        return {"stages": stages, "counters": dict(counters)}
+
+    def to_jsonl(self):
+        """The summary as JSON lines, one per stage and counter series."""
+        summary = self.summary()
+        lines = [json.dumps({"stage": stage, **stats}) for stage, stats in summary["stages"].items()]
+        lines += [
+            json.dumps({"counter": name, **series})
+            for name, counter in summary["counters"].items()
+            for series in counter
+        ]
+        return "".join(line + "\n" for line in lines)
+
+    def to_prometheus(self):
+        """The summary in the Prometheus text exposition format."""
+        summary = self.summary()
+        lines = [
+            "# HELP stage_duration_seconds Duration of each stage, quantiles over the recent observations.",
+            "# TYPE stage_duration_seconds summary",
+        ]
+        for stage, stats in summary["stages"].items():
+            for q in QUANTILES:
+                labels = _prometheus_labels({"stage": stage, "quantile": q})
+                lines.append(f"stage_duration_seconds{labels} {stats[f'p{round(q * 100)}']}")
+            labels = _prometheus_labels({"stage": stage})
+            lines.append(f"stage_duration_seconds_sum{labels} {stats['sum']}")
+            lines.append(f"stage_duration_seconds_count{labels} {stats['count']}")
+        for name, counter in summary["counters"].items():
+            lines.append(f"# TYPE {name} counter")
+            lines += [f"{name}{_prometheus_labels(series['labels'])} {series['value']}" for series in counter]
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """Writes the summary to a file, in the Prometheus format unless the path ends in .jsonl."""
+        text = self.to_jsonl() if path.endswith(".jsonl") else self.to_prometheus()
+        with open(path + ".tmp", "w") as f:
+            f.write(text)
+        os.replace(path + ".tmp", path)
+
+    def serve(self, port, host="127.0.0.1"):
+        """
+        Serves the summary over HTTP from a background thread, in the Prometheus format at /metrics and as
+        JSON lines at /metrics.jsonl.
+
+        Returns:
+        ThreadingHTTPServer: The running server, stopped with shutdown().
+        """
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/metrics":
+                    body, content_type = metrics.to_prometheus(), "text/plain; version=0.0.4"
+                elif self.path == "/metrics.jsonl":
+                    body, content_type = metrics.to_jsonl(), "application/jsonl"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.end_headers()
+                self.wfile.write(body.encode())
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+def _prometheus_labels(labels):
+    """Labels in the Prometheus text format, e.g. {stage="llm"}, or an empty string without labels."""
+    if not labels:
+        return ""
+
+    def escape(value):
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in labels.items()) + "}"
+
+
+def measure_stream(chunks, name="answer"):
+    """
+    Passes through the chunks of a streamed response, recording the time to the first chunk, the total
+    streaming time and the number of chunks.
+
+    The clock starts when the first chunk is requested, so the time to first chunk includes all the work
+    of a lazy stream before its first output, e.g. retrieval.
+    """
+    start = time.perf_counter()
+    n_chunks = 0
+    for chunk in chunks:
+        if n_chunks == 0:
+            metrics.observe(f"{name}_time_to_first_chunk", time.perf_counter() - start)
+        n_chunks += 1
+        yield chunk
+    metrics.observe(f"{name}_stream_total", time.perf_counter() - start)
+    metrics.increment(f"{name}_chunks_total", n_chunks)
+
+
+async def ameasure_stream(chunks, name="answer"):
+    """measure_stream for the chunks of an asynchronous stream."""
+    start = time.perf_counter()
+    n_chunks = 0
+    async for chunk in chunks:
+        if n_chunks == 0:
+            metrics.observe(f"{name}_time_to_first_chunk", time.perf_counter() - start)
+        n_chunks += 1
+        yield chunk
+    metrics.observe(f"{name}_stream_total", time.perf_counter() - start)
+    metrics.increment(f"{name}_chunks_total", n_chunks)
+
+
+# the METRICS_JSONL_PATH environment variable turns on the log of every observation
+metrics = Metrics(jsonl_path=os.getenv("METRICS_JSONL_PATH") or None)
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def start_metrics_server():
+    """Serves the metrics on the port in the METRICS_PORT environment variable, if set, once per process."""
+    global _server
+    port = os.getenv("METRICS_PORT")
+    with _server_lock:
+        if port and _server is None:
+            _server = metrics.serve(int(port))
+    return _server
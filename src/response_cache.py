@@ -0,0 +1,73 @@
+import hashlib
+import os
+import sqlite3
+import time
+from contextlib import closing, contextmanager
+
+from store import STORE_DIR
+
+RESPONSE_CACHE_PATH = os.path.join(STORE_DIR, "responses.sqlite")
+
+
+class ResponseCache:
+    """
+    On-disk SQLite cache of chatbot responses with TTL and LRU eviction.
+
+    Parameters:
+    path (str): Location of the SQLite database.
+    ttl (float): Seconds after which a cached response expires.
+    max_entries (int): Maximum number of responses kept, the least recently used are evicted first.
+    """
+
+    def __init__(self, path=RESPONSE_CACHE_PATH, ttl=7 * 24 * 60 * 60, max_entries=1000):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connect() as connection:
+            connection.execute(
+                """CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    response TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_used_at REAL NOT NULL
+                )"""
+            )
+
+    @contextmanager
+    def _connect(self):
+        """A connection in a transaction, committed or rolled back and then closed when the block exits."""
+        with closing(sqlite3.connect(self.path, timeout=10)) as connection, connection:
+            yield connection
+
+    @staticmethod
+    def key(*parts):
+        """Cache key from the parts that determine a response, e.g. the model, anomaly text and prompt."""
+        return hashlib.sha256("\0".join(parts).encode()).hexdigest()
+
+    def get(self, key):
+        """Returns the cached response for key, or None if it is missing or expired."""
+        now = time.time()
+        with self._connect() as connection:
+            row = connection.execute(
+                "SELECT response FROM responses WHERE key = ? AND created_at > ?", (key, now - self.ttl)
+            ).fetchone()
+            if row is None:
+                return None
+            connection.execute("UPDATE responses SET last_used_at = ? WHERE key = ?", (now, key))
+        return row[0]
+
+    def put(self, key, response):
+        """Stores a response, then evicts expired and least recently used responses."""
+        now = time.time()
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)", (key, response, now, now)
+            )
+            connection.execute("DELETE FROM responses WHERE created_at <= ?", (now - self.ttl,))
+            connection.execute(
+                """DELETE FROM responses WHERE key NOT IN (
+                    SELECT key FROM responses ORDER BY last_used_at DESC LIMIT ?
+                )""",
+                (self.max_entries,),
+            )
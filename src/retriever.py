@@ -0,0 +1,246 @@
+import json
+import os
+import re
+
+import numpy as np
+import pandas as pd
+from langchain_core.retrievers import BaseRetriever
+from langchain_text_splitters import RecursiveJsonSplitter
+from metrics import metrics
+from pydantic import ConfigDict, PrivateAttr
+from scipy import sparse
+from store import DEFAULT_METER
+
+DOCUMENTS_PATH = "src/example_customer_documents.json"
+
+
+def load_customer_documents(path=DOCUMENTS_PATH, customer_id=DEFAULT_METER, max_chunk_size=300):
+    """
+    Splits the customer documents JSON into chunks that keep the metadata of their record.
+
+    Each record (an interaction or document, e.g. customer_agent_interactions/0) is split on its own, so
+    every chunk can be tagged with the record's section, key, datetime and customer id. Chunks keep the
+    nested JSON form of the whole-file split, with the section and record keys as the outer keys.
+
+    Parameters:
+    path (str): JSON file with sections of records keyed by id.
+    customer_id (str): Customer of records without a "customer_id" field, e.g. when the file holds the
+        documents of a single customer. Defaults to the meter of the chatbot, as in
+        anomaly_context.anomaly_documents. With None, such records have no customer_id.
+    max_chunk_size (int): Maximum chunk size in characters.
+
+    Returns:
+    list: Documents with the metadata section, record, datetime (ISO format or None) and customer_id (if
+        known).
+    """
+    with open(path) as f:
+        json_data = json.load(f)
+
+    splitter = RecursiveJsonSplitter(max_chunk_size=max_chunk_size)
+    docs = []
+    for section, records in json_data.items():
+        for key, record in records.items():
+            metadata = {
+                "section": section,
+                "record": key,
+                "datetime": record.get("datetime"),
+            }
+            record_customer_id = record.get("customer_id", customer_id)
+            if record_customer_id is not None:
+                metadata["customer_id"] = str(record_customer_id)
+            if metadata["datetime"] is not None:
+                metadata["datetime"] = pd.Timestamp(metadata["datetime"]).isoformat()
+            docs += splitter.create_documents(texts=[{section: {key: record}}], metadatas=[metadata])
+    return docs
+
+
+def tokenize(text):
+    """Lower case word tokens, as used by HashingEmbeddings."""
+    return re.findall(r"\w+", text.lower())
+
+
+class NumpyRetriever(BaseRetriever):
+    """
+    Top-k retriever over an in-memory float32 matrix of normalized document embeddings.
+
+    The query is scored against every document with one matrix-vector product, and the top k are selected
+    with argpartition rather than a full sort. Documents can be filtered by customer and date before
+    scoring, and dense scores can be blended with BM25 lexical scores, or replaced by them when there are
+    no embeddings, so retrieval works without any embeddings API call.
+
+    Build with from_documents. The filter fields apply to every query, and can be overridden per query:
+    retriever.invoke(query, customer_id="42", start="2024-08-01").
+
+    Parameters:
+    k (int): Number of documents returned.
+    bm25_weight (float): Weight of the BM25 scores, from 0 (dense only) to 1 (lexical only).
+    customer_id (str): Only return documents of this customer.
+    start (str): Only return documents dated on or after this date.
+    end (str): Only return documents dated on or before this date.
+    """
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    k: int = 4
+    bm25_weight: float = 0.0
+    customer_id: str | None = None
+    start: str | None = None
+    end: str | None = None
+
+    _documents: list = PrivateAttr(default_factory=list)
+    _embeddings: object = PrivateAttr(default=None)
+    _matrix: np.ndarray | None = PrivateAttr(default=None)
+    _customer_ids: np.ndarray = PrivateAttr(default=None)
+    _datetimes: np.ndarray = PrivateAttr(default=None)
+    _vocabulary: dict = PrivateAttr(default_factory=dict)
+    _bm25: sparse.csc_matrix = PrivateAttr(default=None)
+
+    @classmethod
+    def from_documents(cls, documents, embeddings=None, k1=1.5, b=0.75, **kwargs):
+        """
+        Indexes documents for retrieval.
+
+        Parameters:
+        documents (list): Documents, with optional customer_id and datetime metadata.
+        embeddings (Embeddings): Embeddings of the documents and queries, or None for BM25 only.
+        k1 (float): BM25 term frequency saturation.
+        b (float): BM25 document length normalization.
+        kwargs: Fields of the retriever, e.g. k, bm25_weight or the filters.
+        """
+        if embeddings is None:
+            kwargs["bm25_weight"] = 1.0
+        retriever = cls(**kwargs)
+        retriever._documents = list(documents)
+        retriever._embeddings = embeddings
+        texts = [doc.page_content for doc in retriever._documents]
+
+        if embeddings is not None and retriever.bm25_weight < 1:
+            with metrics.timer("embed_documents"):
+                matrix = np.ascontiguousarray(embeddings.embed_documents(texts), dtype=np.float32)
+            metrics.increment("embedded_chunks_total", len(texts))
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            retriever._matrix = matrix / np.where(norms > 0, norms, 1)
+
+        # documents without a customer id are kept as None, which no customer filter matches
+        retriever._customer_ids = np.array(
+            [doc.metadata.get("customer_id") for doc in documents], dtype=object
+        )
+        retriever._datetimes = pd.to_datetime(
+            [doc.metadata.get("datetime") for doc in documents], errors="coerce"
+        ).to_numpy()
+
+        if retriever.bm25_weight > 0:
+            retriever._index_bm25(texts, k1, b)
+        return retriever
+
+    def _index_bm25(self, texts, k1, b):
+        # document x term matrix of BM25 term weights, so a query scores every document by summing the
+        # columns of its terms
+        vocabulary = {}
+        tokens = [
+            [vocabulary.setdefault(token, len(vocabulary)) for token in tokenize(text)] for text in texts
+        ]
+        self._vocabulary = vocabulary
+        if not vocabulary:
+            self._bm25 = sparse.csc_matrix((len(texts), 0), dtype=np.float32)
+            return
+        lengths = np.array([len(ids) for ids in tokens], dtype=float)
+
+        # term counts of each document, from the unique (document, term) pairs
+        pairs = np.unique(
+            np.repeat(np.arange(len(texts)), lengths.astype(np.intp)) * len(vocabulary)
+            + np.fromiter((i for ids in tokens for i in ids), dtype=np.intp, count=int(lengths.sum())),
+            return_counts=True,
+        )
+        rows, terms = np.divmod(pairs[0], len(vocabulary))
+        tf = pairs[1]
+        document_frequency = np.bincount(terms, minlength=len(vocabulary))
+        idf = np.log1p((len(texts) - document_frequency + 0.5) / (document_frequency + 0.5))
+        length_norm = k1 * (1 - b + b * lengths / max(lengths.mean(), 1))
+        weights = idf[terms] * tf * (k1 + 1) / (tf + length_norm[rows])
+        self._bm25 = sparse.csc_matrix(
+            (weights.astype(np.float32), (rows, terms)), shape=(len(texts), len(vocabulary))
+        )
+
+    def _candidates(self, customer_id, start, end):
+        """Positions of the documents that pass the filters, or None if there are no filters."""
+        if customer_id is None and start is None and end is None:
+            return None
+        mask = np.ones(len(self._documents), dtype=bool)
+        if customer_id is not None:
+            mask &= self._customer_ids == str(customer_id)
+        # undated documents are excluded by date filters, NaT never compares as true
+        if start is not None:
+            mask &= self._datetimes >= pd.Timestamp(start).to_datetime64()
+        if end is not None:
+            mask &= self._datetimes <= pd.Timestamp(end).to_datetime64()
+        return np.flatnonzero(mask)
+
+    def scores(self, query, candidates=None):
+        """Relevance of the candidate documents (all if None) to the query, higher is better."""
+        n = len(self._documents) if candidates is None else len(candidates)
+        scores = np.zeros(n, dtype=np.float32)
+        if self._matrix is not None:
+            with metrics.timer("embed_query"):
+                vector = np.asarray(self._embeddings.embed_query(query), dtype=np.float32)
+            vector /= np.linalg.norm(vector) or 1
+            # gathering the candidate rows only pays off when the filters leave few of them
+            if candidates is not None and len(candidates) < len(self._documents) // 4:
+                similarity = self._matrix[candidates] @ vector
+            else:
+                similarity = self._matrix @ vector
+                similarity = similarity if candidates is None else similarity[candidates]
+            scores += (1 - self.bm25_weight) * similarity
+        if self._bm25 is not None:
+            ids = [self._vocabulary[t] for t in tokenize(query) if t in self._vocabulary]
+            if ids:
+                lexical = np.asarray(self._bm25[:, ids].sum(axis=1)).ravel()
+                lexical = lexical if candidates is None else lexical[candidates]
+                # scaled to [0, 1] to be comparable to the cosine similarities
+                top = lexical.max(initial=0)
+                if top > 0:
+                    scores += self.bm25_weight * lexical / top
+        return scores
+
+    def _get_relevant_documents(self, query, *, run_manager, k=None, **filters):
+        k = k or self.k
+        candidates = self._candidates(
+            filters.get("customer_id", self.customer_id),
+            filters.get("start", self.start),
+            filters.get("end", self.end),
+        )
+        if candidates is not None and len(candidates) == 0:
+            return []
+        scores = self.scores(query, candidates)
+        if len(scores) > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            top = np.arange(len(scores))
+        top = top[np.argsort(-scores[top], kind="stable")]
+        positions = top if candidates is None else candidates[top]
+        return [self._documents[i] for i in positions]
+
+
+def build_customer_retriever(embeddings=None, extra_documents=(), customer_id=None, **kwargs):
+    """
+    The retriever over the customer documents used by the chatbots.
+
+    The RETRIEVER_BM25_WEIGHT environment variable sets the weight of the lexical scores, 0 (the default)
+    for dense retrieval only. At 1, retrieval is lexical only and the documents are not embedded.
+
+    Parameters:
+    embeddings (Embeddings): Embeddings of the documents and queries, e.g. from get_embeddings().
+    extra_documents (list): Documents retrieved along with the customer documents, e.g. from
+        anomaly_context.anomaly_documents.
+    customer_id (str): Customer of the documents file, and the only customer whose documents are
+        retrieved, or None for every document and the default meter as the customer of the file.
+    kwargs: Fields of the retriever, e.g. k or the date filters.
+    """
+    bm25_weight = float(os.getenv("RETRIEVER_BM25_WEIGHT", "0"))
+    if bm25_weight >= 1:
+        embeddings = None
+    with metrics.timer("chunk_documents"):
+        documents = load_customer_documents(customer_id=customer_id or DEFAULT_METER) + list(extra_documents)
+    return NumpyRetriever.from_documents(
+        documents, embeddings, bm25_weight=bm25_weight, customer_id=customer_id, **kwargs
+    )
@@ -0,0 +1,261 @@
+import glob
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+STORE_DIR = "src/.store"
+DEFAULT_METER = "default"
+
+
+class ColumnarStore:
+    """
+    Binary columnar copy of a time series CSV, stored as memory-mapped .npy files.
+
+    Timestamps are stored as int64 epoch nanoseconds and values as float32, sorted by meter and then time,
+    with an offsets array giving the rows of each meter so that one meter can be opened without reading
+    the others.
+
+    Parameters:
+    store_dir (str): Directory containing the store, as written by build_store.
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, "metadata.json")) as f:
+            self.metadata = json.load(f)
+        self.meters = self.metadata["meters"]
+        self.columns = self.metadata["columns"]
+        self._offsets = np.load(os.path.join(store_dir, "offsets.npy"))
+        self._arrays = {
+            name: np.load(os.path.join(store_dir, f"{name}.npy"), mmap_mode="r")
+            for name in ["timestamps"] + self.columns
+        }
+
+    def meter_slice(self, meter_id=None):
+        """
+        Zero-copy views of the timestamps and value columns of one meter.
+
+        Parameters:
+        meter_id (str): Meter to open, or None for a store with a single meter.
+
+        Returns:
+        dict: Memory-mapped arrays keyed by "timestamps" and the value column names.
+        """
+        if meter_id is None:
+            if len(self.meters) != 1:
+                raise ValueError(f"Store has {len(self.meters)} meters, a meter_id is required")
+            meter_id = self.meters[0]
+        position = self.meters.index(str(meter_id))
+        start, end = self._offsets[position], self._offsets[position + 1]
+        return {name: array[start:end] for name, array in self._arrays.items()}
+
+    def to_frame(self, meter_id=None):
+        """The data of one meter as a DataFrame with a datetime index, like the source CSV."""
+        arrays = self.meter_slice(meter_id)
+        index = pd.DatetimeIndex(
+            arrays.pop("timestamps").astype("datetime64[ns]"), name=self.metadata["index_name"]
+        )
+        return pd.DataFrame(arrays, index=index)
+
+
+def store_path(csv_path):
+    """
+    The store directory used for a CSV file.
+
+    It is named after the file and a hash of its absolute path, size and modification time, so files of
+    the same name in other directories never share a store, and a changed file gets a new one.
+    """
+    signature = _source_signature(csv_path)
+    key = json.dumps(signature, sort_keys=True)
+    digest = hashlib.sha256(key.encode()).hexdigest()[:16]
+    return os.path.join(STORE_DIR, f"{_source_name(csv_path)}-{digest}")
+
+
+def _source_name(csv_path):
+    return os.path.splitext(os.path.basename(csv_path))[0]
+
+
+def _source_signature(csv_path):
+    stat = os.stat(csv_path)
+    return {
+        "source_path": os.path.realpath(csv_path),
+        "source_mtime_ns": stat.st_mtime_ns,
+        "source_size": stat.st_size,
+    }
+
+
+def _write_file(path, write):
+    """
+    Writes a file through a uniquely named temporary file in the same directory, so concurrent builds
+    never write to the same file and readers only ever see complete files.
+    """
+    fd, temporary_path = tempfile.mkstemp(
+        dir=os.path.dirname(path), prefix=f"{os.path.basename(path)}.", suffix=".tmp"
+    )
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+        os.replace(temporary_path, path)
+    except BaseException:
+        os.unlink(temporary_path)
+        raise
+
+
+def _remove_stale_stores(source_path, store_dir):
+    """Removes the stores of earlier versions of a CSV file, once its current store is complete."""
+    pattern = os.path.join(os.path.dirname(store_dir), f"{_source_name(source_path)}-*")
+    for other_dir in glob.glob(pattern):
+        if os.path.abspath(other_dir) == os.path.abspath(store_dir):
+            continue
+        try:
+            with open(os.path.join(other_dir, "metadata.json")) as f:
+                stale = json.load(f).get("source_path") == source_path
+        except (OSError, ValueError):
+            continue
+        if stale:
+            shutil.rmtree(other_dir, ignore_errors=True)
+
+
+def build_store(csv_path, store_dir=None, meter_column=None):
+    """
+    Converts a CSV with a datetime index column into a columnar store.
+
+    Parameters:
+    csv_path (str): CSV file with the timestamps in the first column.
+    store_dir (str): Directory to write the store to, defaults to store_path(csv_path).
+    meter_column (str): Column identifying the meter of each row, or None if the file holds one meter.
+
+    Returns:
+    ColumnarStore: The newly written store.
+    """
+    default_dir = store_dir is None
+    store_dir = store_dir or store_path(csv_path)
+    signature = _source_signature(csv_path)
+    df = pd.read_csv(csv_path, index_col=0, parse_dates=True)
+
+    if meter_column is None:
+        meter_ids = np.zeros(len(df), dtype=np.intp)
+        meters = [DEFAULT_METER]
+    else:
+        meters, meter_ids = np.unique(df.pop(meter_column).astype(str), return_inverse=True)
+        meters = meters.tolist()
+
+    timestamps = df.index.as_unit("ns").asi8
+    order = np.lexsort((timestamps, meter_ids))
+    offsets = np.searchsorted(meter_ids[order], np.arange(len(meters) + 1))
+
+    arrays = {"timestamps": timestamps[order], "offsets": offsets.astype(np.int64)}
+    for column in df.columns:
+        arrays[column] = df[column].to_numpy(dtype=np.float32)[order]
+    os.makedirs(store_dir, exist_ok=True)
+    for name, array in arrays.items():
+        _write_file(os.path.join(store_dir, f"{name}.npy"), lambda f, array=array: np.save(f, array))
+
+    # the metadata is written last, so a store is only used once all of its arrays are complete
+    metadata = {
+        **signature,
+        "index_name": df.index.name,
+        "columns": df.columns.tolist(),
+        "meters": meters,
+    }
+    _write_file(os.path.join(store_dir, "metadata.json"), lambda f: f.write(json.dumps(metadata).encode()))
+    if default_dir:
+        _remove_stale_stores(signature["source_path"], store_dir)
+    return ColumnarStore(store_dir)
+
+
+def open_store(csv_path, store_dir=None):
+    """Opens the store of a CSV file, or returns None if it is missing or older than the CSV."""
+    try:
+        store = ColumnarStore(store_dir or store_path(csv_path))
+    except (OSError, ValueError, KeyError):
+        return None
+    signature = _source_signature(csv_path)
+    if any(store.metadata.get(key) != value for key, value in signature.items()):
+        return None
+    return store
+
+
+def load_columnar(csv_path, meter_id=None, meter_column=None):
+    """
+    Loads a time series CSV through its columnar store, building the store on first use.
+
+    Falls back to parsing the CSV if the store can not be written, e.g. on a read-only file system.
+
+    Parameters:
+    csv_path (str): CSV file with the timestamps in the first column.
+    meter_id (str): Meter to load, or None for a file with a single meter.
+    meter_column (str): Column identifying the meter of each row, or None if the file holds one meter.
+
+    Returns:
+    pd.DataFrame: DataFrame with a datetime index and float32 value columns.
+    """
+    store = open_store(csv_path)
+    if store is None:
+        try:
+            store = build_store(csv_path, meter_column=meter_column)
+        except OSError:
+            df = pd.read_csv(csv_path, index_col=0, parse_dates=True)
+            if meter_column is not None:
+                df = df[df.pop(meter_column).astype(str) == str(meter_id)]
+            return df.astype(np.float32)
+    return store.to_frame(meter_id)
+
+
+def aggregate_daily(csv_path, how="sum", chunksize=1_000_000, meter_column=None, value_column="usage"):
+    """
+    Aggregates a time series CSV to daily values without loading the whole file into memory.
+
+    The file is read in chunks of rows, and each chunk is reduced to partial daily sums (and counts, for
+    means) before the next is read. A day split across two chunks gets a partial aggregate from each, which
+    are added together at the end, so the rows need not be sorted. Peak memory is bounded by the chunk size
+    and the size of the daily result, however long the file is.
+
+    Parameters:
+    csv_path (str): CSV file with the timestamps in the first column.
+    how (str): "sum" for daily totals, as resample("D").sum(), or "mean" for daily means.
+    chunksize (int): Number of rows read at a time.
+    meter_column (str): Column identifying the meter of each row, or None for a file with one column per
+        value.
+    value_column (str): Column aggregated per meter when meter_column is given.
+
+    Returns:
+    pd.DataFrame: Daily values with a daily datetime index, with the value columns of the file, or one
+        column per meter if meter_column is given.
+    """
+    if how not in ("sum", "mean"):
+        raise ValueError(f"Unknown aggregation {how}, use 'sum' or 'mean'")
+
+    sums, counts = [], []
+    for chunk in pd.read_csv(csv_path, index_col=0, parse_dates=True, chunksize=chunksize):
+        day = chunk.index.floor("D")
+        if meter_column is None:
+            days = chunk.groupby(day)
+        else:
+            days = chunk.groupby([day, chunk[meter_column].astype(str)])[value_column]
+        sums.append(days.sum())
+        if how == "mean":
+            counts.append(days.count())
+    if not sums:
+        raise ValueError(f"{csv_path} has no rows")
+
+    # combine the partial aggregates of days that were split across chunks
+    levels = list(range(sums[0].index.nlevels))
+    daily = pd.concat(sums).groupby(level=levels).sum()
+    if how == "mean":
+        daily = daily / pd.concat(counts).groupby(level=levels).sum()
+    if meter_column is not None:
+        daily = daily.unstack()
+        daily.columns.name = None
+
+    # include days without readings, as resampling does
+    daily = daily.asfreq("D")
+    if how == "sum":
+        daily = daily.fillna(0.0)
+    daily.index.name = None
+    return daily
@@ -0,0 +1,242 @@
+import math
+from bisect import bisect_left
+from dataclasses import dataclass
+
+import pandas as pd
+from utils import detect_daily_anomalies, detect_prolonged_anomalies
+
+NS_PER_DAY = 24 * 60 * 60 * 10**9
+
+
+@dataclass
+class AnomalyEvent:
+    """
+    An anomaly detected when a day of readings is completed.
+
+    The kind is "daily" for a single day, "prolonged" when a prolonged anomaly starts, and "prolonged_end"
+    when it ends, with the start and end of the whole episode.
+    """
+
+    kind: str
+    start: pd.Timestamp
+    end: pd.Timestamp
+    zscore: float
+
+
+class StreamingAnomalyDetector:
+    """
+    Incremental anomaly detector for live smart meter readings.
+
+    Readings are folded into a running total for the current day. When the first reading of a later day
+    arrives the day is completed: its total is added to running (Welford) mean and variance statistics and
+    checked for daily and prolonged anomalies against the statistics so far, in O(1) amortized time per
+    reading.
+
+    A prolonged anomaly is reported once, with a "prolonged" event on the day a window ending on that day
+    first exceeds the threshold. The detector then keeps it open, extending it while windows ending on
+    each new day still exceed the threshold, and reports its full extent with a "prolonged_end" event on
+    the first day that none does.
+
+    The daily totals of every completed day are kept, so the state and its checkpoints grow by one number
+    per day. They are needed to rebuild the hull from a checkpoint, and daily_anomalies and
+    prolonged_anomalies replay them through the batch functions, in time linear in the history.
+
+    As in the batch functions in utils, z-scores are relative to the whole history, so an anomaly emitted
+    early on may no longer stand once more history has been seen. daily_anomalies and prolonged_anomalies
+    give the same results as utils.detect_daily_anomalies and utils.detect_prolonged_anomalies over all
+    the readings received so far.
+
+    Parameters:
+    min_consecutive_days (int): Minimum number of consecutive days to consider as a prolonged anomaly.
+    zscore_threshold (float): Z-score threshold for prolonged anomalies.
+    daily_zscore_threshold (float): Z-score threshold for daily anomalies.
+    """
+
+    def __init__(self, min_consecutive_days=3, zscore_threshold=1.5, daily_zscore_threshold=2):
+        self.min_consecutive_days = min_consecutive_days
+        self.zscore_threshold = zscore_threshold
+        self.daily_zscore_threshold = daily_zscore_threshold
+
+        # daily totals of completed days, counted from first_day
+        self.first_day = None
+        self.daily_totals = []
+        self.current_total = 0.0
+
+        # Welford statistics of the completed daily totals
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+        # cumulative usage before each completed day, and the lower convex hull of the points
+        # (day, cumulative usage) that can start a prolonged anomaly ending on the latest day
+        self._cumulative = [0.0]
+        self._hull = []
+        self._hull_slopes = []
+
+        # first and last day of the open prolonged anomaly, or None
+        self.open_window = None
+
+    def update(self, timestamp, usage):
+        """
+        Adds a reading to the detector.
+
+        Parameters:
+        timestamp (datetime-like): Time of the reading. Readings must arrive in time order.
+        usage (float): Energy usage of the reading.
+
+        Returns:
+        list: AnomalyEvents for the days completed by this reading.
+        """
+        day = pd.Timestamp(timestamp).value // NS_PER_DAY
+        if self.first_day is None:
+            self.first_day = day
+        current_day = self.first_day + len(self.daily_totals)
+        if day < current_day:
+            raise ValueError(f"Reading at {timestamp} is earlier than the current day")
+
+        # complete the current day and any days without readings, which have zero usage
+        events = []
+        for _ in range(day - current_day):
+            events.extend(self._complete_day(self.current_total))
+            self.current_total = 0.0
+
+        # missing readings count as zero usage, matching resample("D").sum()
+        if not math.isnan(usage):
+            self.current_total += usage
+        return events
+
+    def _complete_day(self, total):
+        """Adds a completed daily total to the statistics and checks it for anomalies."""
+        self.daily_totals.append(total)
+        self._cumulative.append(self._cumulative[-1] + total)
+
+        self.count += 1
+        delta = total - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (total - self.mean)
+
+        # a prolonged anomaly ending on the new day can start on any day that leaves at least
+        # min_consecutive_days days in the window
+        latest_start = len(self.daily_totals) - self.min_consecutive_days
+        if latest_start >= 0:
+            self._add_to_hull(latest_start)
+
+        std = math.sqrt(self.m2 / self.count)
+        if std == 0:
+            return []
+
+        events = []
+        day = self._date(len(self.daily_totals) - 1)
+        zscore = (total - self.mean) / std
+        if zscore > self.daily_zscore_threshold:
+            events.append(AnomalyEvent("daily", day, day, zscore))
+
+        if latest_start >= 0:
+            events.extend(self._check_prolonged(self.mean + self.zscore_threshold * std, std))
+        return events
+
+    def _check_prolonged(self, daily_limit, std):
+        """Opens, extends or closes the prolonged anomaly with the most anomalous window ending today."""
+        last = len(self.daily_totals) - 1
+        start = self._most_anomalous_start(daily_limit)
+        zscore = self._window_zscore(start, last, std)
+        if zscore > self.zscore_threshold:
+            if self.open_window is None:
+                self.open_window = (start, last)
+                return [AnomalyEvent("prolonged", self._date(start), self._date(last), zscore)]
+            # the window ending on the new day overlaps the open one, as windows ending on the previous day
+            # did, so they merge as in utils.prolonged_anomaly_windows
+            self.open_window = (min(self.open_window[0], start), last)
+            return []
+        if self.open_window is None:
+            return []
+        first, end = self.open_window
+        self.open_window = None
+        return [
+            AnomalyEvent(
+                "prolonged_end", self._date(first), self._date(end), self._window_zscore(first, end, std)
+            )
+        ]
+
+    def _window_zscore(self, first, last, std):
+        """Z-score of the mean daily usage from day first to day last (inclusive)."""
+        mean_usage = (self._cumulative[last + 1] - self._cumulative[first]) / (last + 1 - first)
+        return (mean_usage - self.mean) / std
+
+    def _add_to_hull(self, start):
+        """Adds a window start to the lower convex hull, in amortized O(1) time."""
+        point = (start, self._cumulative[start])
+        while self._hull_slopes and self._slope(self._hull[-1], point) <= self._hull_slopes[-1]:
+            self._hull.pop()
+            self._hull_slopes.pop()
+        if self._hull:
+            self._hull_slopes.append(self._slope(self._hull[-1], point))
+        self._hull.append(point)
+
+    @staticmethod
+    def _slope(first, second):
+        return (second[1] - first[1]) / (second[0] - first[0])
+
+    def _most_anomalous_start(self, daily_limit):
+        """
+        The window start that maximises the usage above daily_limit up to the latest day.
+
+        Minimises cumulative usage - daily_limit * day over the hull, where the hull slopes cross daily_limit.
+        """
+        return self._hull[bisect_left(self._hull_slopes, daily_limit)][0]
+
+    def _date(self, day):
+        return pd.Timestamp((self.first_day + day) * NS_PER_DAY)
+
+    def daily_usage(self):
+        """Daily usage received so far, including the current partial day, as a DataFrame."""
+        if self.first_day is None:
+            return pd.DataFrame({"usage": []}, index=pd.DatetimeIndex([], freq="D"))
+        totals = self.daily_totals + [self.current_total]
+        index = pd.date_range(self._date(0), periods=len(totals), freq="D")
+        return pd.DataFrame({"usage": totals}, index=index)
+
+    def daily_anomalies(self):
+        """Daily anomalies over all readings so far, as returned by utils.detect_daily_anomalies."""
+        return detect_daily_anomalies(self.daily_usage())
+
+    def prolonged_anomalies(self):
+        """Prolonged anomalies over all readings so far, as returned by utils.detect_prolonged_anomalies."""
+        return detect_prolonged_anomalies(
+            self.daily_usage(), self.min_consecutive_days, self.zscore_threshold
+        )
+
+    def to_dict(self):
+        """Serializable detector state, for checkpointing."""
+        return {
+            "min_consecutive_days": self.min_consecutive_days,
+            "zscore_threshold": self.zscore_threshold,
+            "daily_zscore_threshold": self.daily_zscore_threshold,
+            "first_day": self.first_day,
+            "daily_totals": list(self.daily_totals),
+            "current_total": self.current_total,
+            "count": self.count,
+            "mean": self.mean,
+            "m2": self.m2,
+            "open_window": self.open_window,
+        }
+
+    @classmethod
+    def from_dict(cls, state):
+        """Restores a detector from to_dict, rebuilding the cumulative usage and hull from the totals."""
+        detector = cls(
+            state["min_consecutive_days"], state["zscore_threshold"], state["daily_zscore_threshold"]
+        )
+        detector.first_day = state["first_day"]
+        detector.daily_totals = list(state["daily_totals"])
+        detector.current_total = state["current_total"]
+        detector.count = state["count"]
+        detector.mean = state["mean"]
+        detector.m2 = state["m2"]
+        open_window = state.get("open_window")
+        detector.open_window = None if open_window is None else tuple(open_window)
+        for total in detector.daily_totals:
+            detector._cumulative.append(detector._cumulative[-1] + total)
+        for start in range(len(detector.daily_totals) - detector.min_consecutive_days + 1):
+            detector._add_to_hull(start)
+        return detector
@@ -0,0 +1,139 @@
+"""
+Stub of the OpenAI chat completions and embeddings API, for testing the chatbot and its pooled HTTP clients
+without the OpenAI API.
+
+Chat completions are the responses of LocalChatModel, streamed at the given rate as the API does, and
+embeddings are HashingEmbeddings vectors. GET /stats returns the number of requests to each route and of
+distinct client connections the server has seen, so the reuse of the pooled connections can be checked. Run
+from the repository root, then point the OpenAI clients at it:
+
+    python src/stub_openai_server.py --port 8081 --token-latency 0.02
+
+    OPENAI_BASE_URL=http://localhost:8081/v1 OPENAI_API_KEY=unused python src/chat_server.py
+"""
+
+import argparse
+import asyncio
+import json
+from collections import Counter
+
+from aiohttp import web
+from chat_models import LocalChatModel
+from embedding_cache import HashingEmbeddings
+from langchain_core.messages import convert_to_messages
+
+
+class StubOpenAIServer:
+    """
+    Handlers of the stub API, counting the requests to each route and the client connections.
+
+    Parameters:
+    token_latency (float): Seconds taken to generate each token after the first.
+    first_token_latency (float): Seconds taken before the first token.
+    response_tokens (int): Number of tokens in each response.
+    dimensions (int): Length of the embedding vectors.
+    """
+
+    def __init__(self, token_latency=0.02, first_token_latency=0.3, response_tokens=100, dimensions=256):
+        self.model = LocalChatModel(
+            token_latency=token_latency,
+            first_token_latency=first_token_latency,
+            response_tokens=response_tokens,
+        )
+        self.embeddings = HashingEmbeddings(dimensions)
+        self.requests = Counter()
+        self.connections = set()
+
+    def app(self):
+        """The aiohttp application serving the stub API."""
+        app = web.Application()
+        app.add_routes(
+            [
+                web.post("/v1/chat/completions", self.chat_completions),
+                web.post("/v1/embeddings", self.create_embeddings),
+                web.get("/stats", self.stats),
+            ]
+        )
+        return app
+
+    def _count(self, request):
+        self.requests[request.path] += 1
+        self.connections.add(request.transport.get_extra_info("peername"))
+
+    async def chat_completions(self, request):
+        self._count(request)
+        body = await request.json()
+        tokens, usage = self.model._respond(convert_to_messages(body["messages"]))
+        usage = {
+            "prompt_tokens": usage["input_tokens"],
+            "completion_tokens": usage["output_tokens"],
+            "total_tokens": usage["total_tokens"],
+        }
+        completion = {"id": "chatcmpl-stub", "created": 0, "model": body["model"]}
+        if not body.get("stream"):
+            await asyncio.sleep(self.model.first_token_latency + self.model.token_latency * (len(tokens) - 1))
+            message = {"role": "assistant", "content": "".join(tokens)}
+            choice = {"index": 0, "message": message, "finish_reason": "stop"}
+            return web.json_response(
+                {**completion, "object": "chat.completion", "choices": [choice], "usage": usage}
+            )
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        chunk = {**completion, "object": "chat.completion.chunk"}
+        for i, token in enumerate(tokens):
+            await asyncio.sleep(self.model.first_token_latency if i == 0 else self.model.token_latency)
+            choice = {"index": 0, "delta": {"role": "assistant", "content": token}, "finish_reason": None}
+            await response.write(f"data: {json.dumps({**chunk, 'choices': [choice]})}\n\n".encode())
+        choice = {"index": 0, "delta": {}, "finish_reason": "stop"}
+        await response.write(f"data: {json.dumps({**chunk, 'choices': [choice]})}\n\n".encode())
+        if body.get("stream_options", {}).get("include_usage"):
+            await response.write(f"data: {json.dumps({**chunk, 'choices': [], 'usage': usage})}\n\n".encode())
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    async def create_embeddings(self, request):
+        self._count(request)
+        body = await request.json()
+        # the input is a list of texts, or of token ids when the client splits long texts itself
+        inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        texts = [text if isinstance(text, str) else " ".join(map(str, text)) for text in inputs]
+        vectors = self.embeddings.embed_documents(texts)
+        n_tokens = sum(len(text.split()) for text in texts)
+        return web.json_response(
+            {
+                "object": "list",
+                "data": [
+                    {"object": "embedding", "index": i, "embedding": vector}
+                    for i, vector in enumerate(vectors)
+                ],
+                "model": body["model"],
+                "usage": {"prompt_tokens": n_tokens, "total_tokens": n_tokens},
+            }
+        )
+
+    async def stats(self, request):
+        return web.json_response({"requests": dict(self.requests), "connections": len(self.connections)})
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on")
+    parser.add_argument("--port", type=int, default=8081, help="port to listen on")
+    parser.add_argument("--token-latency", type=float, default=0.02, help="seconds per generated token")
+    parser.add_argument("--first-token-latency", type=float, default=0.3, help="seconds to the first token")
+    parser.add_argument("--response-tokens", type=int, default=100, help="tokens per response")
+    parser.add_argument("--dimensions", type=int, default=256, help="length of the embedding vectors")
+    args = parser.parse_args()
+
+    server = StubOpenAIServer(
+        args.token_latency, args.first_token_latency, args.response_tokens, args.dimensions
+    )
+    web.run_app(server.app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+"""
+Sweeps the anomaly detection parameters over a fleet of meters, to tune the hard-coded defaults.
+
+Every daily z-score threshold, and every pair of prolonged z-score threshold and minimum number of
+consecutive days, is evaluated in one pass over the daily z-scores of each chunk of meters. Reports the
+anomaly counts of each setting and its day-level agreement (precision, recall and F1) with labelled
+anomalies. Without labels, the agreement is with the anomalies detected at the default settings. Runs on
+synthetic data with known anomalies, or on a wide CSV of smart meter readings with one column per meter.
+Run from the repository root:
+
+    python src/sweep.py --days 365 --meters 1000
+    python src/sweep.py --input fleet.csv --output sweep.csv
+"""
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+from fleet import daily_usage_matrix, daily_zscores, prefix_coverage, prolonged_anomaly_coverage
+from synthetic_data import generate_smart_meter_data
+
+DAILY_ZSCORE_THRESHOLDS = np.round(np.arange(1.5, 3.51, 0.1), 2)
+PROLONGED_ZSCORE_THRESHOLDS = np.round(np.arange(0.5, 2.51, 0.1), 2)
+MIN_CONSECUTIVE_DAYS = np.arange(2, 8)
+
+# the settings of detect_daily_anomalies and detect_prolonged_anomalies
+DEFAULT_DAILY_ZSCORE_THRESHOLD = 2
+DEFAULT_MIN_CONSECUTIVE_DAYS = 3
+DEFAULT_ZSCORE_THRESHOLD = 1.5
+
+
+def label_matrix(truth, days, meter_ids, kind):
+    """
+    Days x meters matrix marking the days of the labelled anomalies of a kind.
+
+    Parameters:
+    truth (pd.DataFrame): Labelled anomalies with the columns meter_id, kind, start and end (inclusive),
+        as returned by generate_smart_meter_data.
+    days (pd.Index): Day labels of the rows, e.g. from daily_usage_matrix.
+    meter_ids (np.ndarray): Meter ids of the columns.
+    kind (str): "daily" or "prolonged".
+    """
+    truth = truth[truth["kind"] == kind]
+    column = pd.Index(meter_ids).get_indexer(truth["meter_id"])
+    first = pd.Index(days).get_indexer(truth["start"])
+    last = pd.Index(days).get_indexer(truth["end"])
+    # a difference array marks every window at once
+    edges = np.zeros((len(days) + 1, len(meter_ids)), dtype=np.int32)
+    known = (column >= 0) & (first >= 0) & (last >= 0)
+    np.add.at(edges, (first[known], column[known]), 1)
+    np.add.at(edges, (last[known] + 1, column[known]), -1)
+    return np.cumsum(edges[:-1], axis=0) > 0
+
+
+def _count_above(values, thresholds):
+    """Number of values strictly above each threshold, from one sort of the values."""
+    return len(values) - np.searchsorted(np.sort(values), thresholds, side="right")
+
+
+def sweep_daily(zscores, thresholds, labels):
+    """
+    Counts of the daily anomalies at each z-score threshold of a chunk of meters.
+
+    A day is a daily anomaly when its z-score is above the threshold, so sorting the z-scores once gives
+    the counts at every threshold with a binary search, whatever the number of thresholds.
+
+    Parameters:
+    zscores (np.ndarray): Days x meters matrix of daily z-scores.
+    thresholds (np.ndarray): Z-score thresholds.
+    labels (np.ndarray): Boolean days x meters matrix of the labelled anomaly days.
+
+    Returns:
+    dict: Arrays over the thresholds of the anomaly days, meters with an anomaly, labelled anomaly days
+        found (true_positives) and the number of labelled days (labelled, a scalar).
+    """
+    finite = np.isfinite(zscores)
+    peaks = np.where(finite, zscores, -np.inf).max(axis=0, initial=-np.inf)
+    return {
+        "anomaly_days": _count_above(zscores[finite], thresholds),
+        "meters": _count_above(peaks, thresholds),
+        "true_positives": _count_above(zscores[finite & labels], thresholds),
+        "labelled": int(labels.sum()),
+    }
+
+
+def sweep_prolonged(zscores, thresholds, min_consecutive_days, labels):
+    """
+    Counts of the prolonged anomalies at each pair of z-score threshold and minimum length of a chunk of
+    meters.
+
+    The z-score prefix sums are computed once and shifted by each threshold with broadcasting, since the
+    prefix sums of the excess z-scores over a threshold t are the z-score prefix sums minus t times the
+    number of days. The prefix sums, their running minimum and their suffix maximum for every threshold and
+    meter are then shared by every minimum length.
+
+    Parameters:
+    zscores (np.ndarray): Days x meters matrix of daily z-scores.
+    thresholds (np.ndarray): Z-score thresholds.
+    min_consecutive_days (np.ndarray): Minimum numbers of consecutive days.
+    labels (np.ndarray): Boolean days x meters matrix of the labelled anomaly days.
+
+    Returns:
+    dict: Arrays of shape (minimum lengths, thresholds) of the anomaly windows, anomaly days, meters with
+        an anomaly and labelled anomaly days found (true_positives), and the number of labelled days
+        (labelled, a scalar).
+    """
+    n_days, n_meters = zscores.shape
+    thresholds = np.asarray(thresholds, dtype=float)
+
+    # meters with NaN z-scores (constant usage) never exceed any threshold, as in prolonged_anomaly_coverage
+    filled = np.where(np.isnan(zscores), thresholds.min() - 1, zscores).T
+    zscore_prefix = np.zeros((n_meters, n_days + 1))
+    np.cumsum(filled, axis=1, out=zscore_prefix[:, 1:])
+    prefix = zscore_prefix[None] - thresholds[:, None, None] * np.arange(n_days + 1)
+    prefix = prefix.reshape(len(thresholds) * n_meters, n_days + 1)
+    running_min = np.minimum.accumulate(prefix, axis=1)
+    suffix_max = np.maximum.accumulate(prefix[:, ::-1], axis=1)[:, ::-1]
+
+    shape = (len(min_consecutive_days), len(thresholds))
+    counts = {name: np.zeros(shape, dtype=np.int64) for name in ["anomalies", "anomaly_days", "meters"]}
+    counts["true_positives"] = np.zeros(shape, dtype=np.int64)
+    labels = labels.T[None]
+    for i, length in enumerate(min_consecutive_days):
+        coverage = prefix_coverage(prefix, running_min, int(length), suffix_max)
+        coverage = coverage.reshape(len(thresholds), n_meters, n_days)
+        counts["anomalies"][i] = np.count_nonzero(coverage[:, :, 1:] & ~coverage[:, :, :-1], axis=(1, 2))
+        counts["anomalies"][i] += np.count_nonzero(coverage[:, :, 0], axis=1)
+        counts["anomaly_days"][i] = np.count_nonzero(coverage, axis=(1, 2))
+        counts["meters"][i] = np.count_nonzero(coverage.any(axis=2), axis=1)
+        counts["true_positives"][i] = np.count_nonzero(coverage & labels, axis=(1, 2))
+    counts["labelled"] = int(labels.sum())
+    return counts
+
+
+def _agreement(table):
+    """Adds the day-level precision, recall and F1 of each setting against the labels."""
+    with np.errstate(invalid="ignore", divide="ignore"):
+        table["precision"] = table["true_positives"] / table["anomaly_days"]
+        table["recall"] = table["true_positives"] / table["labelled"]
+        table["f1"] = 2 * table["true_positives"] / (table["anomaly_days"] + table["labelled"])
+    return table
+
+
+def sweep_thresholds(
+    data,
+    readings_per_day=1,
+    daily_thresholds=DAILY_ZSCORE_THRESHOLDS,
+    zscore_thresholds=PROLONGED_ZSCORE_THRESHOLDS,
+    min_consecutive_days=MIN_CONSECUTIVE_DAYS,
+    truth=None,
+    meter_chunk_size=256,
+):
+    """
+    Evaluates a grid of detection parameters on many smart meters at once.
+
+    Applies the rules of detect_fleet_anomalies at every setting of the grid, aggregating the counts over
+    all meters. The z-scores are computed once per chunk of meters, and shared by every setting.
+
+    Parameters:
+    data (pd.DataFrame or np.ndarray): Wide DataFrame with a datetime index and one column per meter, or a
+        2-D array with one row per reading and one column per meter.
+    readings_per_day (int): Number of array rows per day. Ignored for DataFrames.
+    daily_thresholds (array-like): Z-score thresholds for daily anomalies.
+    zscore_thresholds (array-like): Z-score thresholds for prolonged anomalies.
+    min_consecutive_days (array-like): Minimum numbers of consecutive days of prolonged anomalies.
+    truth (pd.DataFrame): Labelled anomalies with the columns meter_id, kind, start and end (inclusive).
+        Defaults to the anomalies detected at the default settings.
+    meter_chunk_size (int): Number of meters processed together, bounding the working memory, which grows
+        with the number of prolonged thresholds times days times meters.
+
+    Returns:
+    tuple: DataFrames of the daily settings (zscore_threshold) and of the prolonged settings
+        (min_consecutive_days, zscore_threshold), with the columns anomalies (windows, prolonged only),
+        anomaly_days, meters (with any anomaly), true_positives, labelled, precision, recall and f1.
+    """
+    daily, days, meter_ids = daily_usage_matrix(data, readings_per_day)
+    daily_thresholds = np.asarray(daily_thresholds, dtype=float)
+    zscore_thresholds = np.asarray(zscore_thresholds, dtype=float)
+    min_consecutive_days = np.asarray(min_consecutive_days, dtype=int)
+
+    daily_counts, prolonged_counts = [], []
+    for first in range(0, daily.shape[1], meter_chunk_size):
+        zscores = daily_zscores(daily[:, first : first + meter_chunk_size])
+        if truth is None:
+            daily_labels = zscores > DEFAULT_DAILY_ZSCORE_THRESHOLD
+            prolonged_labels = prolonged_anomaly_coverage(
+                zscores, DEFAULT_MIN_CONSECUTIVE_DAYS, DEFAULT_ZSCORE_THRESHOLD
+            )
+        else:
+            chunk_ids = meter_ids[first : first + meter_chunk_size]
+            daily_labels = label_matrix(truth, days, chunk_ids, "daily")
+            prolonged_labels = label_matrix(truth, days, chunk_ids, "prolonged")
+        daily_counts.append(sweep_daily(zscores, daily_thresholds, daily_labels))
+        prolonged_counts.append(
+            sweep_prolonged(zscores, zscore_thresholds, min_consecutive_days, prolonged_labels)
+        )
+
+    def totals(counts, shape):
+        return {name: np.broadcast_to(sum(c[name] for c in counts), shape).ravel() for name in counts[0]}
+
+    daily_table = pd.DataFrame(
+        {"zscore_threshold": daily_thresholds} | totals(daily_counts, daily_thresholds.shape)
+    )
+    lengths, thresholds = np.meshgrid(min_consecutive_days, zscore_thresholds, indexing="ij")
+    prolonged_table = pd.DataFrame(
+        {"min_consecutive_days": lengths.ravel(), "zscore_threshold": thresholds.ravel()}
+        | totals(prolonged_counts, lengths.shape)
+    )
+    return _agreement(daily_table), _agreement(prolonged_table)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--input", help="wide CSV of readings with one column per meter, else synthetic data")
+    parser.add_argument("--days", type=int, default=365, help="days of synthetic data")
+    parser.add_argument("--meters", type=int, default=1000, help="meters of synthetic data")
+    parser.add_argument("--meter-chunk-size", type=int, default=256, help="meters processed together")
+    parser.add_argument("--output", help="CSV file for the prolonged settings, and .daily.csv for the daily")
+    args = parser.parse_args()
+
+    truth = None
+    if args.input:
+        data = pd.read_csv(args.input, index_col=0, parse_dates=True)
+    else:
+        data, _, truth = generate_smart_meter_data(days=args.days, n_meters=args.meters, freq="1h")
+    n_settings = len(DAILY_ZSCORE_THRESHOLDS) + len(PROLONGED_ZSCORE_THRESHOLDS) * len(MIN_CONSECUTIVE_DAYS)
+
+    start = time.perf_counter()
+    daily_table, prolonged_table = sweep_thresholds(data, truth=truth, meter_chunk_size=args.meter_chunk_size)
+    print(f"{n_settings} settings on {data.shape[1]} meters in {time.perf_counter() - start:.2f}s")
+    print(f"agreement with {'the labels' if truth is not None else 'the default settings'}")
+
+    with pd.option_context("display.width", 120, "display.max_columns", None):
+        print("\nbest daily settings by F1")
+        print(daily_table.nlargest(5, "f1").to_string(index=False, float_format="{:.3f}".format))
+        print("\nbest prolonged settings by F1")
+        print(prolonged_table.nlargest(5, "f1").to_string(index=False, float_format="{:.3f}".format))
+
+    if args.output:
+        prolonged_table.to_csv(args.output, index=False)
+        daily_table.to_csv(args.output.removesuffix(".csv") + ".daily.csv", index=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+import numpy as np
+import pandas as pd
+
+
+def generate_smart_meter_data(
+    days=31,
+    n_meters=1,
+    start="2024-08-01",
+    freq="15min",
+    daily_anomalies_per_month=2,
+    prolonged_anomalies_per_month=1,
+    prolonged_days=(3, 5),
+    seed=0,
+):
+    """
+    Generates synthetic smart meter and weather data with known anomalies.
+
+    Follows notebooks/smart_meter_data_generation.ipynb: usage follows a daily sine curve with an amplitude
+    of 10 plus random noise, single anomaly days have an amplitude of 12, prolonged anomalies an amplitude
+    of 11.5, and the weather is hotter on single anomaly days.
+
+    Parameters:
+    days (int): Number of days of data.
+    n_meters (int): Number of meters.
+    start (str): First day of the data.
+    freq (str): Time between readings.
+    daily_anomalies_per_month (float): Number of single anomaly days per meter per 31 days.
+    prolonged_anomalies_per_month (float): Number of prolonged anomalies per meter per 31 days.
+    prolonged_days (tuple): Minimum and maximum length in days of the prolonged anomalies.
+    seed (int): Random seed.
+
+    Returns:
+    tuple: Usage DataFrame with a "usage" column for a single meter or one column per meter, weather
+        DataFrame with a "temperature" column, and a DataFrame of the injected anomalies with the
+        columns meter_id, kind, start and end (inclusive).
+    """
+    rng = np.random.default_rng(seed)
+    readings_per_day = pd.Timedelta("1D") // pd.Timedelta(freq)
+    index = pd.date_range(start, periods=days * readings_per_day, freq=freq)
+    meter_ids = ["usage"] if n_meters == 1 else [f"meter_{i}" for i in range(n_meters)]
+
+    # amplitude of the daily usage curve, per day and meter
+    amplitude = np.full((days, n_meters), 10.0)
+    truth = []
+    for meter, meter_id in enumerate(meter_ids):
+        n_prolonged = round(prolonged_anomalies_per_month * days / 31)
+        n_daily = round(daily_anomalies_per_month * days / 31)
+
+        # prolonged anomalies are placed in separate slots of the period so they never overlap
+        slots = np.array_split(np.arange(days), max(n_prolonged, 1))
+        for slot in slots[:n_prolonged]:
+            length = int(rng.integers(prolonged_days[0], prolonged_days[1] + 1))
+            if len(slot) < length + 2:
+                continue
+            first = int(rng.integers(slot[0] + 1, slot[-1] - length + 1))
+            amplitude[first : first + length, meter] = 11.5
+            truth.append((meter_id, "prolonged", first, first + length - 1))
+
+        # single anomaly days, away from the prolonged anomalies and each other
+        free = np.flatnonzero(amplitude[:, meter] == 10.0)
+        for day in rng.choice(free, size=min(n_daily, len(free)), replace=False):
+            if np.all(amplitude[max(day - 1, 0) : day + 2, meter] == 10.0):
+                amplitude[day, meter] = 12.0
+                truth.append((meter_id, "daily", int(day), int(day)))
+
+    curve = np.sin(np.pi * index.hour.to_numpy() / 24)
+    usage = np.repeat(amplitude, readings_per_day, axis=0) * curve[:, None]
+    usage += rng.integers(0, 5, size=usage.shape)
+    df = pd.DataFrame(usage, index=index, columns=meter_ids)
+
+    # weather is shared by all meters, hotter on the first meter's single anomaly days
+    hot_days = amplitude[:, 0] == 12.0
+    temperature = curve * 10 + 15 + np.repeat(np.where(hot_days, 10.0, 0.0), readings_per_day)
+    weather_df = pd.DataFrame({"temperature": temperature + rng.integers(0, 5, size=len(index))}, index=index)
+
+    day_labels = index[::readings_per_day]
+    truth = pd.DataFrame(truth, columns=["meter_id", "kind", "start", "end"])
+    truth["start"] = day_labels[truth["start"].to_numpy(dtype=int)]
+    truth["end"] = day_labels[truth["end"].to_numpy(dtype=int)]
+    return df, weather_df, truth
@@ -0,0 +1,63 @@
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+def run_task_graph(tasks, max_workers=4):
+    """
+    Runs a graph of dependent tasks on a thread pool, starting each task as soon as its dependencies finish.
+
+    Parameters:
+    tasks (dict): Maps each task name to a tuple of a function and a list of the names of the tasks it
+        depends on. The function is called with the results of its dependencies, in order.
+    max_workers (int): Number of threads.
+
+    Returns:
+    tuple: Dict of the result of each task, and dict of the (start, end) time of each task in seconds
+        since the graph started.
+    """
+    results = {}
+    timings = {}
+    graph_start = time.perf_counter()
+
+    def run_timed(name, function, args):
+        start = time.perf_counter() - graph_start
+        result = function(*args)
+        timings[name] = (start, time.perf_counter() - graph_start)
+        return result
+
+    pending = dict(tasks)
+    running = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running:
+            for name, (function, dependencies) in list(pending.items()):
+                if all(dependency in results for dependency in dependencies):
+                    args = [results[dependency] for dependency in dependencies]
+                    running[executor.submit(run_timed, name, function, args)] = name
+                    del pending[name]
+            if not running:
+                raise ValueError(f"Tasks with missing or circular dependencies: {', '.join(pending)}")
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                results[running.pop(future)] = future.result()
+    return results, timings
+
+
+def critical_path(tasks, timings):
+    """The chain of tasks that determined the total run time, following the last dependency to finish."""
+    path = [max(timings, key=lambda name: timings[name][1])]
+    while dependencies := tasks[path[0]][1]:
+        path.insert(0, max(dependencies, key=lambda name: timings[name][1]))
+    return path
+
+
+def format_timings(tasks, timings):
+    """Human readable table of the task timings and the critical path."""
+    lines = [
+        f"{name:<30} {start * 1000:8.1f}ms -> {end * 1000:8.1f}ms ({(end - start) * 1000:.1f}ms)"
+        for name, (start, end) in sorted(timings.items(), key=lambda item: item[1])
+    ]
+    total = max(end for _, end in timings.values())
+    busy = sum(end - start for start, end in timings.values())
+    lines.append(f"total {total * 1000:.1f}ms, sequential {busy * 1000:.1f}ms")
+    lines.append("critical path: " + " -> ".join(critical_path(tasks, timings)))
+    return "\n".join(lines)
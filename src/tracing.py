@@ -0,0 +1,196 @@
+import json
+import logging
+import os
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from langchain_core.callbacks import BaseCallbackHandler
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# run names of the history aware retriever, on its own and inside a retrieval chain
+RETRIEVER_RUN_NAMES = ("chat_retriever_chain", "retrieve_documents")
+
+
+def tracing_mode():
+    """
+    The tracing mode, set with the TRACING_MODE environment variable.
+
+    "off" (the default) records nothing, "spans" records the duration of each stage and chain run as
+    structured spans, and "debug" turns on the langchain debug output of every chain payload.
+    """
+    return os.getenv("TRACING_MODE", "off")
+
+
+class SpanTracer(BaseCallbackHandler):
+    """
+    Records the duration of each chain, chat model and retriever run as a span.
+
+    Spans are logged as JSON lines and the most recent are kept in memory. Only names, ids and timings are
+    recorded, never the inputs or outputs of the runs.
+
+    Parameters:
+    max_spans (int): Number of recent spans kept in memory.
+    """
+
+    # the handler only does bookkeeping, so async runs call it on the event loop instead of in a thread
+    run_inline = True
+
+    def __init__(self, max_spans=1000):
+        self.spans = deque(maxlen=max_spans)
+        self._runs = {}
+
+    def record(self, name, duration, **attributes):
+        """Records a finished span."""
+        span = {"name": name, "duration_ms": round(duration * 1000, 3), **attributes}
+        self.spans.append(span)
+        logger.info(json.dumps(span))
+
+    def _start(self, run_type, serialized, run_id, parent_run_id, kwargs):
+        name = kwargs.get("name") or (serialized or {}).get("name") or run_type
+        self._runs[run_id] = (time.perf_counter(), name, run_type, parent_run_id)
+
+    def _end(self, run_id, error=None):
+        run = self._runs.pop(run_id, None)
+        if run is None:
+            return
+        start, name, run_type, parent_run_id = run
+        attributes = {"run_type": run_type, "run_id": str(run_id)}
+        if parent_run_id is not None:
+            attributes["parent_run_id"] = str(parent_run_id)
+        if error is not None:
+            attributes["error"] = type(error).__name__
+        self.record(name, time.perf_counter() - start, **attributes)
+
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, **kwargs):
+        self._start("chain", serialized, run_id, parent_run_id, kwargs)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, parent_run_id=None, **kwargs):
+        self._start("llm", serialized, run_id, parent_run_id, kwargs)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, parent_run_id=None, **kwargs):
+        self._start("llm", serialized, run_id, parent_run_id, kwargs)
+
+    def on_retriever_start(self, serialized, query, *, run_id, parent_run_id=None, **kwargs):
+        self._start("retriever", serialized, run_id, parent_run_id, kwargs)
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_retriever_end(self, documents, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error)
+
+    def on_retriever_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error)
+
+
+class MetricsCallbackHandler(BaseCallbackHandler):
+    """
+    Records the retrieval, question contextualization and answer stages of chain runs in the metrics, with
+    the number of retrieved chunks and of input and output tokens.
+
+    LLM runs inside the history aware retriever are the contextualization of the question, all others are
+    answers. The retriever is named "chat_retriever_chain", or "retrieve_documents" once wrapped by
+    create_retrieval_chain.
+    """
+
+    run_inline = True
+
+    def __init__(self):
+        self._runs = {}
+
+    def _start(self, run_id, parent_run_id, name):
+        self._runs[run_id] = (time.perf_counter(), parent_run_id, name)
+
+    def _inside(self, run_id, names):
+        while run_id in self._runs:
+            _, run_id, run_name = self._runs[run_id]
+            if run_name in names:
+                return True
+        return False
+
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, **kwargs):
+        self._start(run_id, parent_run_id, kwargs.get("name") or (serialized or {}).get("name"))
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, parent_run_id=None, **kwargs):
+        self._start(run_id, parent_run_id, "llm")
+
+    def on_llm_start(self, serialized, prompts, *, run_id, parent_run_id=None, **kwargs):
+        self._start(run_id, parent_run_id, "llm")
+
+    def on_retriever_start(self, serialized, query, *, run_id, parent_run_id=None, **kwargs):
+        self._start(run_id, parent_run_id, "retriever")
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._runs.pop(run_id, None)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._runs.pop(run_id, None)
+
+    def on_retriever_end(self, documents, *, run_id, **kwargs):
+        run = self._runs.pop(run_id, None)
+        if run is not None:
+            metrics.observe("retrieval", time.perf_counter() - run[0])
+            metrics.increment("retrieved_chunks_total", len(documents))
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        if run_id not in self._runs:
+            return
+        stage = "contextualize_question" if self._inside(run_id, RETRIEVER_RUN_NAMES) else "answer"
+        start, _, _ = self._runs.pop(run_id)
+        metrics.observe(stage, time.perf_counter() - start)
+        # token usage is reported on the messages, with stream_usage=True for streamed OpenAI responses
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+                metrics.increment("input_tokens_total", usage.get("input_tokens", 0), stage=stage)
+                metrics.increment("output_tokens_total", usage.get("output_tokens", 0), stage=stage)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._runs.pop(run_id, None)
+
+    def on_retriever_error(self, error, *, run_id, **kwargs):
+        self._runs.pop(run_id, None)
+
+
+tracer = SpanTracer()
+
+
+def configure_tracing():
+    """Applies the tracing mode, turning on the langchain debug output in debug mode."""
+    if tracing_mode() == "debug":
+        from langchain_core.globals import set_debug
+
+        set_debug(True)
+
+
+def get_callbacks():
+    """Callbacks to pass to chain runs, recording stage metrics, and spans in spans mode."""
+    callbacks = [MetricsCallbackHandler()]
+    if tracing_mode() == "spans":
+        callbacks.append(tracer)
+    return callbacks
+
+
+@contextmanager
+def span(name, **attributes):
+    """Records the duration of the enclosed block as a stage in the metrics, and as a span in spans mode."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        metrics.observe(name, duration)
+        if tracing_mode() == "spans":
+            tracer.record(name, duration, **attributes)
@@ -1,102 +1,202 @@
-import os
-import time
-
 import numpy as np
 import pandas as pd
 import plotly.express as px
-import streamlit as st
+from metrics import metrics
 from scipy.stats import zscore
+from store import load_columnar
 
 
-def check_password():
-    """Returns `True` if the user had the correct password."""
-
-    def password_entered():
-        """Checks whether a password entered by the user is correct."""
-        password = os.getenv("STREAMLIT_PASSWORD")
-        if not password:
-            st.error("😕 Password not set")
-            return False
-        if st.session_state["password"] == password:
-            st.session_state["password_correct"] = True
-            st.session_state["show_success"] = True
-            del st.session_state["password"]  # Don't store the password.
-        else:
-            st.session_state["password_correct"] = False
-
-    # Return True if the password is validated.
-    if st.session_state.get("password_correct", False):
-        if st.session_state.get("show_success", False):
-            placeholder = st.empty()
-            placeholder.success("🎉 Password correct")
-            time.sleep(1.5)
-            placeholder.empty()
-            st.session_state["show_success"] = False
-        return True
-
-    # Show input for password.
-    st.text_input("Password", type="password", on_change=password_entered, key="password")
-    if "password_correct" in st.session_state:
-        st.error("😕 Password incorrect")
-    return False
-
-
+@metrics.timed("load_smart_meter_data")
 def load_smart_meter_data():
-    """Loads the smart meter data from the CSV file."""
-    df = pd.read_csv("src/smart_meter_data.csv", index_col=0, parse_dates=True)
+    """Loads the smart meter data from the CSV file, through its columnar store when available."""
+    df = load_columnar("src/smart_meter_data.csv")
     return df
 
 
+@metrics.timed("load_weather_data")
 def load_weather_data():
-    """Loads the weather data from the CSV file."""
-    df = pd.read_csv("src/weather_data.csv", index_col=0, parse_dates=True)
+    """Loads the weather data from the CSV file, through its columnar store when available."""
+    df = load_columnar("src/weather_data.csv")
     return df
 
 
-def detect_daily_anomalies(df):
+class DailyProfile:
     """
-    Detects anomalies in energy usage from smart meter data.
+    Daily aggregates of a customer's smart meter and weather data, computed once per session.
+
+    The detection, analysis and plotting functions accept a DailyProfile in place of the raw DataFrames,
+    and reuse its daily usage, z-scores and daily mean temperatures instead of resampling again.
 
-    Simple anomaly detection using z-score exceeding 2 for daily usage.
+    Parameters:
+    df (pd.DataFrame): DataFrame containing the energy usage data with a datetime index.
+    weather_df (pd.DataFrame): DataFrame containing weather data with a datetime index, optional.
     """
 
-    # Aggregate the data to daily usage
-    df_daily = df.resample("D").sum()
+    @metrics.timed("daily_profile")
+    def __init__(self, df, weather_df=None):
+        self.df = df
+        self.weather_df = weather_df
+
+        # Aggregate the data to daily usage and calculate the Z-score for daily usage
+        self.usage = df.resample("D").sum()
+        self.usage["zscore"] = zscore(self.usage["usage"])
 
-    # Calculate the Z-score for daily usage
+        # daily mean weather
+        self.weather = None if weather_df is None else weather_df.resample("D").mean()
+
+    @classmethod
+    def from_daily(cls, usage, weather=None):
+        """
+        Builds a profile from data that is already aggregated to days, e.g. by store.aggregate_daily.
+
+        The profile holds no raw readings, so plot_anomalies draws the daily usage instead.
+
+        Parameters:
+        usage (pd.DataFrame): Daily usage with a "usage" column and a daily datetime index.
+        weather (pd.DataFrame): Daily mean weather with a "temperature" column, optional.
+        """
+        profile = cls.__new__(cls)
+        profile.df = None
+        profile.weather_df = None
+        profile.usage = usage[["usage"]].copy()
+        profile.usage["zscore"] = zscore(profile.usage["usage"])
+        profile.weather = weather
+        return profile
+
+
+def _daily_usage(df):
+    """Daily usage with z-scores, from a DailyProfile or resampled from the smart meter data."""
+    if isinstance(df, DailyProfile):
+        return df.usage
+    df_daily = df.resample("D").sum()
     df_daily["zscore"] = zscore(df_daily["usage"])
+    return df_daily
+
+
+def _daily_weather(df):
+    """Daily mean weather, from a DailyProfile or resampled from the weather data."""
+    if isinstance(df, DailyProfile):
+        return df.weather
+    return df.resample("D").mean()
+
+
+@metrics.timed("detect_daily_anomalies")
+def detect_daily_anomalies(df):
+    """
+    Detects anomalies in energy usage from smart meter data.
+
+    Simple anomaly detection using z-score exceeding 2 for daily usage. df can be the smart meter
+    DataFrame or a DailyProfile.
+    """
+
+    # Aggregate the data to daily usage and calculate the Z-score for daily usage
+    df_daily = _daily_usage(df)
 
     # Identify anomalies
-    df_daily["anomalies"] = df_daily["zscore"] > 2
+    anomalies = df_daily["zscore"] > 2
 
     # if there are any anomalies, return the dates
-    if df_daily["anomalies"].any():
-        anomalies = df_daily[df_daily["anomalies"]].index
-        return anomalies
+    if anomalies.any():
+        return df_daily[anomalies].index
     else:
         return None
 
 
-def detect_prolonged_anomalies(df, min_consecutive_days=3, zscore_threshold=1.5):
+def prolonged_anomaly_windows(zscores, min_consecutive_days=3, zscore_threshold=1.5):
+    """
+    Finds the prolonged anomaly windows in a series of daily z-scores.
+
+    A day is part of a prolonged anomaly if it lies in any run of at least min_consecutive_days days whose
+    average z-score exceeds zscore_threshold, with overlapping and adjacent runs merged. Days with a NaN
+    z-score can not be part of a window.
+
+    Parameters:
+    zscores (array-like): Daily z-scores.
+    min_consecutive_days (int): Minimum number of consecutive days to consider as a prolonged anomaly.
+    zscore_threshold (float): Z-score threshold for detecting anomalies.
+
+    Returns:
+    tuple: Integer arrays with the start and end positions (inclusive) of each prolonged anomaly window.
+    """
+    zscores = np.asarray(zscores, dtype=float)
+    finite = np.isfinite(zscores)
+    if finite.all():
+        return _finite_prolonged_anomaly_windows(zscores, min_consecutive_days, zscore_threshold)
+
+    # windows can not span a NaN, so search each finite run separately
+    edges = np.diff(np.concatenate(([0], finite.astype(np.int8), [0])))
+    starts, ends = [], []
+    for run_start, run_end in zip(np.flatnonzero(edges == 1), np.flatnonzero(edges == -1), strict=True):
+        run_starts, run_ends = _finite_prolonged_anomaly_windows(
+            zscores[run_start:run_end], min_consecutive_days, zscore_threshold
+        )
+        starts.append(run_starts + run_start)
+        ends.append(run_ends + run_start)
+    if not starts:
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp)
+    return np.concatenate(starts), np.concatenate(ends)
+
+
+def _finite_prolonged_anomaly_windows(zscores, min_consecutive_days, zscore_threshold):
+    """Prolonged anomaly windows of a NaN free z-score array in O(n log n)."""
+    n = len(zscores)
+    if n < min_consecutive_days:
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp)
+
+    # prefix[k] is the excess z-score summed over the first k days, so the days s to e average above the
+    # threshold exactly when prefix[s] < prefix[e + 1]
+    prefix = np.concatenate(([0.0], np.cumsum(zscores - zscore_threshold)))
+
+    # the running minimum of the prefix sums is non-increasing, so a binary search over it gives the
+    # earliest start for each end day, i.e. the longest window ending on that day
+    running_min = np.minimum.accumulate(prefix)
+    ends = np.arange(n)
+    starts = np.searchsorted(-running_min, -prefix[1:], side="right")
+    valid = starts <= ends + 1 - min_consecutive_days
+
+    # merge the longest windows ending on each day into non-overlapping windows
+    coverage = np.zeros(n + 1, dtype=np.intp)
+    np.add.at(coverage, starts[valid], 1)
+    np.add.at(coverage, ends[valid] + 1, -1)
+    in_window = np.cumsum(coverage[:-1]) > 0
+    edges = np.diff(np.concatenate(([0], in_window.astype(np.int8), [0])))
+    return np.flatnonzero(edges == 1), np.flatnonzero(edges == -1) - 1
+
+
+@metrics.timed("detect_prolonged_anomalies")
+def detect_prolonged_anomalies(df, min_consecutive_days=3, zscore_threshold=1.5, method="fast"):
     """
     Detects prolonged anomalies in energy usage from smart meter data.
 
     Anomaly detection using the average z-score exceeding a threshold for a prolonged period.
 
     Parameters:
-    df (pd.DataFrame): DataFrame containing the energy usage data with a datetime index.
+    df (pd.DataFrame or DailyProfile): DataFrame containing the energy usage data with a datetime index.
     min_consecutive_days (int): Minimum number of consecutive days to consider as a prolonged anomaly.
     zscore_threshold (float): Z-score threshold for detecting anomalies.
+    method (str): "fast" uses prolonged_anomaly_windows, "reference" uses the original sweep over every
+        window size, which is O(n^2) in the number of days and kept for checking the fast method.
 
     Returns:
-    pd.DataFrame: DataFrame with the anomaly_window column indicating prolonged anomalies.
+    list: List of tuples with the start and end dates of each prolonged anomaly, or None.
     """
 
-    # Aggregate the data to daily usage
-    df_daily = df.resample("D").sum()
+    # Aggregate the data to daily usage and calculate the Z-score for daily usage
+    df_daily = _daily_usage(df)
 
-    # Calculate the Z-score for daily usage
-    df_daily["zscore"] = zscore(df_daily["usage"])
+    if method == "reference":
+        return _detect_prolonged_anomalies_reference(df_daily.copy(), min_consecutive_days, zscore_threshold)
+    if method != "fast":
+        raise ValueError(f"Unknown prolonged anomaly detection method: {method}")
+
+    starts, ends = prolonged_anomaly_windows(df_daily["zscore"], min_consecutive_days, zscore_threshold)
+    if len(starts) == 0:
+        return None
+    return list(zip(df_daily.index[starts], df_daily.index[ends], strict=True))
+
+
+def _detect_prolonged_anomalies_reference(df_daily, min_consecutive_days, zscore_threshold):
+    """Original sliding window implementation of detect_prolonged_anomalies."""
 
     # Initialize a column to mark prolonged anomalies
     df_daily["prolonged_anomaly_length"] = 0
@@ -134,8 +234,159 @@ def detect_prolonged_anomalies(df, min_consecutive_days=3, zscore_threshold=1.5)
         return None
 
 
-def plot_anomalies(df, anomalies, prolonged_anomalies):
-    """Plots the anomalies in the energy usage."""
+PLOT_MAX_POINTS = 2000
+
+
+def minmax_downsample(values, max_points):
+    """
+    Indices of the points to keep when plotting a long series with at most max_points points.
+
+    The series is split into (max_points - 2) // 2 equal buckets and the minimum and maximum of each bucket
+    are kept, along with the first and last points, so that spikes survive the downsampling and no more than
+    max_points points are kept.
+
+    Parameters:
+    values (array-like): Values of the series.
+    max_points (int): Maximum number of points, at least 4.
+
+    Returns:
+    np.ndarray: Sorted positions of the points to keep.
+    """
+    values = np.asarray(values, dtype=float)
+    n = len(values)
+    if n <= max_points:
+        return np.arange(n)
+
+    bucket_size = -(-n // max((max_points - 2) // 2, 1))
+    n_buckets = -(-n // bucket_size)
+    padded = np.full(n_buckets * bucket_size, np.nan)
+    padded[:n] = values
+    buckets = padded.reshape(n_buckets, bucket_size)
+
+    # NaN values (missing readings and padding) are never picked over real values
+    offsets = np.arange(n_buckets) * bucket_size
+    minima = offsets + np.argmin(np.where(np.isnan(buckets), np.inf, buckets), axis=1)
+    maxima = offsets + np.argmax(np.where(np.isnan(buckets), -np.inf, buckets), axis=1)
+    keep = np.unique(np.concatenate(([0, n - 1], minima, maxima)))
+    return keep[keep < n]
+
+
+def _merge_anomaly_days(anomalies):
+    """Merges daily anomalies on consecutive days into (start, end) date ranges."""
+    days = pd.DatetimeIndex(anomalies)
+    new_run = np.diff(days.asi8, prepend=days.asi8[0]) != pd.Timedelta(days=1).value
+    new_run[0] = True
+    starts = np.flatnonzero(new_run)
+    ends = np.append(starts[1:], len(days)) - 1
+    return list(zip(days[starts], days[ends], strict=True))
+
+
+def _bucket_ranges(ranges, max_ranges):
+    """
+    Merges the date ranges that start in the same one of max_ranges equal buckets over their span into one
+    range covering them all, so there are at most max_ranges highlights however many anomalies there are.
+    """
+    ranges = list(ranges)
+    if len(ranges) <= max_ranges:
+        return ranges
+    table = pd.DataFrame(ranges, columns=["start", "end"])
+    starts = table["start"].to_numpy(dtype="datetime64[ns]").astype(np.int64)
+    span = starts.max() - starts.min() + 1
+    bucket = np.minimum(((starts - starts.min()) / span * max_ranges).astype(np.int64), max_ranges - 1)
+    merged = table.groupby(bucket).agg({"start": "min", "end": "max"})
+    return list(zip(merged["start"], merged["end"], strict=True))
+
+
+def _anomaly_highlights(ranges, fillcolor, text):
+    """Rectangle shapes and annotations highlighting date ranges, as added by fig.add_vrect."""
+    shapes = []
+    annotations = []
+    for start, end in ranges:
+        shapes.append(
+            dict(
+                type="rect",
+                xref="x",
+                yref="y domain",
+                x0=start,
+                x1=end + pd.Timedelta(days=1),
+                y0=0,
+                y1=1,
+                fillcolor=fillcolor,
+                opacity=0.25,
+                line_width=0,
+                layer="below",
+            )
+        )
+        annotations.append(
+            dict(
+                x=start,
+                xref="x",
+                y=1,
+                yref="y domain",
+                text=text,
+                showarrow=False,
+                xanchor="left",
+                yanchor="top",
+            )
+        )
+    return shapes, annotations
+
+
+def plot_anomalies(df, anomalies, prolonged_anomalies, max_points=None, x_range=None):
+    """
+    Plots the anomalies in the energy usage.
+
+    Parameters:
+    df (pd.DataFrame or DailyProfile): DataFrame containing the energy usage data with a datetime index.
+    anomalies (list): List of dates with energy usage anomalies.
+    prolonged_anomalies (list): List of tuples with start and end dates of prolonged anomalies.
+    max_points (int): If given, the usage is min-max downsampled to at most this many points and drawn with
+        WebGL, and the highlights of anomalies on consecutive days are merged and added as one layer. Beyond
+        max_points // 2 highlights of a kind, nearby ones are merged into one, so the figure size does not
+        grow with the length of the history or the number of anomalies.
+    x_range (tuple): Start and end dates to plot, so that a zoomed in figure is downsampled over the
+        zoomed range only and shows more detail. Defaults to the whole history.
+
+    Returns:
+    plotly.graph_objects.Figure: The figure.
+    """
+    if isinstance(df, DailyProfile):
+        df = df.usage[["usage"]] if df.df is None else df.df
+    if x_range is not None:
+        df = df.loc[x_range[0] : x_range[1]]
+    if max_points is None:
+        return _plot_anomalies_full(df, anomalies, prolonged_anomalies)
+
+    df = df.iloc[minmax_downsample(df["usage"], max_points)]
+    fig = px.line(
+        df,
+        x=df.index,
+        y="usage",
+        title="Daily Usage with Daily and Prolonged Anomalies Highlighted",
+        render_mode="webgl",
+    )
+
+    shapes, annotations = [], []
+    max_ranges = max(max_points // 2, 1)
+    if anomalies is not None and len(anomalies) > 0:
+        daily_shapes, daily_annotations = _anomaly_highlights(
+            _bucket_ranges(_merge_anomaly_days(anomalies), max_ranges), "yellow", "daily anomaly"
+        )
+        shapes += daily_shapes
+        annotations += daily_annotations
+    if prolonged_anomalies is not None:
+        prolonged_shapes, prolonged_annotations = _anomaly_highlights(
+            _bucket_ranges(prolonged_anomalies, max_ranges), "red", "prolonged anomaly"
+        )
+        shapes += prolonged_shapes
+        annotations += prolonged_annotations
+    fig.update_layout(shapes=shapes, annotations=annotations)
+
+    return fig
+
+
+def _plot_anomalies_full(df, anomalies, prolonged_anomalies):
+    """Plots every reading, with one highlight per anomaly."""
     # plot original data with outliers highlighted with a red box covering the day
     fig = px.line(
         df, x=df.index, y="usage", title="Daily Usage with Daily and Prolonged Anomalies Highlighted"
@@ -165,6 +416,16 @@ def plot_anomalies(df, anomalies, prolonged_anomalies):
     return fig
 
 
+# instructions that follow the anomalies in the system prompt
+PROLONGED_ANOMALY_GUIDANCE = """These are more serious as they have lasted for more than 3 days, so may have a clearer \
+        underlying cause that needs to be addressed. Prolonged anomalies can be caused by \
+        things such as a device being left on, or a device consuming more power than it was previously."""
+ANOMALY_GUIDANCE = (
+    "Help the user to identify the causes of each of the anomalies and suggest ways to fix them."
+    + " You should also compare the temperature during the anomalies against the average temperature for the location."
+)
+
+
 def generate_anomaly_text(
     anomalies,
     prolonged_anomalies,
@@ -197,17 +458,11 @@ def generate_anomaly_text(
             anomaly_text
             + f"""Prolonged anomalies have been detected in the customer's energy usage. \
         The prolonged anomalies occured on the following dates:  {prolonged_anomalies_str}. \
-        These are more serious as they have lasted for more than 3 days, so may have a clearer \
-        underlying cause that needs to be addressed. Prolonged anomalies can be caused by \
-        things such as a device being left on, or a device consuming more power than it was previously. \
+        {PROLONGED_ANOMALY_GUIDANCE} \
         {prolonged_anomaly_temperatures_str}. """
         )
     if anomalies is not None or prolonged_anomalies is not None:
-        anomaly_text = (
-            anomaly_text
-            + "Help the user to identify the causes of each of the anomalies and suggest ways to fix them."
-            + " You should also compare the temperature during the anomalies against the average temperature for the location."
-        )
+        anomaly_text += ANOMALY_GUIDANCE
     else:
         anomaly_text = """No anomalies have been detected in the customer's energy usage. \
         You may still help the user to address any concerns they have about their energy usage."""
@@ -216,64 +471,160 @@ def generate_anomaly_text(
     return anomaly_text
 
 
+def weather_window_stats(df, starts, ends, base_temperature=None):
+    """
+    Temperature statistics over many date windows at once.
+
+    Joins the windows to the daily mean temperatures with a binary search on their bounds, then takes the
+    means (and degree-days) from prefix sums and the minimums and maximums from one reduction over the
+    window bounds, so the cost does not depend on a Python loop over the windows. Days without a
+    temperature are ignored.
+
+    Parameters:
+    df (pd.DataFrame or DailyProfile): DataFrame containing weather data with a datetime index.
+    starts (array-like): First day of each window.
+    ends (array-like): Last day of each window (inclusive).
+    base_temperature (float): If given, the heating and cooling degree-days of each window are added,
+        relative to this base temperature (°C).
+
+    Returns:
+    pd.DataFrame: One row per window with the columns start, end, days (with a temperature),
+        mean_temperature, min_temperature, max_temperature and, with a base temperature,
+        heating_degree_days and cooling_degree_days. Windows without any temperature get NaN statistics.
+    """
+    df_daily = _daily_weather(df)
+    days = df_daily.index
+    temperature = df_daily["temperature"].to_numpy(dtype=float)
+    starts = pd.DatetimeIndex(starts)
+    ends = pd.DatetimeIndex(ends)
+
+    # positions of the windows as half-open ranges of days, matching .loc[start:end]
+    first = days.searchsorted(starts, side="left")
+    last = np.maximum(days.searchsorted(ends, side="right"), first)
+
+    def window_sums(values):
+        prefix = np.concatenate(([0.0], np.cumsum(values)))
+        return prefix[last] - prefix[first]
+
+    finite = np.isfinite(temperature)
+    n_days = window_sums(finite)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        table = {
+            "start": starts,
+            "end": ends,
+            "days": n_days.astype(int),
+            "mean_temperature": window_sums(np.where(finite, temperature, 0.0)) / n_days,
+        }
+
+    # reduceat over the interleaved window bounds reduces each window in one call, the reductions between
+    # one window's end and the next window's start are discarded; a NaN pad keeps the bounds in range
+    padded = np.append(temperature, np.nan)
+    bounds = np.stack([first, last], axis=1).ravel()
+    nonempty = n_days > 0
+    for name, reduce in [("min_temperature", np.fmin), ("max_temperature", np.fmax)]:
+        values = reduce.reduceat(padded, bounds)[::2] if len(bounds) else np.empty(0)
+        table[name] = np.where(nonempty, values, np.nan)
+
+    if base_temperature is not None:
+        heating = np.where(finite, np.maximum(base_temperature - temperature, 0.0), 0.0)
+        cooling = np.where(finite, np.maximum(temperature - base_temperature, 0.0), 0.0)
+        table["heating_degree_days"] = window_sums(heating)
+        table["cooling_degree_days"] = window_sums(cooling)
+    return pd.DataFrame(table)
+
+
+def anomaly_weather_table(df, anomalies, prolonged_anomalies, base_temperature=None):
+    """
+    Temperature statistics during each daily and prolonged anomaly.
+
+    Parameters:
+    df (pd.DataFrame or DailyProfile): DataFrame containing weather data with a datetime index.
+    anomalies (list): List of dates with energy usage anomalies.
+    prolonged_anomalies (list): List of tuples with start and end dates of prolonged anomalies.
+    base_temperature (float): If given, degree-days relative to this base temperature are added.
+
+    Returns:
+    pd.DataFrame: The weather_window_stats columns with a leading kind column ("daily" or "prolonged"),
+        daily anomalies first.
+    """
+    anomalies = [] if anomalies is None else list(anomalies)
+    prolonged_anomalies = [] if prolonged_anomalies is None else list(prolonged_anomalies)
+    starts = anomalies + [start for start, _ in prolonged_anomalies]
+    ends = anomalies + [end for _, end in prolonged_anomalies]
+    table = weather_window_stats(df, starts, ends, base_temperature)
+    table.insert(0, "kind", ["daily"] * len(anomalies) + ["prolonged"] * len(prolonged_anomalies))
+    return table
+
+
+@metrics.timed("analyse_weather_data")
 def analyse_weather_data(df, anomalies, prolonged_anomalies):
     """
     Analyse weather data to identify correlations with energy usage anomalies.
 
     Parameters:
-    df (pd.DataFrame): DataFrame containing weather data with a datetime index.
+    df (pd.DataFrame or DailyProfile): DataFrame containing weather data with a datetime index.
     anomalies (list): List of dates with energy usage anomalies.
     prolonged_anomalies (list): List of tuples with start and end dates of prolonged anomalies.
 
     Returns:
-    pd.DataFrame: DataFrame with weather data during anomalies.
+    tuple: Descriptions of the average temperature, the temperature during each anomaly and the average
+        temperature during each prolonged anomaly, the latter two None if there are no such anomalies.
     """
 
     # resample to daily data
-    df_daily = df.resample("D").mean()
+    df_daily = _daily_weather(df)
 
     # calculate average temperature
     average_temperature = df_daily["temperature"].mean()
     average_temperature_str = "Average temperature for location (°C): {:.2f}".format(average_temperature)
 
-    # calculate average temperature for each anomaly
+    # temperature statistics for every anomaly at once
+    table = anomaly_weather_table(df_daily, anomalies, prolonged_anomalies)
+    daily = table[table["kind"] == "daily"]
+    prolonged = table[table["kind"] == "prolonged"]
+
+    # average temperature for each anomaly
     anomaly_temperatures_str = None
     if anomalies is not None:
-        anomaly_temperatures = {}
-        for anomaly in anomalies:
-            anomaly_temperatures[anomaly] = df_daily.loc[anomaly, "temperature"]
-
         anomaly_temperatures_str = "Temperature during anomalies (°C): " + ", ".join(
             [
                 f"[{date.strftime('%Y-%m-%d')}: {temperature:.2f}]"
-                for date, temperature in anomaly_temperatures.items()
+                for date, temperature in zip(daily["start"], daily["mean_temperature"], strict=True)
             ]
         )
 
-    # calculate average temperature for each prolonged anomaly
+    # average temperature for each prolonged anomaly
     prolonged_anomaly_temperatures_str = None
     if prolonged_anomalies is not None:
-        prolonged_anomaly_temperatures = {}
-        for start_date, end_date in prolonged_anomalies:
-            prolonged_anomaly_temperatures[(start_date, end_date)] = df_daily.loc[
-                start_date:end_date, "temperature"
-            ].mean()
-
         prolonged_anomaly_temperatures_str = "Temperature during prolonged anomalies (°C): " + ", ".join(
             [
                 f"[{start_date.strftime('%Y-%m-%d')} - {end_date.strftime('%Y-%m-%d')}: {temperature:.2f}]"
-                for (start_date, end_date), temperature in prolonged_anomaly_temperatures.items()
+                for start_date, end_date, temperature in zip(
+                    prolonged["start"], prolonged["end"], prolonged["mean_temperature"], strict=True
+                )
             ]
         )
 
     return average_temperature_str, anomaly_temperatures_str, prolonged_anomaly_temperatures_str
 
 
-def plot_weather(df):
-    """Plots the weather data."""
+def plot_weather(df, max_points=None):
+    """
+    Plots the weather data.
+
+    Parameters:
+    df (pd.DataFrame or DailyProfile): DataFrame containing weather data with a datetime index.
+    max_points (int): If given and there are more days than this, consecutive days are averaged into
+        wider bars so that there are at most max_points bars.
+
+    Returns:
+    plotly.graph_objects.Figure: The figure.
+    """
 
     # resample to daily data
-    df_daily = df.resample("D").mean()
+    df_daily = _daily_weather(df)
+    if max_points is not None and len(df_daily) > max_points:
+        df_daily = df_daily.resample(f"{-(-len(df_daily) // max_points)}D").mean()
 
     # plot temperature data
     fig = px.bar(
@@ -0,0 +1,49 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from store import aggregate_daily
+from synthetic_data import generate_smart_meter_data
+
+
+@pytest.fixture
+def readings():
+    df, weather_df, _ = generate_smart_meter_data(days=20, n_meters=3, freq="1h", seed=3)
+    # a day without readings in the middle of the file
+    df = df.drop(df.loc["2024-08-10"].index)
+    return df, weather_df
+
+
+@pytest.mark.parametrize("chunksize", [7, 24, 100, 10_000])
+def test_sums_match_resample(tmp_path, readings, chunksize):
+    df, _ = readings
+    path = tmp_path / "usage.csv"
+    df.sample(frac=1, random_state=0).to_csv(path)
+    daily = aggregate_daily(str(path), chunksize=chunksize)
+    pd.testing.assert_frame_equal(daily, df.resample("D").sum(), check_freq=False)
+
+
+@pytest.mark.parametrize("chunksize", [7, 1000])
+def test_means_match_resample(tmp_path, readings, chunksize):
+    _, weather_df = readings
+    path = tmp_path / "weather.csv"
+    weather_df.to_csv(path)
+    daily = aggregate_daily(str(path), how="mean", chunksize=chunksize)
+    pd.testing.assert_frame_equal(daily, weather_df.resample("D").mean(), check_freq=False)
+
+
+def test_long_format_matches_resample_per_meter(tmp_path, readings):
+    df, _ = readings
+    long = df.stack().rename("usage").reset_index(level=1).rename(columns={"level_1": "meter"})
+    path = tmp_path / "long.csv"
+    long.sample(frac=1, random_state=1).to_csv(path)
+    daily = aggregate_daily(str(path), chunksize=50, meter_column="meter")
+    expected = df.resample("D").sum()
+    assert list(daily.columns) == list(expected.columns)
+    np.testing.assert_allclose(daily.to_numpy(), expected.to_numpy())
+    assert daily.index.equals(expected.index)
+
+
+def test_unknown_aggregation_raises(tmp_path):
+    with pytest.raises(ValueError):
+        aggregate_daily(str(tmp_path / "missing.csv"), how="max")
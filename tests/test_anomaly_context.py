@@ -0,0 +1,57 @@
+import pandas as pd
+
+from anomaly_context import anomaly_table, compact_anomaly_text, describe_anomalies
+from intraday import intraday_outliers
+from synthetic_data import generate_smart_meter_data
+from utils import DailyProfile, detect_daily_anomalies, detect_prolonged_anomalies
+
+
+def profile_with_outlier():
+    df, weather_df, _ = generate_smart_meter_data(days=90, seed=5)
+    # a device left on overnight, too small to show in the daily total
+    df.loc["2024-09-10 01:00":"2024-09-10 03:45", "usage"] += df["usage"].mean() * 3
+    return df, DailyProfile(df, weather_df)
+
+
+def test_intraday_outliers_are_rows_of_their_own():
+    df, profile = profile_with_outlier()
+    outliers = intraday_outliers(df)
+    assert not outliers.empty
+    table = anomaly_table(
+        profile, detect_daily_anomalies(df), detect_prolonged_anomalies(df), intraday_outliers=outliers
+    )
+
+    intraday = table[table["kind"] == "intraday"].sort_values("start")
+    assert list(intraday["start"]) == list(outliers["start"])
+    assert list(intraday["severity"]) == list(outliers["max_zscore"])
+    assert (intraday["days"] >= 1).all()
+    assert table["mean_temperature"].notna().all()
+    assert len(table[table["kind"] != "intraday"]) == len(
+        anomaly_table(profile, detect_daily_anomalies(df), detect_prolonged_anomalies(df))
+    )
+    assert any("(intraday)" in description for description in describe_anomalies(intraday))
+
+
+def test_intraday_outliers_survive_compaction():
+    df, profile = profile_with_outlier()
+    outliers = intraday_outliers(df)
+    table = anomaly_table(
+        profile, detect_daily_anomalies(df), detect_prolonged_anomalies(df), intraday_outliers=outliers
+    )
+    long_text = "anomaly " * 10000
+    for top_k in (10, 0):
+        text = compact_anomaly_text(long_text, table, "", max_tokens=1, top_k=top_k)
+        assert f"{len(outliers)} intraday anomalies" in text
+        assert "Intraday anomalies are marked as intraday." in text
+
+    # the last day of an outlier ending at midnight is the day it started
+    ends_at_midnight = pd.DataFrame(
+        {
+            "start": [pd.Timestamp("2024-09-10 23:00")],
+            "end": [pd.Timestamp("2024-09-11")],
+            "usage": [5.0],
+            "max_zscore": [6.0],
+        }
+    )
+    row = anomaly_table(profile, None, None, intraday_outliers=ends_at_midnight).iloc[0]
+    assert row["kind"] == "intraday" and row["days"] == 1
@@ -0,0 +1,137 @@
+import sqlite3
+from contextlib import closing
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from anomaly_store import AnomalyStore
+from synthetic_data import generate_smart_meter_data
+from utils import detect_daily_anomalies, detect_prolonged_anomalies, prolonged_anomaly_windows
+
+
+def detected(df):
+    """The detector results over the complete days of the readings."""
+    return detect_daily_anomalies(df), detect_prolonged_anomalies(df)
+
+
+def assert_same_anomalies(stored, expected):
+    if expected[0] is None:
+        assert stored[0] is None
+    else:
+        pd.testing.assert_index_equal(stored[0], expected[0], check_names=False)
+    assert stored[1] == expected[1]
+
+
+def frozen(path):
+    """The stored z-score statistics of the meter, and its prolonged windows with whether they are open."""
+    with closing(sqlite3.connect(path)) as conn:
+        mean, std = conn.execute("SELECT mean, std FROM meters WHERE meter_id = 'meter'").fetchone()
+        windows = conn.execute(
+            "SELECT start_day, end_day, is_open FROM windows WHERE meter_id = 'meter' AND kind = 'prolonged' "
+            "ORDER BY start_day"
+        ).fetchall()
+    return (
+        mean,
+        std,
+        [(pd.Timestamp(start), pd.Timestamp(end), bool(is_open)) for start, end, is_open in windows],
+    )
+
+
+def detected_with(df, mean, std):
+    """The detector results over the complete days of the readings, with the given z-score statistics."""
+    usage = df["usage"].resample("D").sum()
+    zscores = ((usage - mean) / std).to_numpy()
+    starts, ends = prolonged_anomaly_windows(zscores)
+    anomalies = usage.index[zscores > 2]
+    prolonged = list(zip(usage.index[starts], usage.index[ends], strict=True))
+    return (anomalies if len(anomalies) else None), (prolonged or None)
+
+
+def up_to_day(df, day):
+    """The readings up to the end of a day."""
+    return df[df.index < day + pd.Timedelta(days=1)]
+
+
+@pytest.fixture
+def readings():
+    df, _, _ = generate_smart_meter_data(days=120, seed=10)
+    return df
+
+
+def test_first_build_matches_the_detectors(tmp_path, readings):
+    store = AnomalyStore(str(tmp_path / "anomalies.sqlite"))
+    assert_same_anomalies(store.anomalies("meter", readings), detected(readings))
+    assert store.watermark("meter") == readings.index[-1].floor("D")
+
+
+@pytest.mark.parametrize("step_days", [1, 7])
+def test_appends_match_the_detectors_without_tolerance(tmp_path, readings, step_days):
+    store = AnomalyStore(str(tmp_path / "anomalies.sqlite"), zscore_tolerance=0)
+    days = readings.index.floor("D").unique()
+    for last in range(60, len(days) + 1, step_days):
+        df = readings[readings.index < days[last - 1] + pd.Timedelta(days=1)]
+        assert_same_anomalies(store.anomalies("meter", df), detected(df))
+
+
+def test_changing_the_tolerance_detects_again(tmp_path):
+    readings, _, _ = generate_smart_meter_data(days=120, seed=0)
+    path = str(tmp_path / "anomalies.sqlite")
+    days = readings.index.floor("D").unique()
+    for last in range(60, len(days) + 1):
+        stored = AnomalyStore(path).anomalies(
+            "meter", readings[readings.index < days[last - 1] + pd.Timedelta(days=1)]
+        )
+    # the statistics frozen within the default tolerance leave these results different from the detectors
+    with pytest.raises(AssertionError):
+        assert_same_anomalies(stored, detected(readings))
+    # no new readings, but the results are those of a full detection
+    assert_same_anomalies(
+        AnomalyStore(path, zscore_tolerance=0).anomalies("meter", readings), detected(readings)
+    )
+
+
+def test_appends_match_the_detectors_with_the_stored_statistics(tmp_path, readings):
+    path = str(tmp_path / "anomalies.sqlite")
+    # a tolerance that is never exceeded, so every new day is appended rather than detected again
+    store = AnomalyStore(path, zscore_tolerance=1e9)
+    days = readings.index.floor("D").unique()
+    store.anomalies("meter", up_to_day(readings, days[59]))
+    mean, std, _ = frozen(path)
+    for last in range(60, len(days), 3):
+        df = up_to_day(readings, days[last])
+        assert_same_anomalies(store.anomalies("meter", df), detected_with(df, mean, std))
+        assert frozen(path)[:2] == (mean, std)
+        assert store.watermark("meter") == days[last]
+
+
+def test_open_window_is_extended_and_closed(tmp_path):
+    index = pd.date_range("2024-01-01", periods=100 * 24, freq="h")
+    usage = pd.Series(np.random.default_rng(1).uniform(0.9, 1.1, len(index)), index=index)
+    usage["2024-02-26":"2024-03-02"] *= 3
+    df = usage.to_frame("usage")
+    path = str(tmp_path / "anomalies.sqlite")
+    store = AnomalyStore(path, zscore_tolerance=1e9)
+
+    # the high usage runs up to the watermark, so the window is open
+    opened = up_to_day(df, pd.Timestamp("2024-02-28"))
+    stored = store.anomalies("meter", opened)
+    mean, std, windows = frozen(path)
+    assert_same_anomalies(stored, detected_with(opened, mean, std))
+    ((start, end, is_open),) = windows
+    assert start <= pd.Timestamp("2024-02-26") and end == pd.Timestamp("2024-02-28") and is_open
+
+    # appended high days extend it, and may move its start earlier, as a longer run of high days averages
+    # above the threshold from further back
+    extended = up_to_day(df, pd.Timestamp("2024-03-01"))
+    assert_same_anomalies(store.anomalies("meter", extended), detected_with(extended, mean, std))
+    ((extended_start, extended_end, is_open),) = frozen(path)[2]
+    assert extended_start <= start and extended_end == pd.Timestamp("2024-03-01") and is_open
+
+    # and normal days close it
+    closed = up_to_day(df, pd.Timestamp("2024-04-05"))
+    assert_same_anomalies(store.anomalies("meter", closed), detected_with(closed, mean, std))
+    ((closed_start, closed_end, is_open),) = frozen(path)[2]
+    assert closed_start <= extended_start and closed_end >= pd.Timestamp("2024-03-02") and not is_open
+    # every step after the first was an append, with the statistics of the first detection
+    assert frozen(path)[:2] == (mean, std)
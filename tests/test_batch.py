@@ -0,0 +1,68 @@
+import pandas as pd
+import pytest
+
+from batch import REPORT_COLUMNS, analyse_chunk, build_report, find_jobs, run_batch, write_report
+from synthetic_data import generate_smart_meter_data
+
+
+@pytest.fixture
+def jobs(tmp_path):
+    meters = tmp_path / "meters"
+    meters.mkdir()
+    for i in range(6):
+        df, weather_df, _ = generate_smart_meter_data(days=60, freq="1h", seed=20 + i)
+        df.to_csv(meters / f"customer_{i}.csv")
+    weather_df.to_csv(tmp_path / "weather.csv")
+    (meters / "customer_3.csv").write_text("timestamp,usage\nyesterday,a lot\n")
+    return find_jobs(str(meters), str(tmp_path / "weather.csv"))
+
+
+def pool_report(jobs, **kwargs):
+    rows = []
+    for _, chunk_rows in run_batch(jobs, workers=2, chunk_size=2, max_pending=1, **kwargs):
+        rows += chunk_rows
+    return build_report(rows)
+
+
+def test_pool_and_serial_reports_are_identical(jobs):
+    serial = build_report(analyse_chunk(jobs)[1])
+    pd.testing.assert_frame_equal(pool_report(jobs), serial)
+    # the chunked reads find the same anomalies, and fail on the malformed file with their own message
+    pd.testing.assert_frame_equal(
+        pool_report(jobs, chunksize=100).drop(columns="error"), serial.drop(columns="error")
+    )
+
+    assert list(serial.columns) == REPORT_COLUMNS
+    assert set(serial["customer"]) == {f"customer_{i}" for i in range(6)}
+    assert (serial["kind"] != "error").sum() > 0
+
+
+def test_malformed_file_is_an_error_row(jobs):
+    count, rows = analyse_chunk(jobs)
+    assert count == len(jobs)
+    report = build_report(rows)
+    errors = report[report["kind"] == "error"]
+    assert list(errors["customer"]) == ["customer_3"]
+    assert errors["error"].iloc[0]
+    # the customers after it in the same chunk are still analysed
+    assert {"customer_4", "customer_5"} <= set(report.loc[report["kind"] != "error", "customer"])
+
+
+@pytest.mark.parametrize("extension", [".csv", ".parquet", ".jsonl"])
+def test_write_report(tmp_path, jobs, extension):
+    report = build_report(analyse_chunk(jobs)[1])
+    path = tmp_path / f"report{extension}"
+    write_report(report, str(path))
+    if extension == ".csv":
+        written = pd.read_csv(path)
+    elif extension == ".parquet":
+        written = pd.read_parquet(path)
+    else:
+        written = pd.read_json(path, lines=True)
+    assert list(written.columns) == REPORT_COLUMNS
+    assert list(written["customer"]) == list(report["customer"])
+
+
+def test_unknown_report_format(tmp_path):
+    with pytest.raises(ValueError, match="Unknown report format"):
+        write_report(pd.DataFrame(columns=REPORT_COLUMNS), str(tmp_path / "report.xlsx"))
@@ -0,0 +1,113 @@
+import pytest
+from langchain_core.documents import Document
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+from langchain_core.runnables import RunnableLambda
+
+from chat_history import BudgetedChatHistory, create_selective_history_aware_retriever, references_history
+
+
+def summary_model(summary="The user asked about their usage.", calls=100):
+    return FakeListChatModel(responses=[summary] * calls)
+
+
+def add_turn(history, turn, length=10):
+    """Adds an exchange whose messages are each about length tokens."""
+    history.add_messages(
+        [
+            HumanMessage(f"question {turn} " + "q" * 4 * length),
+            AIMessage(f"answer {turn} " + "a" * 4 * length),
+        ]
+    )
+
+
+def test_summary_call_only_every_few_turns():
+    llm = summary_model()
+    history = BudgetedChatHistory(llm, max_tokens=200, keep_turns=2)
+    for turn in range(30):
+        add_turn(history, turn)
+        assert history.token_count() <= 200
+    assert 0 < llm.i <= 5
+    assert history.messages[0].type == "system"
+    # the last exchanges are kept verbatim
+    assert history.messages[-1].content.startswith("answer 29")
+    assert history.messages[-3].content.startswith("answer 28")
+
+
+def test_budget_holds_when_the_recent_exchanges_do_not_fit():
+    llm = summary_model()
+    history = BudgetedChatHistory(llm, max_tokens=100, keep_turns=2)
+    for turn in range(10):
+        add_turn(history, turn, length=40)
+        assert history.token_count() <= 100
+    # each exchange is over the budget on its own, so it is folded on the turn it is added
+    assert llm.i == 10
+    assert history.recent == []
+
+
+def test_older_exchanges_are_dropped_without_a_model():
+    history = BudgetedChatHistory(max_tokens=100, keep_turns=4)
+    for turn in range(10):
+        add_turn(history, turn)
+        assert history.token_count() <= 100
+    assert history.summary == ""
+    # the last four exchanges are over the budget, so only three are kept
+    assert history.messages[0].content.startswith("question 7")
+
+
+def test_explicit_zero_is_not_replaced_by_the_default(monkeypatch):
+    monkeypatch.setenv("CHAT_HISTORY_MAX_TOKENS", "2000")
+    monkeypatch.setenv("CHAT_HISTORY_KEEP_TURNS", "4")
+    history = BudgetedChatHistory(max_tokens=0, keep_turns=0)
+    assert (history.max_tokens, history.keep_turns) == (0, 0)
+    add_turn(history, 0)
+    assert history.messages == []
+    assert (BudgetedChatHistory().max_tokens, BudgetedChatHistory().keep_turns) == (2000, 4)
+
+
+def test_summary_over_the_budget_raises():
+    history = BudgetedChatHistory(summary_model("s" * 1000), max_tokens=100, keep_turns=1)
+    with pytest.raises(ValueError, match="over the budget"):
+        for turn in range(10):
+            add_turn(history, turn)
+
+
+@pytest.mark.parametrize(
+    "question, expected",
+    [
+        ("Why was my usage high in March?", False),
+        ("What is the average temperature where I live?", False),
+        ("Why did it happen?", True),
+        ("And in April?", True),
+        ("What about the weekends then?", True),
+        ("Why?", True),
+    ],
+)
+def test_references_history(question, expected):
+    assert references_history(question) is expected
+
+
+def test_only_questions_that_refer_back_are_rewritten():
+    rewrites = []
+
+    def rewrite(prompt_value):
+        rewrites.append(prompt_value)
+        return "Why was my usage high on 2024-08-12?"
+
+    prompt = ChatPromptTemplate.from_messages([MessagesPlaceholder("chat_history"), ("human", "{input}")])
+    retriever = RunnableLambda(lambda query: [Document(query)])
+    chain = create_selective_history_aware_retriever(RunnableLambda(rewrite), retriever, prompt)
+    history = [HumanMessage("Was there an anomaly on 2024-08-12?"), AIMessage("Yes, usage was high.")]
+
+    # no history, or a question that stands on its own, goes straight to the retriever
+    assert chain.invoke({"input": "Why did it happen?", "chat_history": []})[0].page_content == (
+        "Why did it happen?"
+    )
+    question = "What is the average temperature where I live?"
+    assert chain.invoke({"input": question, "chat_history": history})[0].page_content == question
+    assert rewrites == []
+
+    documents = chain.invoke({"input": "Why did it happen?", "chat_history": history})
+    assert documents[0].page_content == "Why was my usage high on 2024-08-12?"
+    assert len(rewrites) == 1
@@ -0,0 +1,105 @@
+import asyncio
+import functools
+import json
+import os
+import time
+import uuid
+
+from aiohttp.test_utils import TestClient, TestServer
+from langchain_openai import OpenAIEmbeddings
+
+import embedding_cache
+import http_clients
+from anomaly_store import AnomalyStore
+from chat_server import ChatServer
+from chatbot_rag_anomaly_detection import SharedResources
+from figure_cache import FigureCache
+from stub_openai_server import StubOpenAIServer
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+async def read_answer(client, session_id, input):
+    """The chunks of a streamed answer, and whether the stream was ended by the server."""
+    chunks, ended = [], False
+    async with client.post(f"/sessions/{session_id}/messages", json={"input": input}) as response:
+        assert response.status == 200
+        assert response.headers["Content-Type"] == "text/event-stream"
+        async for line in response.content:
+            line = line.decode().strip()
+            if line == "event: end":
+                ended = True
+            elif line.startswith("data: ") and not ended:
+                chunks.append(json.loads(line[len("data: ") :]))
+    return chunks, ended
+
+
+async def chat(client, question):
+    async with client.post("/sessions") as response:
+        assert response.status == 201
+        session_id = (await response.json())["session_id"]
+    answers = [await read_answer(client, session_id, f"{question} {turn}") for turn in range(2)]
+    async with client.delete(f"/sessions/{session_id}") as response:
+        assert response.status == 204
+    return answers
+
+
+def test_concurrent_sessions_against_the_stub_api(monkeypatch, tmp_path):
+    monkeypatch.chdir(REPOSITORY)
+    for name, value in {
+        "LLM_PROVIDER": "openai",
+        "EMBEDDINGS_PROVIDER": "openai",
+        "OPENAI_API_KEY": "unused",
+        "OPENAI_MAX_CONNECTIONS": "4",
+    }.items():
+        monkeypatch.setenv(name, value)
+    # fresh pooled clients for this event loop, and the stub vectors kept out of the embedding cache
+    monkeypatch.setattr(http_clients, "_clients", {})
+    monkeypatch.setattr(
+        embedding_cache,
+        "PersistentEmbeddingCache",
+        functools.partial(embedding_cache.PersistentEmbeddingCache, path=str(tmp_path / "embeddings.npz")),
+    )
+    # texts are sent whole, as splitting them into tokens needs the tokenizer files from the internet
+    monkeypatch.setattr(
+        embedding_cache,
+        "OpenAIEmbeddings",
+        functools.partial(OpenAIEmbeddings, check_embedding_ctx_length=False),
+    )
+    n_sessions, first_token_latency, token_latency, response_tokens = 8, 0.5, 0.01, 20
+
+    async def run():
+        stub = StubOpenAIServer(token_latency, first_token_latency, response_tokens)
+        stub_server = TestServer(stub.app())
+        await stub_server.start_server()
+        monkeypatch.setenv("OPENAI_BASE_URL", str(stub_server.make_url("/v1")))
+        # the start-up embeds the documents with the blocking client, so it runs off the stub's event loop
+        shared = await asyncio.to_thread(
+            SharedResources,
+            figure_cache=FigureCache(str(tmp_path / "figures")),
+            anomaly_store=AnomalyStore(str(tmp_path / "anomalies.sqlite")),
+        )
+        assert stub.requests["/v1/embeddings"] > 0
+
+        async with TestClient(TestServer(ChatServer(shared).app())) as client:
+            started = time.perf_counter()
+            results = await asyncio.gather(
+                *(chat(client, f"Why was my usage high? {uuid.uuid4().hex}") for _ in range(n_sessions))
+            )
+            elapsed = time.perf_counter() - started
+        await stub_server.close()
+        return stub, results, elapsed
+
+    stub, results, elapsed = asyncio.run(run())
+
+    for answers in results:
+        for chunks, ended in answers:
+            assert ended and len("".join(chunks).split()) == response_tokens
+    # every question is embedded by the retriever and answered by the chat model
+    assert stub.requests["/v1/chat/completions"] >= 2 * n_sessions
+    assert stub.requests["/v1/embeddings"] >= 2 * n_sessions + 1
+    # the sessions were answered at once, in well under the time of answering them one after another, through
+    # no more connections than the sync and async pools allow
+    answer_time = first_token_latency + token_latency * (response_tokens - 1)
+    assert elapsed < n_sessions * answer_time
+    assert len(stub.connections) <= 2 * 4
@@ -0,0 +1,28 @@
+import pandas as pd
+
+from synthetic_data import generate_smart_meter_data
+from utils import (
+    DailyProfile,
+    analyse_weather_data,
+    detect_daily_anomalies,
+    detect_prolonged_anomalies,
+    plot_anomalies,
+)
+
+
+def test_profile_matches_dataframes():
+    df, weather_df, _ = generate_smart_meter_data(days=120, seed=7)
+    profile = DailyProfile(df, weather_df)
+
+    anomalies = detect_daily_anomalies(df)
+    prolonged_anomalies = detect_prolonged_anomalies(df)
+    pd.testing.assert_index_equal(detect_daily_anomalies(profile), anomalies)
+    assert detect_prolonged_anomalies(profile) == prolonged_anomalies
+    assert detect_prolonged_anomalies(profile, method="reference") == prolonged_anomalies
+    assert analyse_weather_data(profile, anomalies, prolonged_anomalies) == analyse_weather_data(
+        weather_df, anomalies, prolonged_anomalies
+    )
+    assert (
+        plot_anomalies(profile, anomalies, prolonged_anomalies).to_json()
+        == plot_anomalies(df, anomalies, prolonged_anomalies).to_json()
+    )
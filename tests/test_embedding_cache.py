@@ -0,0 +1,50 @@
+from embedding_cache import HashingEmbeddings, PersistentEmbeddingCache
+
+
+class CountingEmbeddings(HashingEmbeddings):
+    """HashingEmbeddings that records the texts it is asked to embed."""
+
+    def __init__(self):
+        super().__init__(dimensions=32)
+        self.embedded = []
+
+    def embed_documents(self, texts):
+        self.embedded += texts
+        return super().embed_documents(texts)
+
+
+def cache(path):
+    embeddings = CountingEmbeddings()
+    return embeddings, PersistentEmbeddingCache(embeddings, embeddings.model, str(path))
+
+
+def test_second_instance_hits_the_cache(tmp_path):
+    path = tmp_path / "embeddings.npz"
+    texts = ["usage was high on Monday", "the bill is estimated"]
+    first, first_cache = cache(path)
+    vectors = first_cache.embed_documents(texts)
+    assert first.embedded == texts
+
+    second, second_cache = cache(path)
+    assert second_cache.embed_documents(texts) == vectors
+    assert second.embedded == []
+
+    # changed content is embedded again, the unchanged text is not
+    assert second_cache.embed_documents([texts[0], "the bill is final"])[0] == vectors[0]
+    assert second.embedded == ["the bill is final"]
+
+
+def test_processes_do_not_overwrite_each_others_vectors(tmp_path):
+    path = tmp_path / "embeddings.npz"
+    # both read the index before either has written to it, as two app processes starting together
+    _, first_cache = cache(path)
+    _, second_cache = cache(path)
+    first_cache.embed_documents(["first document"])
+    second_cache.embed_documents(["second document"])
+
+    third, third_cache = cache(path)
+    third_cache.embed_documents(["first document", "second document"])
+    assert third.embedded == []
+    # a vector added by another process is read from disk rather than embedded again
+    first_cache.embed_documents(["second document"])
+    assert first_cache.embeddings.embedded == ["first document"]
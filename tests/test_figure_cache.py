@@ -0,0 +1,47 @@
+import os
+import time
+import zlib
+
+import plotly.graph_objects as go
+
+from figure_cache import FigureCache, data_fingerprint
+from synthetic_data import generate_smart_meter_data
+from utils import detect_daily_anomalies
+
+
+def test_fingerprint_changes_with_the_anomalies_drawn():
+    df, _, _ = generate_smart_meter_data(days=60, seed=9)
+    fingerprint = data_fingerprint(df)
+    anomalies = detect_daily_anomalies(df)
+    assert data_fingerprint(fingerprint, anomalies, None) == data_fingerprint(fingerprint, anomalies, None)
+    assert data_fingerprint(fingerprint, anomalies, None) != data_fingerprint(
+        fingerprint, anomalies[:1], None
+    )
+    assert data_fingerprint(fingerprint, anomalies, None) != data_fingerprint(fingerprint, anomalies, 1000)
+
+
+def test_least_recently_used_specs_are_evicted(tmp_path):
+    cache = FigureCache(str(tmp_path), max_entries=2)
+    keys = [cache.key("customer", str(i), "anomalies") for i in range(3)]
+    cache.put(keys[0], go.Figure())
+    cache.put(keys[1], go.Figure())
+    # a read counts as a use, so the second spec is now the least recently used
+    past = time.time() - 60
+    os.utime(cache._path(keys[1]), (past, past))
+    os.utime(cache._path(keys[0]), (past - 1, past - 1))
+    assert zlib.decompress(cache.get(keys[0]))
+    cache.put(keys[2], go.Figure())
+    assert cache.get(keys[0]) is not None
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[2]) is not None
+
+
+def test_expired_specs_are_evicted(tmp_path):
+    cache = FigureCache(str(tmp_path), ttl=3600)
+    old, new = cache.key("customer", "old", "weather"), cache.key("customer", "new", "weather")
+    cache.put(old, go.Figure())
+    past = time.time() - 7200
+    os.utime(cache._path(old), (past, past))
+    cache.put(new, go.Figure())
+    assert cache.get(old) is None
+    assert cache.get(new) is not None
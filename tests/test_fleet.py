@@ -0,0 +1,55 @@
+import pytest
+
+from fleet import detect_fleet_anomalies
+from synthetic_data import generate_smart_meter_data
+from utils import detect_daily_anomalies, detect_prolonged_anomalies
+
+
+def per_meter_anomalies(df, min_consecutive_days, zscore_threshold):
+    """The anomalies of each meter found by the utils functions, as rows of detect_fleet_anomalies."""
+    rows = []
+    for meter_id in df.columns:
+        meter_df = df[[meter_id]].rename(columns={meter_id: "usage"})
+        days = detect_daily_anomalies(meter_df)
+        rows += [(meter_id, "daily", day, day) for day in ([] if days is None else days)]
+        windows = detect_prolonged_anomalies(meter_df, min_consecutive_days, zscore_threshold) or []
+        rows += [(meter_id, "prolonged", start, end) for start, end in windows]
+    return sorted(rows)
+
+
+def fleet_rows(anomalies):
+    return sorted(
+        zip(
+            anomalies["meter_id"],
+            anomalies["kind"].astype(str),
+            anomalies["start"],
+            anomalies["end"],
+            strict=True,
+        )
+    )
+
+
+# scipy warns about the z-scores of the constant meter
+@pytest.mark.filterwarnings("ignore:Precision loss")
+@pytest.mark.parametrize("min_consecutive_days", [2, 3, 5])
+@pytest.mark.parametrize("zscore_threshold", [1.0, 1.5])
+def test_fleet_matches_per_meter(min_consecutive_days, zscore_threshold):
+    df, _, _ = generate_smart_meter_data(days=120, n_meters=20, freq="1h", seed=1)
+    # a constant meter has no z-scores and no anomalies
+    df["meter_constant"] = 1.0
+    anomalies = detect_fleet_anomalies(
+        df, min_consecutive_days=min_consecutive_days, zscore_threshold=zscore_threshold, meter_chunk_size=7
+    )
+    assert fleet_rows(anomalies) == per_meter_anomalies(df, min_consecutive_days, zscore_threshold)
+
+
+def test_fleet_array_matches_dataframe():
+    df, _, _ = generate_smart_meter_data(days=60, n_meters=5, freq="1h", seed=2)
+    from_frame = detect_fleet_anomalies(df)
+    from_array = detect_fleet_anomalies(df.to_numpy(), readings_per_day=24)
+    days = df.resample("D").sum().index
+    assert list(from_array["meter_id"]) == [
+        df.columns.get_loc(meter_id) for meter_id in from_frame["meter_id"]
+    ]
+    assert list(days[from_array["start"]]) == list(from_frame["start"])
+    assert list(days[from_array["end"]]) == list(from_frame["end"])
@@ -0,0 +1,65 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from intraday import detect_intraday_anomalies, intraday_outliers, slot_baseline, slot_matrix
+from synthetic_data import generate_smart_meter_data
+
+
+def naive_baseline(matrix, weeks, slot_window, min_history):
+    """The median and MAD of the history of each slot, one slot at a time."""
+    n_days, slots_per_day = matrix.shape
+    # the baseline is computed in float32
+    flat = matrix.ravel().astype(np.float32)
+    baseline = np.full(flat.size, np.nan)
+    deviation = np.full(flat.size, np.nan)
+    for position in range(flat.size):
+        history = []
+        for week in range(1, weeks + 1):
+            for offset in range(-slot_window, slot_window + 1):
+                other = position - 7 * slots_per_day * week + offset
+                if 0 <= other < flat.size and np.isfinite(flat[other]):
+                    history.append(flat[other])
+        if len(history) >= min_history:
+            baseline[position] = np.median(history)
+            deviation[position] = np.median(np.abs(np.array(history) - baseline[position]))
+    return baseline.reshape(n_days, slots_per_day), deviation.reshape(n_days, slots_per_day)
+
+
+@pytest.mark.parametrize("chunk_days", [1, 3, 366])
+def test_baseline_matches_a_loop_over_the_slots(chunk_days):
+    rng = np.random.default_rng(0)
+    matrix = rng.gamma(2.0, size=(40, 8))
+    matrix[rng.random(matrix.shape) < 0.1] = np.nan
+    baseline, deviation = slot_baseline(matrix, weeks=2, slot_window=1, min_history=3, chunk_days=chunk_days)
+    expected_baseline, expected_deviation = naive_baseline(matrix, weeks=2, slot_window=1, min_history=3)
+
+    np.testing.assert_allclose(baseline, expected_baseline, rtol=1e-6)
+    np.testing.assert_allclose(deviation, expected_deviation, rtol=1e-5, atol=1e-6)
+    # the first week has no history, and later slots have enough
+    assert np.isnan(baseline[:7]).all() and np.isfinite(baseline[21:]).mean() > 0.9
+
+
+def test_slot_matrix_sums_readings_and_leaves_missing_slots_empty():
+    index = pd.DatetimeIndex(["2024-01-01 00:10", "2024-01-01 00:20", "2024-01-02 23:50"])
+    days, matrix = slot_matrix(pd.DataFrame({"usage": [1.0, 2.0, 4.0]}, index=index), slots_per_day=24)
+    assert list(days) == [pd.Timestamp("2024-01-01"), pd.Timestamp("2024-01-02")]
+    assert matrix[0, 0] == 3.0 and matrix[1, 23] == 4.0
+    assert np.isnan(matrix).sum() == 2 * 24 - 2
+
+
+def test_spike_over_midnight_is_one_outlier():
+    df, _, _ = generate_smart_meter_data(days=60, seed=12)
+    spike_start, spike_end = pd.Timestamp("2024-09-20 23:00"), pd.Timestamp("2024-09-21 01:00")
+    df.loc[spike_start : spike_end - pd.Timedelta(minutes=15), "usage"] += df["usage"].mean() * 4
+
+    outliers = intraday_outliers(df)
+    overlapping = outliers[(outliers["start"] < spike_end) & (outliers["end"] > spike_start)]
+    assert len(overlapping) == 1
+    spike = overlapping.iloc[0]
+    assert spike["start"] == spike_start and spike["end"] == spike_end
+    assert spike["slots"] == 8 and spike["max_zscore"] > 3.5
+    assert spike["usage"] > spike["baseline"]
+    # both days it touches are reported as days with intraday anomalies
+    days = detect_intraday_anomalies(df)
+    assert {pd.Timestamp("2024-09-20"), pd.Timestamp("2024-09-21")} <= set(days)
@@ -0,0 +1,105 @@
+import asyncio
+import json
+
+import pytest
+
+import metrics as metrics_module
+from metrics import Metrics, ameasure_stream, measure_stream
+
+
+@pytest.fixture
+def metrics(monkeypatch):
+    """A fresh process-wide Metrics, for the stream helpers that record to it."""
+    metrics = Metrics()
+    monkeypatch.setattr(metrics_module, "metrics", metrics)
+    return metrics
+
+
+def test_timed_records_each_call_also_when_it_raises(metrics):
+    @metrics.timed("work")
+    def work(fail=False):
+        """Does the work."""
+        if fail:
+            raise RuntimeError("failed")
+        return 42
+
+    assert work() == 42
+    with pytest.raises(RuntimeError):
+        work(fail=True)
+    assert work.__doc__ == "Does the work."
+    stats = metrics.summary()["stages"]["work"]
+    assert stats["count"] == 2
+    assert 0 <= stats["p50"] <= stats["max"] and stats["sum"] == pytest.approx(stats["mean"] * 2)
+
+
+def test_measure_stream(metrics):
+    assert list(measure_stream(iter("abc"), name="test")) == ["a", "b", "c"]
+
+    async def chunks():
+        for chunk in "de":
+            yield chunk
+
+    async def collect():
+        return [chunk async for chunk in ameasure_stream(chunks(), name="test")]
+
+    assert asyncio.run(collect()) == ["d", "e"]
+    summary = metrics.summary()
+    assert summary["stages"]["test_time_to_first_chunk"]["count"] == 2
+    assert summary["stages"]["test_stream_total"]["count"] == 2
+    assert summary["counters"]["test_chunks_total"] == [{"labels": {}, "value": 5}]
+
+
+def test_labelled_counters_are_separate_series():
+    metrics = Metrics()
+    metrics.increment("output_tokens_total", 10, stage="answer")
+    metrics.increment("output_tokens_total", 5, stage="summary")
+    metrics.increment("output_tokens_total", 1, stage="answer")
+    metrics.increment("chat_sessions_total")
+
+    assert metrics.summary()["counters"] == {
+        "chat_sessions_total": [{"labels": {}, "value": 1}],
+        "output_tokens_total": [
+            {"labels": {"stage": "answer"}, "value": 11},
+            {"labels": {"stage": "summary"}, "value": 5},
+        ],
+    }
+
+
+def test_prometheus_format():
+    metrics = Metrics()
+    metrics.observe("llm", 0.5)
+    metrics.observe("llm", 1.5)
+    metrics.increment("output_tokens_total", 10, stage="answer", model='gpt-"4o"')
+    metrics.increment("chat_sessions_total")
+
+    lines = metrics.to_prometheus().splitlines()
+    assert "# TYPE stage_duration_seconds summary" in lines
+    assert 'stage_duration_seconds{stage="llm",quantile="0.5"} 1.0' in lines
+    assert 'stage_duration_seconds_sum{stage="llm"} 2.0' in lines
+    assert 'stage_duration_seconds_count{stage="llm"} 2' in lines
+    assert "# TYPE output_tokens_total counter" in lines
+    assert 'output_tokens_total{model="gpt-\\"4o\\"",stage="answer"} 10.0' in lines
+    assert "chat_sessions_total 1.0" in lines
+    # one type line per counter, before its series
+    assert lines.count("# TYPE output_tokens_total counter") == 1
+
+
+def test_jsonl_export(tmp_path):
+    path = tmp_path / "observations.jsonl"
+    metrics = Metrics(jsonl_path=str(path))
+    metrics.observe("retrieval", 0.25, session="a")
+    metrics.increment("retrieved_chunks_total", 4, stage="retrieval")
+
+    observations = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [observation["type"] for observation in observations] == ["stage", "counter"]
+    assert observations[0]["seconds"] == 0.25 and observations[0]["session"] == "a"
+    assert observations[1]["stage"] == "retrieval" and "time" in observations[1]
+
+    summary = [json.loads(line) for line in metrics.to_jsonl().splitlines()]
+    assert summary[0]["stage"] == "retrieval" and summary[0]["count"] == 1
+    assert summary[1] == {"counter": "retrieved_chunks_total", "labels": {"stage": "retrieval"}, "value": 4}
+
+    metrics.write(str(tmp_path / "summary.jsonl"))
+    metrics.write(str(tmp_path / "summary.prom"))
+    assert (tmp_path / "summary.jsonl").read_text() == metrics.to_jsonl()
+    assert (tmp_path / "summary.prom").read_text() == metrics.to_prometheus()
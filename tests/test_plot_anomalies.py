@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from synthetic_data import generate_smart_meter_data
+from utils import minmax_downsample, plot_anomalies
+
+
+@pytest.mark.parametrize("n, max_points", [(10_000, 100), (10_001, 101), (999, 10), (50, 4)])
+def test_downsampling_keeps_the_extremes_of_every_bucket(n, max_points):
+    values = np.random.default_rng(n).normal(size=n)
+    values[::97] = np.nan
+    keep = minmax_downsample(values, max_points)
+
+    assert len(keep) <= max_points
+    assert np.all(np.diff(keep) > 0) and keep[0] == 0 and keep[-1] == n - 1
+    bucket_size = -(-n // max((max_points - 2) // 2, 1))
+    for start in range(0, n, bucket_size):
+        bucket = values[start : start + bucket_size]
+        assert start + np.nanargmin(bucket) in keep
+        assert start + np.nanargmax(bucket) in keep
+
+
+def test_short_series_are_not_downsampled():
+    assert list(minmax_downsample(np.arange(5.0), 5)) == list(range(5))
+
+
+def test_highlights_are_bounded_by_max_points():
+    df, _, _ = generate_smart_meter_data(days=400, freq="1h", seed=11)
+    days = df.index.floor("D").unique()
+    # every other day, so none of them merge as consecutive days
+    anomalies = days[::2]
+    prolonged_anomalies = [(start, start + pd.Timedelta(days=3)) for start in days[1:-4:5]]
+    max_points = 50
+
+    fig = plot_anomalies(df, anomalies, prolonged_anomalies, max_points=max_points)
+    assert len(fig.data[0].x) <= max_points
+    assert len(fig.layout.shapes) <= max_points
+    assert len(fig.layout.annotations) <= max_points
+
+    # every anomaly is still covered by a highlight of its kind
+    for color, dates in [("yellow", anomalies), ("red", [start for start, _ in prolonged_anomalies])]:
+        ranges = [
+            (pd.Timestamp(shape.x0), pd.Timestamp(shape.x1))
+            for shape in fig.layout.shapes
+            if shape.fillcolor == color
+        ]
+        assert all(any(x0 <= date < x1 for x0, x1 in ranges) for date in dates)
+
+    few = plot_anomalies(df, anomalies[:3], prolonged_anomalies[:2], max_points=max_points)
+    assert len(few.layout.shapes) == 5
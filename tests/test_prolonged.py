@@ -0,0 +1,70 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils import _detect_prolonged_anomalies_reference, detect_prolonged_anomalies, prolonged_anomaly_windows
+
+
+def reference_windows(zscores, min_consecutive_days, zscore_threshold):
+    """Start and end positions of the windows found by the original sweep."""
+    index = pd.date_range("2024-01-01", periods=len(zscores), freq="D")
+    df_daily = pd.DataFrame({"zscore": zscores}, index=index)
+    windows = _detect_prolonged_anomalies_reference(df_daily, min_consecutive_days, zscore_threshold) or []
+    return [(index.get_loc(start), index.get_loc(end)) for start, end in windows]
+
+
+def fast_windows(zscores, min_consecutive_days, zscore_threshold):
+    starts, ends = prolonged_anomaly_windows(zscores, min_consecutive_days, zscore_threshold)
+    return list(zip(starts.tolist(), ends.tolist(), strict=True))
+
+
+# the reference drops a final single day window, so the methods are only compared from two days up
+@pytest.mark.parametrize("min_consecutive_days", [2, 3, 5])
+@pytest.mark.parametrize("zscore_threshold", [0.5, 1.5, 2.0])
+@pytest.mark.parametrize("n_days", [1, 2, 3, 10, 60, 200])
+def test_fast_windows_match_reference(n_days, zscore_threshold, min_consecutive_days):
+    rng = np.random.default_rng(n_days)
+    for _ in range(3):
+        zscores = rng.normal(0.5, 1.5, n_days)
+        assert fast_windows(zscores, min_consecutive_days, zscore_threshold) == reference_windows(
+            zscores, min_consecutive_days, zscore_threshold
+        )
+
+
+@pytest.mark.parametrize("min_consecutive_days", [2, 3, 4])
+@pytest.mark.parametrize("zscore_threshold", [1.0, 1.5, 2.0])
+def test_fast_windows_match_reference_on_ties(zscore_threshold, min_consecutive_days):
+    # multiples of 0.5 sum exactly, so many windows average exactly the threshold
+    rng = np.random.default_rng(0)
+    for _ in range(20):
+        zscores = rng.integers(0, 7, 40) / 2
+        assert fast_windows(zscores, min_consecutive_days, zscore_threshold) == reference_windows(
+            zscores, min_consecutive_days, zscore_threshold
+        )
+
+
+def test_windows_do_not_span_nan():
+    zscores = np.array([3.0, 3.0, np.nan, 3.0, 3.0, 3.0, 0.0, np.nan, 2.0, 2.0])
+    assert fast_windows(zscores, 2, 1.5) == reference_windows(zscores, 2, 1.5) == [(0, 1), (3, 6), (8, 9)]
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_detect_prolonged_anomalies_methods_match(seed):
+    rng = np.random.default_rng(seed)
+    index = pd.date_range("2024-01-01", periods=60 * 24, freq="h")
+    df = pd.DataFrame({"usage": rng.gamma(2.0, 1.0, len(index))}, index=index)
+    # raise the usage for a few days so there is something to find
+    df.loc["2024-02-10":"2024-02-14", "usage"] *= 1.5
+    for min_consecutive_days in (2, 3, 7):
+        for zscore_threshold in (0.5, 1.0, 1.5):
+            fast = detect_prolonged_anomalies(df, min_consecutive_days, zscore_threshold, method="fast")
+            reference = detect_prolonged_anomalies(
+                df, min_consecutive_days, zscore_threshold, method="reference"
+            )
+            assert (fast or []) == (reference or [])
+
+
+def test_unknown_method_raises():
+    index = pd.date_range("2024-01-01", periods=10, freq="D")
+    with pytest.raises(ValueError):
+        detect_prolonged_anomalies(pd.DataFrame({"usage": np.arange(10.0)}, index=index), method="slow")
@@ -0,0 +1,81 @@
+import sqlite3
+
+import pytest
+
+import response_cache
+from response_cache import ResponseCache
+
+
+class Clock:
+    """Stands in for time.time in the cache, so expiry and recency do not depend on the test's speed."""
+
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(response_cache.time, "time", clock)
+    return clock
+
+
+def test_key_depends_on_every_part():
+    key = ResponseCache.key("gpt-4o", "anomalies", "Why?")
+    assert key == ResponseCache.key("gpt-4o", "anomalies", "Why?")
+    assert key != ResponseCache.key("gpt-4o-mini", "anomalies", "Why?")
+    assert ResponseCache.key("ab", "c") != ResponseCache.key("a", "bc")
+
+
+def test_hit_and_miss(tmp_path, clock):
+    cache = ResponseCache(str(tmp_path / "responses.sqlite"))
+    assert cache.get("missing") is None
+    cache.put("key", "The usage was high.")
+    assert cache.get("key") == "The usage was high."
+    # another instance, e.g. in another process, reads the same responses
+    assert ResponseCache(str(tmp_path / "responses.sqlite")).get("key") == "The usage was high."
+
+
+def test_responses_expire(tmp_path, clock):
+    cache = ResponseCache(str(tmp_path / "responses.sqlite"), ttl=60)
+    cache.put("key", "response")
+    clock.now += 59
+    assert cache.get("key") == "response"
+    clock.now += 2
+    assert cache.get("key") is None
+
+
+def test_least_recently_used_responses_are_evicted(tmp_path, clock):
+    cache = ResponseCache(str(tmp_path / "responses.sqlite"), max_entries=2)
+    for key in ["first", "second"]:
+        cache.put(key, key)
+        clock.now += 1
+    # reading the first makes the second the least recently used
+    assert cache.get("first") == "first"
+    clock.now += 1
+    cache.put("third", "third")
+    assert cache.get("first") == "first"
+    assert cache.get("second") is None
+    assert cache.get("third") == "third"
+
+
+def test_connections_are_closed(tmp_path, monkeypatch):
+    connections = []
+    sqlite_connect = sqlite3.connect
+
+    def connect(*args, **kwargs):
+        connections.append(sqlite_connect(*args, **kwargs))
+        return connections[-1]
+
+    monkeypatch.setattr(response_cache.sqlite3, "connect", connect)
+    cache = ResponseCache(str(tmp_path / "responses.sqlite"))
+    cache.put("key", "response")
+    cache.get("key")
+    cache.get("missing")
+    assert len(connections) == 4
+    for connection in connections:
+        with pytest.raises(sqlite3.ProgrammingError):
+            connection.execute("SELECT 1")
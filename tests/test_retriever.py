@@ -0,0 +1,38 @@
+from anomaly_context import anomaly_documents, anomaly_table
+from retriever import NumpyRetriever, build_customer_retriever, load_customer_documents
+from store import DEFAULT_METER
+from synthetic_data import generate_smart_meter_data
+from utils import DailyProfile, detect_daily_anomalies, detect_prolonged_anomalies
+
+
+def customer_anomaly_documents(*customer_id):
+    df, weather_df, _ = generate_smart_meter_data(days=90, seed=8)
+    profile = DailyProfile(df, weather_df)
+    table = anomaly_table(profile, detect_daily_anomalies(profile), detect_prolonged_anomalies(profile))
+    return anomaly_documents(table, *customer_id)
+
+
+def test_documents_default_to_the_customer_of_the_anomaly_documents():
+    documents = load_customer_documents()
+    anomalies = customer_anomaly_documents()
+    assert {doc.metadata["customer_id"] for doc in documents + anomalies} == {DEFAULT_METER}
+
+
+def test_documents_without_a_customer_have_no_customer_id():
+    documents = load_customer_documents(customer_id=None) + customer_anomaly_documents(None)
+    assert all("customer_id" not in doc.metadata for doc in documents)
+    # no customer filter matches them, not even the string "None"
+    retriever = NumpyRetriever.from_documents(documents, customer_id="None")
+    assert retriever.invoke("energy usage") == []
+
+
+def test_customer_filter_returns_both_document_sets(monkeypatch):
+    monkeypatch.setenv("RETRIEVER_BM25_WEIGHT", "1")
+    retriever = build_customer_retriever(
+        extra_documents=customer_anomaly_documents("42") + customer_anomaly_documents("7"),
+        customer_id="42",
+        k=100,
+    )
+    sections = {doc.metadata["section"] for doc in retriever.invoke("energy usage anomalies chat bill")}
+    assert "anomaly_table" in sections and len(sections) > 1
+    assert {doc.metadata["customer_id"] for doc in retriever.invoke("energy usage anomalies")} == {"42"}
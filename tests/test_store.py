@@ -0,0 +1,81 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import store
+from store import build_store, load_columnar, store_path
+from synthetic_data import generate_smart_meter_data
+
+
+@pytest.fixture(autouse=True)
+def store_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(store, "STORE_DIR", str(tmp_path / "store"))
+    return tmp_path / "store"
+
+
+def write_readings(path, seed, days=5):
+    df, _, _ = generate_smart_meter_data(days=days, freq="1h", seed=seed)
+    path.parent.mkdir(exist_ok=True)
+    df.to_csv(path)
+    return df
+
+
+def as_stored(df):
+    """The readings as the store returns them, float32 with a nanosecond index."""
+    df = df.astype(np.float32)
+    df.index = df.index.as_unit("ns")
+    return df
+
+
+def test_round_trips_the_csv(tmp_path):
+    path = tmp_path / "usage.csv"
+    df = write_readings(path, seed=0)
+    for _ in range(2):
+        # built on the first load, read from the store on the second
+        pd.testing.assert_frame_equal(load_columnar(str(path)), as_stored(df), check_freq=False)
+
+
+def test_round_trips_each_meter(tmp_path):
+    df, _, _ = generate_smart_meter_data(days=5, n_meters=3, freq="1h", seed=1)
+    rows = df.melt(var_name="meter_id", value_name="usage", ignore_index=False)
+    path = tmp_path / "meters.csv"
+    rows.sample(frac=1, random_state=0).to_csv(path)
+    for meter_id in df.columns:
+        loaded = load_columnar(str(path), meter_id, meter_column="meter_id")
+        expected = as_stored(df[[meter_id]].rename(columns={meter_id: "usage"}))
+        pd.testing.assert_frame_equal(loaded, expected, check_freq=False, check_names=False)
+
+
+def test_files_of_the_same_name_have_their_own_store(tmp_path):
+    first = write_readings(tmp_path / "a" / "usage.csv", seed=2)
+    second = write_readings(tmp_path / "b" / "usage.csv", seed=3)
+    assert store_path(str(tmp_path / "a" / "usage.csv")) != store_path(str(tmp_path / "b" / "usage.csv"))
+    for df, directory in [(first, "a"), (second, "b"), (first, "a")]:
+        loaded = load_columnar(str(tmp_path / directory / "usage.csv"))
+        pd.testing.assert_frame_equal(loaded, as_stored(df), check_freq=False)
+
+
+def test_rebuilds_after_the_csv_changes(tmp_path, store_dir):
+    path = tmp_path / "usage.csv"
+    write_readings(path, seed=4)
+    load_columnar(str(path))
+    old_dir = store_path(str(path))
+
+    changed = write_readings(path, seed=5, days=6)
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    pd.testing.assert_frame_equal(load_columnar(str(path)), as_stored(changed), check_freq=False)
+    # the store of the earlier version is removed, and no temporary files are left behind
+    assert not os.path.exists(old_dir)
+    assert os.listdir(store_dir) == [os.path.basename(store_path(str(path)))]
+    assert not [name for name in os.listdir(store_path(str(path))) if name.endswith(".tmp")]
+
+
+def test_store_in_a_given_directory(tmp_path):
+    path = tmp_path / "usage.csv"
+    df = write_readings(path, seed=6)
+    built = build_store(str(path), str(tmp_path / "elsewhere"))
+    assert built.meters == ["default"]
+    pd.testing.assert_frame_equal(built.to_frame(), as_stored(df), check_freq=False)
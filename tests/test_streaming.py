@@ -0,0 +1,46 @@
+import numpy as np
+import pandas as pd
+
+from streaming import StreamingAnomalyDetector
+from synthetic_data import generate_smart_meter_data
+from utils import detect_daily_anomalies, detect_prolonged_anomalies
+
+
+def stream(detector, usage):
+    events = []
+    for timestamp, value in usage.items():
+        events += detector.update(timestamp, value)
+    return events
+
+
+def test_prolonged_anomaly_is_reported_once():
+    index = pd.date_range("2024-01-01", periods=60 * 24, freq="h")
+    usage = pd.Series(np.random.default_rng(0).uniform(0.9, 1.1, len(index)), index=index)
+    usage["2024-02-10":"2024-02-16"] *= 3
+    events = stream(StreamingAnomalyDetector(), usage)
+
+    prolonged = [event for event in events if event.kind.startswith("prolonged")]
+    assert [event.kind for event in prolonged] == ["prolonged", "prolonged_end"]
+    opened, closed = prolonged
+    assert opened.end == pd.Timestamp("2024-02-10")
+    assert closed.start <= opened.start
+    # the episode is closed on the first day without an anomalous window ending on it, and lies within the
+    # batch window over the readings up to that day
+    ((start, end),) = detect_prolonged_anomalies(
+        usage[usage.index < closed.end + pd.Timedelta(days=2)].to_frame("usage")
+    )
+    assert start <= closed.start and closed.end == end
+
+
+def test_history_matches_batch_after_checkpoint():
+    df, _, _ = generate_smart_meter_data(days=90, seed=6)
+    detector = StreamingAnomalyDetector()
+    events = stream(detector, df["usage"][: len(df) // 2])
+    detector = StreamingAnomalyDetector.from_dict(detector.to_dict())
+    events += stream(detector, df["usage"][len(df) // 2 :])
+
+    assert list(detector.daily_anomalies()) == list(detect_daily_anomalies(df))
+    assert detector.prolonged_anomalies() == detect_prolonged_anomalies(df)
+    # every prolonged event is matched by the end of its episode, apart from one still open
+    kinds = [event.kind for event in events if event.kind != "daily"]
+    assert kinds.count("prolonged") - kinds.count("prolonged_end") == (detector.open_window is not None)
@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+from fleet import detect_fleet_anomalies, prolonged_anomaly_coverage
+from sweep import sweep_thresholds
+from synthetic_data import generate_smart_meter_data
+from utils import prolonged_anomaly_windows
+
+
+@pytest.mark.parametrize("min_consecutive_days", [2, 3, 6])
+def test_coverage_matches_prolonged_anomaly_windows(min_consecutive_days):
+    rng = np.random.default_rng(min_consecutive_days)
+    # tied integer z-scores, and a constant meter with NaN z-scores
+    zscores = rng.integers(-1, 4, (60, 40)).astype(float)
+    zscores[:, 0] = np.nan
+    coverage = prolonged_anomaly_coverage(zscores, min_consecutive_days, 1.0)
+    for meter in range(zscores.shape[1]):
+        expected = np.zeros(len(zscores), dtype=bool)
+        for start, end in zip(
+            *prolonged_anomaly_windows(zscores[:, meter], min_consecutive_days, 1.0), strict=True
+        ):
+            expected[start : end + 1] = True
+        np.testing.assert_array_equal(coverage[:, meter], expected)
+
+
+def test_sweep_counts_match_fleet_detection():
+    df, _, _ = generate_smart_meter_data(days=90, n_meters=12, freq="1h", seed=5)
+    df["meter_constant"] = 1.0
+    daily_thresholds = [1.5, 2.0, 2.5]
+    zscore_thresholds = [0.5, 1.0, 1.5]
+    lengths = [2, 3, 5]
+    daily_table, prolonged_table = sweep_thresholds(
+        df,
+        daily_thresholds=daily_thresholds,
+        zscore_thresholds=zscore_thresholds,
+        min_consecutive_days=lengths,
+        meter_chunk_size=5,
+    )
+
+    for row in daily_table.itertuples():
+        anomalies = detect_fleet_anomalies(df, daily_zscore_threshold=row.zscore_threshold)
+        daily = anomalies[anomalies["kind"] == "daily"]
+        assert row.anomaly_days == len(daily)
+        assert row.meters == daily["meter_id"].nunique()
+
+    for row in prolonged_table.itertuples():
+        anomalies = detect_fleet_anomalies(
+            df, min_consecutive_days=row.min_consecutive_days, zscore_threshold=row.zscore_threshold
+        )
+        prolonged = anomalies[anomalies["kind"] == "prolonged"]
+        assert row.anomalies == len(prolonged)
+        assert row.anomaly_days == ((prolonged["end"] - prolonged["start"]).dt.days + 1).sum()
+        assert row.meters == prolonged["meter_id"].nunique()
@@ -0,0 +1,41 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from synthetic_data import generate_smart_meter_data
+from utils import weather_window_stats
+
+
+@pytest.fixture
+def weather_df():
+    _, weather_df, _ = generate_smart_meter_data(days=60, freq="1h", seed=4)
+    # days without a temperature, and a day missing from the file
+    weather_df.loc["2024-08-05", "temperature"] = np.nan
+    weather_df.loc["2024-08-20":"2024-08-22", "temperature"] = np.nan
+    return weather_df.drop(weather_df.loc["2024-09-01"].index)
+
+
+@pytest.mark.parametrize("base_temperature", [None, 15.5])
+def test_window_stats_match_per_window_indexing(weather_df, base_temperature):
+    df_daily = weather_df.resample("D").mean()
+    rng = np.random.default_rng(0)
+    # windows inside the data, over the missing days, past both ends and single days
+    starts = df_daily.index[0] + pd.to_timedelta(rng.integers(-5, 65, 200), unit="D")
+    ends = starts + pd.to_timedelta(rng.integers(0, 10, 200), unit="D")
+    table = weather_window_stats(weather_df, starts, ends, base_temperature)
+
+    for row in table.itertuples():
+        window = df_daily.loc[row.start : row.end, "temperature"].dropna()
+        assert row.days == len(window)
+        np.testing.assert_allclose(
+            [row.mean_temperature, row.min_temperature, row.max_temperature],
+            [window.mean(), window.min(), window.max()],
+        )
+        if base_temperature is not None:
+            np.testing.assert_allclose(
+                [row.heating_degree_days, row.cooling_degree_days],
+                [
+                    (base_temperature - window).clip(lower=0).sum(),
+                    (window - base_temperature).clip(lower=0).sum(),
+                ],
+            )